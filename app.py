@@ -1,69 +1,16 @@
 # streamlit_app.py
-import math
-import random
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Any
 
 import pandas as pd
 import streamlit as st
 
-st.set_page_config(page_title="CoC6 能力値振りツール", layout="wide", initial_sidebar_state="expanded")
+from dicetool import (
+    ABILS, DERIVED_KEYS, ALL_KEYS_FOR_RULE, ROLL_SPEC, WARN_MIN, WARN_MAX,
+    roll_for, damage_bonus, derived_stats, total_score,
+)
+from dicetool import records, rules
 
-# =========================
-# 定数・ユーティリティ
-# =========================
-ABILS = ["STR", "CON", "POW", "DEX", "APP", "SIZ", "INT", "EDU"]
-DERIVED_KEYS = ["HP", "MP", "SAN", "アイデア", "幸運", "知識", "職業P", "興味P"]
-ALL_KEYS_FOR_RULE = ABILS + DERIVED_KEYS + ["TOTAL"]
-
-ROLL_SPEC = {  # (UI表記, 固定加算)
-    "STR": ("3d6", 0),  "CON": ("3d6", 0),  "POW": ("3d6", 0),
-    "DEX": ("3d6", 0),  "APP": ("3d6", 0),
-    "SIZ": ("2d6+6", 6), "INT": ("2d6+6", 6), "EDU": ("3d6+3", 3),
-}
-
-WARN_MIN = {k: 3 for k in ABILS}
-WARN_MAX = {k: 18 for k in ABILS}  # 警告のみ（ブロックしない）
-
-def round_half_up(x: float) -> int:
-    return int(math.floor(x + 0.5))
-
-def roll_nd6(n: int) -> Tuple[int, List[int]]:
-    dice = [random.randint(1, 6) for _ in range(n)]
-    return sum(dice), dice
-
-def roll_for(stat: str) -> Tuple[int, List[int], int]:
-    """戻り: (素の合計=出目合計+固定加算, 出目配列, 固定加算)"""
-    spec, add = ROLL_SPEC[stat]
-    if spec.startswith("3d6"):
-        s, dice = roll_nd6(3)
-    elif spec.startswith("2d6"):
-        s, dice = roll_nd6(2)
-    else:
-        raise ValueError("Unknown dice spec")
-    return s + add, dice, add
-
-def damage_bonus(str_val: int, siz_val: int) -> str:
-    total = str_val + siz_val
-    if 2 <= total <= 12:  return "-1D6"
-    if 13 <= total <= 16: return "-1D4"
-    if 17 <= total <= 24: return "+0"
-    if 25 <= total <= 32: return "+1D4"
-    if 33 <= total <= 40: return "+1D6"
-    if total < 2:        return "-1D6"
-    extra = (total - 33) // 8
-    return f"+{extra+1}D6"
-
-def derived_stats(stats: Dict[str, int]) -> Dict[str, int]:
-    CON = stats["CON"]; SIZ = stats["SIZ"]; POW = stats["POW"]; INT = stats["INT"]; EDU = stats["EDU"]
-    HP = round_half_up((CON + SIZ) / 2)
-    return {
-        "HP": HP, "MP": POW, "SAN": POW * 5,
-        "アイデア": INT * 5, "幸運": POW * 5, "知識": EDU * 5,
-        "職業P": EDU * 20, "興味P": INT * 10,
-    }
-
-def total_score(stats: Dict[str, int]) -> int:
-    return sum(stats[a] for a in ABILS)
+st.set_page_config(page_title="CoC6 能力値振りツール", layout="wide", initial_sidebar_state="expanded")
 
 # =========================
 # セッション初期化
@@ -110,32 +57,11 @@ def make_record(finals: Dict[str, int],
                 base_vals: Dict[str, int],
                 detail: Dict[str, List[int]],
                 adds: Dict[str, int]) -> Dict[str, Any]:
-    rec = {
-        **finals,
-        "TOTAL": total_score(finals),
-        **derived_stats(finals),
-        "_base": base_vals, "_detail": detail, "_adds": adds,
-        "_mods": dict(st.session_state.modifiers),
-        "_apply_mod": apply_mod,
-    }
-    return rec
+    return records.make_record(finals, base_vals, detail, adds, st.session_state.modifiers, apply_mod)
 
 def auto_fav_ok(rec: Dict[str, Any]) -> bool:
-    if not st.session_state.auto_fav_enabled:
-        return False
-    flags: List[bool] = []
-    for k in ALL_KEYS_FOR_RULE:
-        v = int(rec[k])
-        vmin = st.session_state.auto_min.get(k)
-        vmax = st.session_state.auto_max.get(k)
-        if (vmin is not None) or (vmax is not None):
-            ok = True
-            if vmin is not None: ok = ok and (v >= int(vmin))
-            if vmax is not None: ok = ok and (v <= int(vmax))
-            flags.append(ok)
-    if not flags:
-        return False
-    return all(flags) if st.session_state.auto_fav_mode == "AND" else any(flags)
+    return rules.auto_fav_ok(rec, st.session_state.auto_fav_enabled, st.session_state.auto_fav_mode,
+                             st.session_state.auto_min, st.session_state.auto_max)
 
 def history_append(rec: Dict[str, Any]):
     st.session_state.history.insert(0, rec)
@@ -405,7 +331,7 @@ with st.expander("履歴（並べ替え・採用・★チェック）", expanded
             # 並べ替え後でもIDで history を参照できるように
             target = st.session_state.history[hid]
             finals = {a: int(target[a]) for a in ABILS}
-            basev  = target.get("_base", {a: finals[a] - (target.get("_mods", {}).get(a, 0) if target.get("_apply_mod", True) else 0) for a in ABILS})
+            basev  = records.record_base(target)
             st.session_state.current_stats  = finals
             st.session_state.current_base   = basev
             st.session_state.current_detail = target.get("_detail", {a: [] for a in ABILS})
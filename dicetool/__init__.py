@@ -0,0 +1,18 @@
+"""CoC6 能力値ツールのコア（UI非依存）
+
+Streamlit / pandas を import しないので、バッチ処理・ベンチマーク・他ツールから
+軽量に読み込めます。UI（streamlit_app.py / app.py）はこのパッケージの薄いビューです。
+"""
+from .rules import (
+    ABILS, DERIVED_KEYS, ALL_KEYS_FOR_RULE, ROLL_SPEC, WARN_MIN, WARN_MAX,
+    round_half_up, damage_bonus, derived_stats, total_score, auto_fav_ok,
+)
+from .engine import roll_nd6, roll_for, roll_effective
+from .records import make_record, record_base
+
+__all__ = [
+    "ABILS", "DERIVED_KEYS", "ALL_KEYS_FOR_RULE", "ROLL_SPEC", "WARN_MIN", "WARN_MAX",
+    "round_half_up", "damage_bonus", "derived_stats", "total_score", "auto_fav_ok",
+    "roll_nd6", "roll_for", "roll_effective",
+    "make_record", "record_base",
+]
@@ -0,0 +1,346 @@
+"""HTTP API（ボットや VTT 連携から能力値を振る。画面と同じダイスエンジン）
+
+  python -m dicetool.api --port 8000            … 起動（uvicorn dicetool.api:app でも可）
+
+エンドポイント（POST の本文は JSON。どれも省略可能な共通の設定を取る）:
+  GET  /health     … 能力とダイス式
+  POST /roll       … 1 セット
+  POST /batch      … n セット（expr で絞り込み可）。n が JSON_MAX を超えるか stream=true なら NDJSON で流す
+  POST /generate   … 条件（expr / auto_min・auto_max・mode）を満たすセットを n 件そろうまで振る
+                     （出ない条件・期待されるセット数が max_rolls を超える条件は振らずに 400）
+  POST /odds       … 条件を満たす確率（表だけなら厳密値）と、keys の各項目の分布・ダメージボーナスの分布
+  POST /gacha      … kind = country / prefecture / gender を n 回（weighted=true なら国は日本寄り、
+                     population=true なら県は人口比）。kind = profile は n 人分の出身国・出身県・性別
+                     （unique_prefecture=true なら party_size 人ずつの組の中で県が重ならない）
+  POST /party      … pool セット振って、keys（既定 TOTAL / HP / 職業P / SAN）の差が最も小さい k 人
+                     （bands {"TOTAL": 4} で差の上限、members で 1 人ずつの条件式、prefer = high / mid / low）
+共通の設定:
+  fixed_values {"STR": 12, ...}（0〜99）  modifiers {"EDU": -2, ...}（-128〜127）  apply_mod true
+  seed（省略時は新しいシード）
+レコードはエクスポートの JSON Lines と同じ形（records.make_record と同じキー。_uid は 1 からの行番号）で、
+_seed/_offset から batch.replay で同じ出目を作り直せます。応答の seed を次のリクエストに渡せば同じ結果になります。
+
+振る処理はスレッドプールで行い、イベントループを止めません。NDJSON は STREAM_CHUNK セットずつ振っては
+書き出すので、何百万セットでもメモリはチャンク 1 つ分です。
+入力の誤りは 400（{"error": "..."}）です。starlette と uvicorn が必要です（なければ ImportError）。
+負荷試験は python -m dicetool.loadtest です。
+"""
+import argparse
+import json
+import math
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+try:
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+except ImportError as e:   # pragma: no cover - 環境依存
+    raise ImportError("dicetool.api には starlette が必要です（pip install starlette uvicorn）") from e
+
+import numpy as np
+
+from . import batch, export, gacha, odds, party, sampler
+from .rng import SEED_BITS, RollStream, SessionRNG
+from .rules import ABILS, ALL_KEYS_FOR_RULE, ROLL_SPEC
+from .ruleexpr import RuleSyntaxError, combined_source, compile_rule
+from .store import batch_rows
+
+JSON_MAX = 10_000            # JSON で返す最大セット数（これを超えると NDJSON）
+STREAM_MAX = 10_000_000      # /batch の最大セット数
+STREAM_CHUNK = 20_000        # NDJSON で 1 回に振るセット数
+MAX_ROLLS = 50_000_000       # /generate で振る最大セット数（1 リクエストの時間の上限）
+PARTY_POOL_MAX = 1_000_000   # /party の候補の最大セット数
+MOD_RANGE = (-128, 127)      # モディファイア（int8 で持つ）
+FIXED_RANGE = (0, 99)        # 固定値（画面の入力欄と同じ範囲）
+VALUE_RANGE = (-10 ** 9, 10 ** 9)   # 条件の下限/上限・ばらつきの上限
+NDJSON = "application/x-ndjson"
+
+
+class ApiError(ValueError):
+    """リクエストの誤り（400）"""
+
+
+# =========================
+# 入力
+# =========================
+def _int(body: Dict[str, Any], key: str, default: int, lo: int, hi: int) -> int:
+    v = body.get(key, default)
+    if isinstance(v, bool) or not isinstance(v, int) or not lo <= v <= hi:
+        raise ApiError(f"{key} は {lo}〜{hi} の整数です")
+    return v
+
+
+def _bool(body: Dict[str, Any], key: str, default: bool) -> bool:
+    v = body.get(key, default)
+    if not isinstance(v, bool):
+        raise ApiError(f"{key} は true / false です")
+    return v
+
+
+def _abil_map(body: Dict[str, Any], key: str, lo: int, hi: int, keys=ABILS,
+              allow_none: bool = False) -> Dict[str, Any]:
+    m = body.get(key) or {}
+    if not isinstance(m, dict):
+        raise ApiError(f"{key} はオブジェクトです")
+    for k, v in m.items():
+        if k not in keys:
+            raise ApiError(f"{key} の {k} は項目にありません（{', '.join(keys)}）")
+        if allow_none and v is None:
+            continue
+        if isinstance(v, bool) or not isinstance(v, int) or not lo <= v <= hi:
+            raise ApiError(f"{key}.{k} は {lo}〜{hi} の整数です")
+    return m
+
+
+def _settings(body: Dict[str, Any]) -> Dict[str, Any]:
+    """共通の設定（固定値・モディファイア・適用）"""
+    apply_mod = _bool(body, "apply_mod", True)
+    return {"fixed_values": _abil_map(body, "fixed_values", *FIXED_RANGE, allow_none=True),
+            "modifiers": _abil_map(body, "modifiers", *MOD_RANGE), "apply_mod": apply_mod}
+
+
+def _seed(body: Dict[str, Any]) -> Optional[int]:
+    return None if body.get("seed") is None else _int(body, "seed", 0, 0, 2 ** SEED_BITS - 1)
+
+
+def _condition(body: Dict[str, Any], required: bool) -> Optional[Dict[str, Any]]:
+    """条件（自動お気に入りと同じ mode / auto_min / auto_max / expr。なければ None）"""
+    mode = body.get("mode", "AND")
+    if mode not in ("AND", "OR"):
+        raise ApiError("mode は AND / OR です")
+    expr = body.get("expr") or ""
+    if not isinstance(expr, str):
+        raise ApiError("expr は文字列です")
+    cond = {"mode": mode, "auto_min": _abil_map(body, "auto_min", *VALUE_RANGE, ALL_KEYS_FOR_RULE, True),
+            "auto_max": _abil_map(body, "auto_max", *VALUE_RANGE, ALL_KEYS_FOR_RULE, True), "expr": expr.strip()}
+    src = combined_source(**cond)
+    if src is None:
+        if required:
+            raise ApiError("条件（expr か auto_min / auto_max）が必要です")
+        return None
+    compile_rule(src)   # 構文エラーはここで 400
+    return cond
+
+
+async def _body(request: Request) -> Dict[str, Any]:
+    if request.method == "GET":
+        return {}
+    raw = await request.body()
+    if not raw.strip():
+        return {}
+    try:
+        body = json.loads(raw)
+    except ValueError as e:
+        raise ApiError(f"本文が JSON ではありません: {e}") from e
+    if not isinstance(body, dict):
+        raise ApiError("本文は JSON オブジェクトです")
+    return body
+
+
+def _lines(rb: batch.RollBatch, rows, settings: Dict[str, Any], uid_start: int) -> List[str]:
+    """RollBatch の行 → JSON Lines の各行（エクスポートと同じ形）"""
+    return list(export.jsonl_chunk(batch_rows(rb, rows, settings["modifiers"], settings["apply_mod"], uid_start)))
+
+
+def _finite(v: float) -> Optional[float]:
+    """JSON に書ける数（inf / NaN は null。JSON には Infinity がない）"""
+    return v if math.isfinite(v) else None
+
+
+def _json(head: Dict[str, Any], lines: List[str]) -> Response:
+    """head に records（エンコード済みの行）を足した JSON（レコードをエンコードし直さない）"""
+    text = json.dumps(head, ensure_ascii=False, allow_nan=False)[:-1] + ', "records": [' + ", ".join(lines) + "]}"
+    return Response(text, media_type="application/json")
+
+
+def endpoint(fn):
+    """本文を読んで fn(body) を呼び、ApiError / 条件式の誤りを 400 にする"""
+    async def handler(request: Request):
+        try:
+            return await fn(await _body(request), request)
+        except (ApiError, RuleSyntaxError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    handler.__name__ = fn.__name__
+    return handler
+
+
+# =========================
+# エンドポイント
+# =========================
+@endpoint
+async def health(body, request):
+    return JSONResponse({"ok": True, "abilities": ABILS, "roll_spec": {a: ROLL_SPEC[a][0] for a in ABILS}})
+
+
+@endpoint
+async def roll(body, request):
+    settings, rng = _settings(body), RollStream(_seed(body))
+
+    def work():
+        rb = batch.roll_batch(1, rng=rng, **settings)
+        return _lines(rb, [0], settings, 1)[0]
+
+    return Response(await run_in_threadpool(work), media_type="application/json")
+
+
+@endpoint
+async def roll_many(body, request):
+    settings, rng = _settings(body), RollStream(_seed(body))
+    n = _int(body, "n", 1, 1, STREAM_MAX)
+    cond = _condition(body, required=False)
+    rule = compile_rule(combined_source(**cond)) if cond else None
+    stream = _bool(body, "stream", False) or NDJSON in request.headers.get("accept", "") or n > JSON_MAX
+
+    def chunk(size: int, uid_start: int) -> List[str]:
+        rb = batch.roll_batch(size, rng=rng, **settings)
+        rows = np.arange(size) if rule is None else rule.mask(batch.columns(rb.finals)).nonzero()[0]
+        return _lines(rb, rows, settings, uid_start)
+
+    if not stream:
+        lines = await run_in_threadpool(chunk, n, 1)
+        return _json({"seed": rng.seed, "rolled": n, "kept": len(lines)}, lines)
+
+    async def gen() -> AsyncIterator[str]:
+        for start in range(0, n, STREAM_CHUNK):
+            lines = await run_in_threadpool(chunk, min(STREAM_CHUNK, n - start), start + 1)
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(gen(), media_type=NDJSON, headers={"X-Seed": str(rng.seed)})
+
+
+@endpoint
+async def generate(body, request):
+    settings, rng = _settings(body), RollStream(_seed(body))
+    n = _int(body, "n", 1, 1, JSON_MAX)
+    max_rolls = _int(body, "max_rolls", MAX_ROLLS, 1, MAX_ROLLS)
+    cond = _condition(body, required=True)
+
+    def work():
+        # 先に合格率を見て、出ない・max_rolls で足りない条件は振らずに断る（式ならパイロットロールの推定）
+        p, exact = sampler.acceptance(**cond, **settings)
+        if p <= 0:
+            raise ApiError("条件を満たすセットは出ません（確率 0" + ("）" if exact else "。推定値）"))
+        if n / p > max_rolls:
+            raise ApiError(f"条件が厳しすぎます（{n} 件に期待値 {n / p:,.0f} セット。max_rolls は {max_rolls:,}）")
+        try:
+            res = sampler.roll_until(n, rng=rng, max_rolls=max_rolls, **cond, **settings)
+        except ValueError as e:
+            raise ApiError(str(e)) from e
+        return res, _lines(res.batch, range(len(res.batch.finals)), settings, 1)
+
+    res, lines = await run_in_threadpool(work)
+    return _json({"seed": rng.seed, "rolled": res.rolled, "p": res.p, "exact": res.exact,
+                  "expected_rolls": _finite(res.expected_rolls), "complete": len(lines) == n}, lines)
+
+
+@endpoint
+async def odds_(body, request):
+    settings = _settings(body)
+    keys = body.get("keys") or []
+    if not isinstance(keys, list) or any(k not in ALL_KEYS_FOR_RULE for k in keys):
+        raise ApiError(f"keys は項目のリストです（{', '.join(ALL_KEYS_FOR_RULE)}）")
+    cond = _condition(body, required=False)
+
+    def work():
+        out: Dict[str, Any] = {}
+        if cond is not None:   # 表だけの条件は厳密値、式を含むとパイロットロールの推定値
+            p, exact = sampler.acceptance(**cond, **settings)
+            out.update({"p": p, "exact": exact})
+        out["dist"] = {k: odds.key_dist(k, **settings) for k in keys}
+        out["db"] = odds.db_dist(**settings)
+        return out
+
+    return JSONResponse(await run_in_threadpool(work))
+
+
+@endpoint
+async def find_party(body, request):
+    settings, rng = _settings(body), RollStream(_seed(body))
+    k = _int(body, "k", 5, 1, 100)
+    pool = _int(body, "pool", party.POOL, 1, PARTY_POOL_MAX)
+    keys = body.get("keys", party.PARTY_KEYS)
+    if not isinstance(keys, list) or not keys:
+        raise ApiError("keys は 1 つ以上の項目のリストです")
+    bands = _abil_map(body, "bands", 0, VALUE_RANGE[1], keys)
+    members = body.get("members") or ""
+    if not isinstance(members, str):
+        raise ApiError("members は文字列です")
+    prefer = body.get("prefer", "high")
+
+    def work():
+        try:
+            rb, found = party.balanced_party(k, pool, rng=rng, keys=keys, bands=bands, members=members,
+                                             prefer=prefer, **settings)
+        except RuleSyntaxError:
+            raise
+        except ValueError as e:   # 項目の誤り・条件に合う組がない
+            raise ApiError(str(e)) from e
+        return found, _lines(rb, found.rows, settings, 1)
+
+    found, lines = await run_in_threadpool(work)
+    return _json({"seed": rng.seed, "pool": pool, "candidates": found.candidates, "spread": found.spread,
+                  "ranges": found.ranges}, lines)
+
+
+GACHA = {   # kind → 抽選表（weighted / population で選ぶ）
+    "country": lambda body: gacha.country_table(body.get("weighted", True)),
+    "prefecture": lambda body: gacha.prefecture_table(body.get("population", False)),
+    "gender": lambda body: gacha.GENDER_TABLE,
+}
+
+
+@endpoint
+async def draw(body, request):
+    kind = body.get("kind", "country")
+    if kind not in GACHA and kind != "profile":
+        raise ApiError(f"kind は {' / '.join(GACHA)} / profile です")
+    for key in ("weighted", "population", "unique_prefecture"):
+        _bool(body, key, False)
+    n = _int(body, "n", 1, 1, JSON_MAX)
+    rng = SessionRNG(_seed(body))
+    if kind != "profile":
+        table = GACHA[kind](body)
+        return JSONResponse({"seed": rng.seed, "kind": kind, "draws": table.labels(table.sample(rng.gacha, n))})
+    party_size = _int(body, "party_size", n, 1, JSON_MAX)
+    try:
+        cols = gacha.profiles(rng.gacha, n, body.get("weighted", True), body.get("population", False),
+                              body.get("unique_prefecture", False), party_size)
+    except ValueError as e:
+        raise ApiError(str(e)) from e
+    return JSONResponse({"seed": rng.seed, "kind": kind, "party_size": party_size,
+                         "draws": [dict(zip(gacha.PROFILE_KEYS, row)) for row in zip(*cols.values())]})
+
+
+def create_app() -> Starlette:
+    return Starlette(routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/roll", roll, methods=["GET", "POST"]),
+        Route("/batch", roll_many, methods=["POST"]),
+        Route("/generate", generate, methods=["POST"]),
+        Route("/odds", odds_, methods=["POST"]),
+        Route("/gacha", draw, methods=["GET", "POST"]),
+        Route("/party", find_party, methods=["POST"]),
+    ])
+
+
+app = create_app()
+
+
+def main(argv: Optional[List[str]] = None):
+    import uvicorn
+
+    p = argparse.ArgumentParser(prog="python -m dicetool.api", description="能力値の HTTP API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--workers", type=int, default=1, help="プロセス数")
+    p.add_argument("--log-level", default="warning")
+    args = p.parse_args(argv)
+    uvicorn.run("dicetool.api:app", host=args.host, port=args.port, workers=args.workers,
+                log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
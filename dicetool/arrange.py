@@ -0,0 +1,133 @@
+"""出目の自動配置（振った値を能力に割り振り直して、スコア式を最大にする）
+
+振った値は「どのダイス式で出た値か」を保ったまま動かします。入れ替えられるのは ROLL_SPEC の式が
+同じ能力どうし（既定なら 3d6 の STR/CON/POW/DEX/APP、2d6+6 の SIZ/INT、3d6+3 の EDU は動かない）で、
+固定値の能力（出目のない能力）は動かしません。モディファイアは能力の側に残ります。
+
+8! = 40320 通りを全部試すのではなく、
+  - スコア式が参照する能力（派生値は元の能力、HP は CON/SIZ。TOTAL は並べ替えで変わらないので
+    参照なし）だけに、同じ式の値のどれを割り当てるかを列挙し、残りの値は元の順で残りの
+    能力へ入れる（参照しない能力にどの値が行くかはスコアに影響しないので区別しない。値を取られなかった
+    能力はそのまま）
+  - 候補の表は (式の組, 参照する能力) ごとに lru_cache する
+ので、候補は多くても 5!·2! = 240 通り、職業P+興味P なら 2 通り、HP なら 10 通りです。
+ダメージボーナスは STR+SIZ が大きいほど上の区分なので、STR + SIZ を最大にします（DB は比較専用の項目）。
+候補ごとにバッチ全行のスコアを列でまとめて計算するので、まとめ振りの全行に適用できます。
+同点なら元の並び（動かさない方）を選びます。スコア式が 0 で割る並びはスコア -inf（ruleexpr.Score）なので、
+選ばれるのはほかに並びがないときだけです。
+"""
+from functools import lru_cache
+from itertools import permutations, product
+from typing import Dict, FrozenSet, Optional, Tuple
+
+import numpy as np
+
+from . import batch
+from .odds import DERIVED_FROM
+from .rng import NO_OFFSET
+from .rules import ABILS, ROLL_SPEC
+from .ruleexpr import compile_score
+
+N_ABILS = len(ABILS)
+
+# スコア式の項目 → 値を決める能力
+SOURCES: Dict[str, Tuple[str, ...]] = {
+    **{a: (a,) for a in ABILS},
+    **{k: (src,) for k, (src, _mul) in DERIVED_FROM.items()},
+    "HP": ("CON", "SIZ"), "TOTAL": (),
+}
+
+
+def relevant(score: str) -> FrozenSet[int]:
+    """スコア式が参照する能力の列番号（知らない項目があれば全能力）"""
+    names = compile_score(score).names
+    if not names <= SOURCES.keys():
+        return frozenset(range(N_ABILS))
+    return frozenset(ABILS.index(a) for n in names for a in SOURCES[n])
+
+
+def spec_groups(rolled) -> Tuple[Tuple[int, ...], ...]:
+    """値を入れ替えられる能力の組（rolled: 能力ごとの出目の有無。今の ROLL_SPEC の式ごと）"""
+    groups: Dict[str, list] = {}
+    for c, a in enumerate(ABILS):
+        if rolled[c]:
+            groups.setdefault(ROLL_SPEC[a][0], []).append(c)
+    return tuple(tuple(g) for g in groups.values() if len(g) > 1)
+
+
+@lru_cache(maxsize=64)
+def candidates(groups: Tuple[Tuple[int, ...], ...], rel: FrozenSet[int]) -> np.ndarray:
+    """試す並べ替え (P, 8)。perm[p, 能力] = 値を持ってくる能力。先頭は元の並び"""
+    per_group = []
+    for slots in groups:
+        picked = [s for s in slots if s in rel]
+        if not picked:
+            continue
+        rest = [s for s in slots if s not in rel]
+        options = []
+        for src in permutations(slots, len(picked)):
+            # 参照しない能力は値を取られなければそのまま、取られたら余った値を元の順で入れる
+            emptied = [d for d in rest if d in src]
+            spare = [s for s in picked if s not in src]
+            options.append((picked + emptied, list(src) + spare))
+        per_group.append(options)
+    identity = list(range(N_ABILS))
+    out = [identity]
+    for combo in product(*per_group):
+        perm = list(identity)
+        for dst, src in combo:
+            for d, s in zip(dst, src):
+                perm[d] = s
+        if perm != identity:
+            out.append(perm)
+    return np.array(out, np.intp)
+
+
+def best_perms(base: np.ndarray, finals: np.ndarray, rolled: np.ndarray,
+               score: str) -> Tuple[np.ndarray, np.ndarray]:
+    """各行で score を最大にする並べ替え (n, 8) と、そのときのスコア (n,)
+
+    base/finals は (n, 8)、rolled は出目の有無 (n, 8) か全行共通の (8,)。
+    """
+    sc = compile_score(score)
+    rel = relevant(score)
+    n = len(base)
+    delta = finals.astype(np.int16) - base   # モディファイア（能力の側に残る）
+    rolled = np.broadcast_to(np.asarray(rolled, bool), (n, N_ABILS))
+    perms = np.broadcast_to(np.arange(N_ABILS), (n, N_ABILS)).copy()
+    best = np.asarray(sc.values(batch.columns(finals, sc.names)), np.float64).copy()
+
+    pattern = rolled @ (1 << np.arange(N_ABILS))   # 出目のある能力の組ごとに候補が違う
+    for pat in np.unique(pattern).tolist():
+        rows = np.flatnonzero(pattern == pat)
+        cand = candidates(spec_groups([(pat >> c) & 1 for c in range(N_ABILS)]), rel)
+        # 能力ごとに連続な (8, n) で持つと、並べ替えは行のコピーだけで済む
+        b, d = np.ascontiguousarray(base[rows].T), np.ascontiguousarray(delta[rows].T)
+        cur, choice = best[rows], np.zeros(len(rows), np.intp)
+        for p, perm in enumerate(cand[1:], 1):
+            s = np.asarray(sc.values(batch.columns((b[perm] + d).T, sc.names)), np.float64)
+            better = s > cur
+            cur[better] = s[better]
+            choice[better] = p
+        best[rows], perms[rows] = cur, cand[choice]
+    return perms, best
+
+
+def apply_perms(rb: batch.RollBatch, perms: np.ndarray) -> batch.RollBatch:
+    """RollBatch の各行を並べ替える（動かした行だけ offset を NO_OFFSET にする。動かさない行は作り直せる）"""
+    rows = np.arange(len(perms))[:, None]
+    base = rb.base[rows, perms]
+    finals = (base + (rb.finals - rb.base)).astype(rb.finals.dtype)
+    dice = None if rb.dice is None else rb.dice[rows, perms]
+    offsets = rb.offsets
+    if offsets is not None:
+        offsets = np.where((perms != np.arange(N_ABILS)).any(axis=1), NO_OFFSET, offsets)
+    return batch.RollBatch(finals, base, dice, rb.seed, offsets)
+
+
+def arrange_batch(rb: batch.RollBatch, score: str, rolled: Optional[np.ndarray] = None) -> Tuple[batch.RollBatch, int]:
+    """RollBatch の全行を自動配置する。rolled を省くと出目の有無から判断。戻り: (配置後, 動かした行数)"""
+    if rolled is None:
+        rolled = rb.dice.any(axis=2) if rb.dice is not None else np.ones(N_ABILS, bool)
+    perms, _best = best_perms(rb.base, rb.finals, rolled, score)
+    return apply_perms(rb, perms), int((perms != np.arange(N_ABILS)).any(axis=1).sum())
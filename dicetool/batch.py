@@ -0,0 +1,254 @@
+"""NumPy によるまとめ振り（N セットを一括生成）
+
+乱数は rng.RollStream の 64bit 語の列から取り、1 セット = stride 語の決まった区間を使います。
+語を 32bit に割った各スロットを (u * 大きさ) >> 32 で 0〜大きさ-1 に写し、
+  - 組み合わせ表（dice.compile_spec(...).table()）がある能力 … 1 スロットで表の行を引いて出目と合計を得る
+  - 表が大きすぎる式の能力 … ダイス 1 個に 1 スロット（DiceSpec.decode）
+とします（写像の偏りは 大きさ/2^32 以下で、既定の式なら 5e-8 程度）。
+セットごとに使う区間が決まっているので、レコードに残した (seed, offset) から replay で同じ出目を
+作り直せますし、区間ごとに分けて並列に振っても結果は同じです（ROLL_SPEC が同じ間に限る）。
+表は ROLL_SPEC の式の組ごとに 1 回だけ作られます（ROLL_SPEC を書き換えれば次の呼び出しから反映）。
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .dice import MAX_DICE, compile_spec
+from .records import make_record
+from .rng import NO_OFFSET, NO_SEED, RollStream, words_at
+from .rules import ABILS, ROLL_SPEC
+from .ruleexpr import combined_source, compile_rule
+
+DICE_WIDTH = MAX_DICE   # 出目配列の幅（ダイスが少ない式は末尾を 0 埋め）
+
+
+class _Tables(NamedTuple):
+    packed: np.ndarray            # 出目（DICE_WIDTH 個の int8 を uint32 に詰めたもの）を全能力分連結
+    sums: np.ndarray              # 合計（int16）を全能力分連結
+    offset: np.ndarray            # 表のある能力ごとの表の開始位置（table_cols の順）
+    table_cols: np.ndarray        # 表のある能力の列番号
+    sizes: Tuple[int, ...]        # 能力ごとの表の長さ（0 = 表なし、ダイスごとに振る）
+    slots: np.ndarray             # スロットごとの大きさ（int64）。表のある能力 → 表なしの能力のダイスの順
+    stride: int                   # 1 セットが使う 64bit 語の数
+    adds: np.ndarray              # 能力ごとの定数項（固定加算）
+
+
+def spec_key() -> Tuple[str, ...]:
+    """今の ROLL_SPEC の式（能力順）"""
+    return tuple(ROLL_SPEC[a][0] for a in ABILS)
+
+
+@lru_cache(maxsize=16)
+def _tables(specs: Tuple[str, ...]) -> _Tables:
+    compiled = [compile_spec(s) for s in specs]
+    tabs = [c.table() for c in compiled]
+    sizes = tuple(0 if t is None else len(t[0]) for t in tabs)
+    packed, sums, offset, pos = [], [], [], 0
+    for t, size in zip(tabs, sizes):
+        if t is None:
+            continue
+        dice = np.zeros((size, DICE_WIDTH), np.int8)
+        dice[:, :t[1].shape[1]] = t[1]
+        packed.append(dice.view(np.uint32).ravel())
+        sums.append(t[0])
+        offset.append(pos)
+        pos += size
+    slots = [s for s in sizes if s] + [r for c, s in zip(compiled, sizes) if not s for r in c.raw_sizes()]
+    return _Tables(np.concatenate(packed) if packed else np.zeros(0, np.uint32),
+                   np.concatenate(sums) if sums else np.zeros(0, np.int16),
+                   np.array(offset, dtype=np.int64),
+                   np.array([c for c, s in enumerate(sizes) if s], dtype=np.int64),
+                   sizes,
+                   np.array(slots, dtype=np.int64),
+                   max(1, (len(slots) + 1) // 2),
+                   np.array([c.const for c in compiled], dtype=np.int16))
+
+
+def spec_adds() -> np.ndarray:
+    """今の ROLL_SPEC での能力ごとの固定加算（2d6+6 なら 6）"""
+    return _tables(spec_key()).adds
+
+
+def stride() -> int:
+    """今の ROLL_SPEC で 1 セットが使う乱数の語数（RollStream.split の単位）"""
+    return _tables(spec_key()).stride
+
+
+class RollBatch(NamedTuple):
+    finals: np.ndarray   # (N, 8) 最終値（モディファイア適用後/無効時はベース値）
+    base: np.ndarray     # (N, 8) ベース値（出目合計+固定加算 or 固定値）
+    dice: Optional[np.ndarray]  # (N, 8, DICE_WIDTH) 出目（固定/ダイスが少ない式の空きは 0）。with_dice=False なら None
+    seed: int = NO_SEED                 # 乱数のシード（Generator で振ったときは NO_SEED）
+    offsets: Optional[np.ndarray] = None  # (N,) 各行が使った乱数の先頭位置（replay 用。NO_OFFSET の行は作り直せない）
+
+
+def _decode(tb: _Tables, words: np.ndarray, with_dice: bool) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """乱数の語 (n, stride) → ベース値（固定・モディファイア適用前）と出目"""
+    n = len(words)
+    u = np.ascontiguousarray(words, np.uint64).view(np.uint32)[:, :len(tb.slots)]
+    n_tab = len(tb.table_cols)
+    idx = np.multiply(u[:, :n_tab], tb.slots[:n_tab], dtype=np.int64)   # < 2^63 なので int64 で足りる
+    idx >>= 32
+    idx += tb.offset
+    if n_tab == len(ABILS):   # すべて表で引ける（既定の式）
+        base = tb.sums[idx]
+        dice = tb.packed[idx].view(np.int8).reshape(n, len(ABILS), DICE_WIDTH) if with_dice else None
+        return base, dice
+
+    base = np.zeros((n, len(ABILS)), np.int16)
+    dice = np.zeros((n, len(ABILS), DICE_WIDTH), np.int8) if with_dice else None
+    base[:, tb.table_cols] = tb.sums[idx]
+    if dice is not None:
+        dice[:, tb.table_cols] = tb.packed[idx].view(np.int8).reshape(n, n_tab, DICE_WIDTH)
+    j = n_tab
+    for c, size in enumerate(tb.sizes):
+        if size:
+            continue
+        spec = compile_spec(ROLL_SPEC[ABILS[c]][0])
+        k = j + spec.n_dice
+        raw = np.multiply(u[:, j:k], tb.slots[j:k], dtype=np.int64)
+        raw >>= 32
+        sums, d = spec.decode(raw)
+        base[:, c] = sums
+        if dice is not None:
+            dice[:, c, :d.shape[1]] = d
+        j = k
+    return base, dice
+
+
+def _finish(base: np.ndarray,
+            dice: Optional[np.ndarray],
+            fixed_values: Optional[Dict[str, Optional[int]]],
+            modifiers: Optional[Dict[str, int]],
+            apply_mod: bool,
+            seed: int,
+            offsets: Optional[np.ndarray]) -> RollBatch:
+    """固定値とモディファイアを適用して RollBatch にする"""
+    for c, abil in enumerate(ABILS):
+        fixed = (fixed_values or {}).get(abil)
+        if fixed is not None:
+            base[:, c] = int(fixed)
+            if dice is not None:
+                dice[:, c, :] = 0
+
+    finals = base
+    if apply_mod and modifiers:
+        mods = np.array([modifiers.get(a, 0) for a in ABILS], dtype=np.int16)
+        if mods.any():
+            finals = base + mods
+    return RollBatch(finals, base, dice, seed, offsets)
+
+
+def roll_batch(n: int,
+               fixed_values: Optional[Dict[str, Optional[int]]] = None,
+               modifiers: Optional[Dict[str, int]] = None,
+               apply_mod: bool = True,
+               rng: Union[RollStream, np.random.Generator, None] = None,
+               with_dice: bool = True) -> RollBatch:
+    """N セットを一括で振る（固定値・モディファイアは engine.roll_effective と同じ扱い）
+
+    rng が RollStream（None なら新しいシードで作る）なら、その続きを使い、行ごとの offset を返します。
+    np.random.Generator も渡せますが、その場合は replay できません（seed = NO_SEED）。
+    """
+    n = int(n)
+    tb = _tables(spec_key())
+    rng = rng if rng is not None else RollStream()
+    if isinstance(rng, RollStream):
+        start, words = rng.raw(n * tb.stride)
+        seed, offsets = rng.seed, start + tb.stride * np.arange(n, dtype=np.int64)
+    else:
+        words = rng.bit_generator.random_raw(n * tb.stride)
+        seed, offsets = NO_SEED, None
+    base, dice = _decode(tb, words.reshape(n, tb.stride), with_dice)
+    return _finish(base, dice, fixed_values, modifiers, apply_mod, seed, offsets)
+
+
+def replay(seed: int,
+           offsets,
+           fixed_values: Optional[Dict[str, Optional[int]]] = None,
+           modifiers: Optional[Dict[str, int]] = None,
+           apply_mod: bool = True,
+           with_dice: bool = True) -> RollBatch:
+    """(seed, offset) の行を作り直す（roll_batch で振ったときと同じ出目。ROLL_SPEC が同じ間に限る）"""
+    if seed == NO_SEED:
+        raise ValueError("シードのないレコードは作り直せません")
+    tb = _tables(spec_key())
+    offsets = np.asarray(offsets, np.int64).ravel()
+    base, dice = _decode(tb, words_at(seed, offsets, tb.stride), with_dice)
+    return _finish(base, dice, fixed_values, modifiers, apply_mod, seed, offsets)
+
+
+# =========================
+# 列（カラム）単位の派生値
+# =========================
+def total_column(finals: np.ndarray) -> np.ndarray:
+    # 幅 8 の行ごとの和は sum(axis=1) より einsum の方が 4 倍ほど速い（dtype は finals のまま int16）
+    return np.einsum("ij->i", finals, dtype=np.int16)
+
+
+_DERIVED = {   # 派生値 → 列の作り方（rules.derived_stats の列版。HP は round_half_up((CON+SIZ)/2) = (CON+SIZ+1)//2）
+    "HP": lambda c: (c["CON"] + c["SIZ"] + 1) // 2, "MP": lambda c: c["POW"], "SAN": lambda c: c["POW"] * 5,
+    "アイデア": lambda c: c["INT"] * 5, "幸運": lambda c: c["POW"] * 5, "知識": lambda c: c["EDU"] * 5,
+    "職業P": lambda c: c["EDU"] * 20, "興味P": lambda c: c["INT"] * 10,
+}
+
+
+def derived_columns(finals: np.ndarray, names: Optional[frozenset] = None) -> Dict[str, np.ndarray]:
+    """rules.derived_stats の列版（names を渡すとその派生値だけ）"""
+    col = {a: finals[:, i] for i, a in enumerate(ABILS)}
+    return {k: f(col) for k, f in _DERIVED.items() if names is None or k in names}
+
+
+def columns(finals: np.ndarray, names: Optional[frozenset] = None) -> Dict[str, np.ndarray]:
+    """ALL_KEYS_FOR_RULE の全列（能力・派生・TOTAL）。names（Rule.names）を渡すと派生と TOTAL は使う時だけ作る"""
+    cols = {a: finals[:, i] for i, a in enumerate(ABILS)}
+    if names is None or not names <= _DERIVED.keys() | set(ABILS) | {"TOTAL", "DB"}:
+        cols.update(derived_columns(finals))   # 知らない名前があれば全部（エラーは式の側で出す）
+    else:
+        cols.update(derived_columns(finals, names))
+    if names is None or "TOTAL" in names:
+        cols["TOTAL"] = total_column(finals)
+    return cols
+
+
+def auto_fav_mask(cols: Dict[str, np.ndarray],
+                  enabled: bool,
+                  mode: str,
+                  auto_min: Dict[str, Optional[int]],
+                  auto_max: Dict[str, Optional[int]],
+                  expr: Optional[str] = None) -> np.ndarray:
+    """rules.auto_fav_ok の列版（行ごとの bool 配列）"""
+    src = combined_source(mode, auto_min, auto_max, expr)
+    if not enabled or src is None:
+        return np.zeros(len(next(iter(cols.values()))), dtype=bool)
+    return compile_rule(src).mask(cols)
+
+
+# =========================
+# レコード（dict）への変換
+# =========================
+def to_records(batch: RollBatch,
+               rows: Sequence[int],
+               modifiers: Dict[str, int],
+               apply_mod: bool,
+               uid_start: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    指定行だけを履歴/★用の dict レコードにする
+    出目が全て 0 の列は固定値扱い。_uid は uid_start + 行番号。_seed/_offset は replay 用。
+    """
+    adds_c = spec_adds()
+    out = []
+    for r in rows:
+        finals, base, detail, adds = {}, {}, {}, {}
+        for c, abil in enumerate(ABILS):
+            finals[abil] = int(batch.finals[r, c])
+            base[abil] = int(batch.base[r, c])
+            d = [int(x) for x in batch.dice[r, c] if x] if batch.dice is not None else []
+            detail[abil] = d
+            adds[abil] = int(adds_c[c]) if d else 0
+        uid = None if uid_start is None else uid_start + int(r)
+        offset = None if batch.offsets is None or batch.offsets[r] == NO_OFFSET else int(batch.offsets[r])
+        out.append(make_record(finals, base, detail, adds, modifiers, apply_mod, uid=uid,
+                               seed=batch.seed, offset=offset))
+    return out
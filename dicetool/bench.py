@@ -0,0 +1,496 @@
+"""ベンチマーク（ロール・派生値・条件判定・履歴/★ の表示）
+
+  python -m dicetool.bench                          … 全部測って表を出す
+  python -m dicetool.bench --out bench.json         … 結果を JSON に保存
+  python -m dicetool.bench --baseline base.json     … 保存済みの結果と比べる（遅くなったものがあれば終了コード 1）
+  python -m dicetool.bench --quick -k history       … 履歴 10 万件まで・名前に history を含むものだけ
+  python -m dicetool.bench --memory                 … 1,000 件あたりのメモリ（dict レコード・各ストア）
+  python -m dicetool.bench --startup                … 画面の起動時間（新しいプロセスで初回の描画まで）
+
+乱数はすべて固定シード（SEED）なので、同じマシンなら毎回同じ入力を測ります。
+各ケースは timeit の autorange で回数を決め（1 回 0.2 秒以上）、repeat 回のうち最速を 1 回あたりの時間にします。
+履歴の件数は HISTORY_SIZES（20〜100 万件）。SQLite はメモリ上のデータベースで 10 万件までです。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from . import batch, engine, records, rules
+from .rng import RollStream
+from .rules import ABILS
+from .ruleexpr import combined_source, compile_rule
+
+SEED = 20240601
+HISTORY_SIZES = (20, 1_000, 10_000, 100_000, 1_000_000)
+QUICK_MAX = 100_000            # --quick の履歴件数の上限
+SQLITE_MAX = 100_000           # SQLite ケースの履歴件数の上限（追加が遅いので）
+BATCH_N = 1_000_000            # まとめ振りのセット数
+TOLERANCE = 0.25               # 比較で「遅くなった」とみなす割合
+
+AUTO_MIN = {**{k: None for k in rules.ALL_KEYS_FOR_RULE}, "TOTAL": 90, "EDU": 12}
+AUTO_MAX = {k: None for k in rules.ALL_KEYS_FOR_RULE}
+EXPR = "HP >= 13 and not DB == -1D4"
+FILTER = "TOTAL >= 90 and HP >= 14"
+
+Case = Callable[[Any], Callable[[], Any]]   # 準備（引数は件数）→ 測る関数
+_CASES: List[Tuple[str, Optional[Tuple[int, ...]], Case]] = []
+
+
+def case(name: str, sizes: Optional[Tuple[int, ...]] = None):
+    """ベンチマークの登録（sizes があれば件数ごとに name[件数] として測る）"""
+    def deco(fn: Case) -> Case:
+        _CASES.append((name, sizes, fn))
+        return fn
+    return deco
+
+
+# =========================
+# 共通の入力
+# =========================
+def _record(rand: random.Random, uid: int = 1) -> Dict[str, Any]:
+    base, detail, adds = {}, {}, {}
+    for a in ABILS:
+        base[a], detail[a], adds[a] = engine.roll_for(a, rand)
+    return records.make_record(base, base, detail, adds, {a: 0 for a in ABILS}, True, uid=uid)
+
+
+_stores: Dict[Tuple[str, int], Any] = {}
+
+
+def _history(n: int, kind: str = "memory"):
+    """n 件入った履歴ストア（固定シード。同じ件数は使い回す）"""
+    key = (kind, n)
+    if key not in _stores:
+        _stores.clear()   # 100 万件のストアを複数持たない
+        if kind == "memory":
+            from .store import RecordStore
+            store = RecordStore(n)
+        else:
+            from .sqlite_store import SQLiteStore
+            store = SQLiteStore(":memory:", "history", n)
+        rb = batch.roll_batch(n, rng=RollStream(SEED))
+        store.extend_batch(rb, range(n), {}, True, 1)
+        _stores[key] = store
+    return _stores[key]
+
+
+# =========================
+# 1 回ずつ（スカラー）
+# =========================
+@case("scalar.roll_for")
+def _roll_for(_):
+    rand = random.Random(SEED)
+    return lambda: engine.roll_for("STR", rand)
+
+
+@case("scalar.roll_set")
+def _roll_set(_):
+    rand = random.Random(SEED)
+    return lambda: [engine.roll_effective(a, {}, {a: 0 for a in ABILS}, True, rand) for a in ABILS]
+
+
+@case("scalar.roll_set_stream")
+def _roll_set_stream(_):
+    stream = RollStream(SEED)
+    return lambda: batch.roll_batch(1, rng=stream)
+
+
+@case("scalar.derived_stats")
+def _derived(_):
+    rec = _record(random.Random(SEED))
+    return lambda: rules.derived_stats(rec)
+
+
+@case("scalar.damage_bonus")
+def _damage_bonus(_):
+    return lambda: rules.damage_bonus(13, 14)
+
+
+@case("scalar.make_record")
+def _make_record(_):
+    rec = _record(random.Random(SEED))
+    finals = {a: rec[a] for a in ABILS}
+    return lambda: records.make_record(finals, rec["_base"], rec["_detail"], rec["_adds"], rec["_mods"], True, uid=1)
+
+
+@case("scalar.auto_fav_ok")
+def _auto_fav_ok(_):
+    rec = _record(random.Random(SEED))
+    return lambda: rules.auto_fav_ok(rec, True, "AND", AUTO_MIN, AUTO_MAX)
+
+
+@case("scalar.auto_fav_ok_expr")
+def _auto_fav_ok_expr(_):
+    rec = _record(random.Random(SEED))
+    return lambda: rules.auto_fav_ok(rec, True, "AND", AUTO_MIN, AUTO_MAX, EXPR)
+
+
+# =========================
+# まとめて（NumPy）
+# =========================
+@case("batch.roll", (BATCH_N,))
+def _batch_roll(n):
+    return lambda: batch.roll_batch(n, rng=RollStream(SEED))
+
+
+@case("batch.roll_nodice", (BATCH_N,))
+def _batch_roll_nodice(n):
+    return lambda: batch.roll_batch(n, rng=RollStream(SEED), with_dice=False)
+
+
+@case("batch.columns", (BATCH_N,))
+def _batch_columns(n):
+    finals = batch.roll_batch(n, rng=RollStream(SEED), with_dice=False).finals
+    return lambda: batch.columns(finals)
+
+
+@case("batch.rule_mask", (BATCH_N,))
+def _batch_rule_mask(n):
+    cols = batch.columns(batch.roll_batch(n, rng=RollStream(SEED), with_dice=False).finals)
+    rule = compile_rule(combined_source("AND", AUTO_MIN, AUTO_MAX, EXPR))
+    return lambda: rule.mask(cols)
+
+
+@case("batch.db_codes", (BATCH_N,))
+def _batch_db_codes(n):
+    from .lut import db_codes
+
+    finals = batch.roll_batch(n, rng=RollStream(SEED), with_dice=False).finals
+    str_siz = finals[:, ABILS.index("STR")] + finals[:, ABILS.index("SIZ")]
+    return lambda: db_codes(str_siz)
+
+
+@case("batch.topk", (BATCH_N,))
+def _batch_topk(n):
+    from .topk import TopK
+
+    rb = batch.roll_batch(n, rng=RollStream(SEED))
+    return lambda: TopK(100, "職業P+興味P").feed_batch(rb, {}, True, 1)
+
+
+@case("batch.arrange", (100_000,))
+def _batch_arrange(n):
+    from .arrange import arrange_batch
+
+    rb = batch.roll_batch(n, rng=RollStream(SEED))
+    return lambda: arrange_batch(rb, "HP + MP + STR + SIZ")
+
+
+@case("batch.gacha_profiles", (BATCH_N,))
+def _batch_gacha(n):
+    from .gacha import profiles
+
+    rng = np.random.default_rng(SEED)
+    return lambda: profiles(rng, n, population=True, unique_prefecture=True, party_size=6)
+
+
+@case("batch.montecarlo_update", (BATCH_N,))
+def _batch_montecarlo(n):
+    from .montecarlo import StreamStats
+
+    finals = batch.roll_batch(n, rng=RollStream(SEED), with_dice=False).finals
+    stats = StreamStats()
+    return lambda: stats.update(finals)
+
+
+@case("batch.party", (100_000,))
+def _batch_party(n):
+    from .party import find_party
+
+    cols = batch.columns(batch.roll_batch(n, rng=RollStream(SEED), with_dice=False).finals)
+    return lambda: find_party(cols, 5)
+
+
+@case("batch.to_records", (1_000,))
+def _batch_to_records(n):
+    rb = batch.roll_batch(n, rng=RollStream(SEED))
+    return lambda: batch.to_records(rb, range(n), {}, True, 1)
+
+
+# =========================
+# 履歴/★（画面の操作と同じ呼び出し）
+# =========================
+@case("history.adopt", HISTORY_SIZES)
+def _history_adopt(n):
+    """画面の採用（UID で 1 件引いて dict レコードに戻す）"""
+    store = _history(n)
+    uid = int(store.uids()[len(store) // 2])
+    return lambda: records.record_base(store.take_uids([uid]).record(0))
+
+
+@case("history.frame_cold", HISTORY_SIZES)
+def _history_frame_cold(n):
+    """並べ替え済みの表を作り直す（新しいロールの直後）"""
+    from .views import TableView
+
+    store = _history(n)
+    cols = ["_uid"] + ABILS + ["TOTAL"] + rules.DERIVED_KEYS
+    return lambda: TableView("★", cols, 1000).frame(store, "TOTAL", False, set())
+
+
+@case("history.frame_rarity", HISTORY_SIZES)
+def _history_frame_rarity(n):
+    """レア度で並べ替えた表を作り直す（frame_cold の TOTAL と比べる）"""
+    from .percentile import RANK_KEYS, RARITY
+    from .views import TableView
+
+    store = _history(n)
+    cols = ["_uid"] + ABILS + ["TOTAL"] + rules.DERIVED_KEYS + RANK_KEYS
+    return lambda: TableView("★", cols, 1000).frame(store, RARITY, False, set())
+
+
+@case("history.frame_warm", HISTORY_SIZES)
+def _history_frame_warm(n):
+    """変更なしの再実行（キャッシュから返る）"""
+    from .views import TableView
+
+    store = _history(n)
+    view = TableView("★", ["_uid"] + ABILS + ["TOTAL"] + rules.DERIVED_KEYS, 1000)
+    view.frame(store, "TOTAL", False, set())
+    return lambda: view.frame(store, "TOTAL", False, set())
+
+
+@case("history.filter_page", HISTORY_SIZES)
+def _history_filter(n):
+    store = _history(n)
+    where = compile_rule(FILTER)
+    return lambda: (store.count(where), store.page("HP", True, 1000, 0, where))
+
+
+@case("history.append", HISTORY_SIZES)
+def _history_append(n):
+    """画面の history_append（追加＋自動★の判定）。ストアが変わるので同じ件数のケースの最後に測る"""
+    store = _history(n)
+    rec = store.get(0)
+    return lambda: (store.append(rec), rules.auto_fav_ok(rec, True, "AND", AUTO_MIN, AUTO_MAX))
+
+
+@case("sqlite.page", tuple(s for s in HISTORY_SIZES if s <= SQLITE_MAX))
+def _sqlite_page(n):
+    store = _history(n, "sqlite")
+    return lambda: store.page("TOTAL", False, 1000, len(store) // 2)
+
+
+@case("sqlite.page_rarity", tuple(s for s in HISTORY_SIZES if s <= SQLITE_MAX))
+def _sqlite_page_rarity(n):
+    from .percentile import RARITY
+
+    store = _history(n, "sqlite")
+    return lambda: store.page(RARITY, False, 1000, len(store) // 2)
+
+
+@case("sqlite.filter_page", tuple(s for s in HISTORY_SIZES if s <= SQLITE_MAX))
+def _sqlite_filter(n):
+    store = _history(n, "sqlite")
+    where = compile_rule(FILTER)
+    return lambda: (store.count(where), store.page("HP", True, 1000, 0, where))
+
+
+# =========================
+# メモリ（1,000 件あたり）
+# =========================
+MEMORY_N = 1_000
+
+
+def memory_report(n: int = MEMORY_N) -> Dict[str, int]:
+    """n 件分のバイト数（dict レコードは tracemalloc で実測、ストアは確保した配列・ファイルの大きさ）"""
+    from .sqlite_store import SQLiteStore
+    from .store import RecordStore
+
+    rb = batch.roll_batch(n, rng=RollStream(SEED))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    recs = batch.to_records(rb, range(n), {}, True, 1)
+    dict_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del recs
+
+    out = {"dict レコード": dict_bytes}
+    for name, store in (("RecordStore（容量 n）", RecordStore(n)),
+                        ("SQLiteStore（メモリ上）", SQLiteStore(":memory:", "history", n))):
+        store.extend_batch(rb, range(n), {}, True, 1)
+        out[name] = store.nbytes()
+        if name.startswith("RecordStore"):
+            out["Rows（取り出した行）"] = sum(a.nbytes for a in store.take(np.arange(n)))
+    return out
+
+
+# =========================
+# 起動（新しいプロセスで画面を初めて描くまで）
+# =========================
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+HEAVY = ("pandas", "pyarrow", "numpy", "sqlite3")   # 読み込まれたかを報告するモジュール
+STARTUP_REPEAT = 5
+
+# 子プロセスで実行する。AppTest は本物のサーバーと同じスクリプト実行器で、ブラウザなしで 1 回分を描く
+_STARTUP = r"""
+import json, logging, sys, time
+logging.disable(logging.WARNING)
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+t2 = time.perf_counter()
+heavy = [m for m in sys.argv[2:] if m in sys.modules]
+at.run()
+t3 = time.perf_counter()
+json.dump({"streamlit": t1 - t0, "first": t2 - t1, "rerun": t3 - t2, "heavy": heavy,
+           "error": [str(e.value) for e in at.exception]}, sys.stdout)
+"""
+
+
+def startup_report(app: str = APP, repeat: int = STARTUP_REPEAT) -> Dict[str, Any]:
+    """画面の起動時間（秒。repeat 回の中央値）と、初回の描画までに読み込まれた重いモジュール
+
+    streamlit … streamlit 自体の import、first … 初回の実行（アプリの import と最初の描画。新しいセッションの
+    最初の表示にあたる）、rerun … 2 回目の実行。子プロセスは一時ディレクトリで動かすので、
+    保存済みの SQLite は開きません。
+    """
+    import subprocess
+    import tempfile
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", _STARTUP, os.path.abspath(app), *HEAVY],
+                                 cwd=tmp, capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(out))
+    if any(r["error"] for r in runs):
+        raise RuntimeError(f"画面の実行でエラー: {runs[0]['error']}")
+    return {**{k: statistics.median(r[k] for r in runs) for k in ("streamlit", "first", "rerun")},
+            "heavy": runs[0]["heavy"], "repeat": repeat}
+
+
+# =========================
+# 計測・保存・比較
+# =========================
+def measure(fn: Callable[[], Any], repeat: int = 3) -> Dict[str, float]:
+    """1 回あたりの秒数（best = repeat 回の最速、median = 中央値）"""
+    timer = timeit.Timer(fn)
+    number, first = timer.autorange()
+    times = [first] + timer.repeat(repeat - 1, number) if repeat > 1 else [first]
+    per = [t / number for t in times]
+    return {"best": min(per), "median": statistics.median(per), "number": number, "repeat": len(per)}
+
+
+def cases(quick: bool = False, pattern: str = "") -> Iterator[Tuple[str, Case, Any]]:
+    """(名前, 準備関数, 件数)。同じ件数の履歴を使うケースが続くように件数順に並べる"""
+    out = []
+    for name, sizes, fn in _CASES:
+        for size in sizes or (None,):
+            if quick and size is not None and name.startswith(("history.", "sqlite.")) and size > QUICK_MAX:
+                continue
+            full = name if size is None else f"{name}[{size}]"
+            if pattern in full:
+                out.append((full, fn, size))
+    order = {name: i for i, (name, _s, _f) in enumerate(_CASES)}
+    return iter(sorted(out, key=lambda c: (c[2] is not None and c[0].startswith(("history.", "sqlite.")),
+                                           c[2] or 0, order[c[0].split("[")[0]])))
+
+
+def run(quick: bool = False, pattern: str = "", repeat: int = 3,
+        progress: Optional[Callable[[str, Dict[str, float]], None]] = None) -> Dict[str, Any]:
+    results = {}
+    for name, fn, size in cases(quick, pattern):
+        results[name] = measure(fn(size), repeat)
+        if progress:
+            progress(name, results[name])
+    _stores.clear()
+    return {"meta": meta(), "results": results}
+
+
+def meta() -> Dict[str, Any]:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "seed": SEED,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = TOLERANCE) -> List[Tuple[str, float, float, float, str]]:
+    """(名前, 基準の秒, 今回の秒, 比, 判定)。判定は slower / faster / ok / new"""
+    rows = []
+    base = baseline.get("results", {})
+    for name, r in current["results"].items():
+        if name not in base:
+            rows.append((name, float("nan"), r["best"], float("nan"), "new"))
+            continue
+        ratio = r["best"] / base[name]["best"]
+        status = "slower" if ratio > 1 + tolerance else "faster" if ratio < 1 / (1 + tolerance) else "ok"
+        rows.append((name, base[name]["best"], r["best"], ratio, status))
+    return rows
+
+
+def _fmt(sec: float) -> str:
+    if sec != sec:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if sec >= scale:
+            return f"{sec / scale:.3g} {unit}"
+    return f"{sec / 1e-9:.3g} ns"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m dicetool.bench", description="ベンチマーク")
+    p.add_argument("--out", help="結果を保存する JSON")
+    p.add_argument("--baseline", help="比べる JSON（--out で保存したもの）")
+    p.add_argument("--tolerance", type=float, default=TOLERANCE, help="遅くなったとみなす割合（既定 0.25 = 25%%）")
+    p.add_argument("--quick", action="store_true", help=f"履歴は {QUICK_MAX:,} 件まで")
+    p.add_argument("-k", dest="pattern", default="", help="名前にこの文字列を含むケースだけ")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--memory", action="store_true", help=f"{MEMORY_N:,} 件あたりのメモリだけ表示する")
+    p.add_argument("--startup", nargs="?", const=APP, metavar="APP",
+                   help="画面の起動時間だけ測る（既定: streamlit_app.py）")
+    args = p.parse_args(argv)
+
+    if args.memory:
+        for name, size in memory_report().items():
+            print(f"{name:<28} {size / 1024:>10.1f} KiB  ({size / MEMORY_N:,.0f} B/件)")
+        return 0
+    if args.startup:
+        r = startup_report(args.startup)
+        print(f"streamlit の import   {r['streamlit'] * 1e3:>8.0f} ms")
+        print(f"初回の実行（描画まで） {r['first'] * 1e3:>8.0f} ms")
+        print(f"2 回目の実行           {r['rerun'] * 1e3:>8.0f} ms")
+        print(f"初回に読み込んだもの   {', '.join(r['heavy']) or '-'}（{r['repeat']} 回の中央値）")
+        return 0
+
+    res = run(args.quick, args.pattern, args.repeat,
+              progress=lambda name, r: print(f"{name:<36} {_fmt(r['best']):>10}", flush=True))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=1)
+        print(f"{args.out} に保存しました")
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        rows = compare(res, json.load(f), args.tolerance)
+    print(f"\n{'name':<36} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, base, now, ratio, status in rows:
+        mark = {"slower": "  ← 遅い", "faster": "  速い", "new": "  (新規)"}.get(status, "")
+        print(f"{name:<36} {_fmt(base):>10} {_fmt(now):>10} {ratio:>7.2f}{mark}")
+    slower = [r[0] for r in rows if r[4] == "slower"]
+    if slower:
+        print(f"\n{len(slower)} 件が {args.tolerance:.0%} 以上遅くなりました: {', '.join(slower)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""ダイス式（ROLL_SPEC の表記）のパーサとコンパイル結果
+
+書ける式:
+  3d6 / 2d6+6 / 1d10+8 / d%          … NdS（N 省略で 1、d% は d100）と定数の和・差
+  4d6kh3 / 4d6k3 / 2d20kl1 / 4d6dl1  … 高い方/低い方を残す（kh, kl）・捨てる（dh, dl）
+  2d6r1 / 2d6ro1                      … 1 を振り直す（r は出なくなるまで、ro は 1 回だけ）
+  2d6+6 reroll 1s / reroll 1s,2s once … 式全体のダイスに振り直しをかける
+
+compile_spec(式) は lru_cache され、同じ式は 1 回だけコンパイルされます。結果の DiceSpec は
+  roll()   … 1 回ずつ振る（random モジュール。engine.roll_for 用）
+  table()  … 生の乱数の組み合わせごとの (合計, 出目) 表。どれも等確率なので一様乱数で引ける（batch 用）
+  sample() … 表が大きすぎる式のための NumPy 直接サンプリング
+  decode() … 生の乱数（ダイスごとの index）→ 合計と出目（batch が再現可能な乱数から振るとき用）
+  dist()   … 厳密な分布（odds 用）
+を持ちます。出目は振ったダイスすべて（残さなかったものも含む）を振った順に記録します。
+roll() とコンパイルは NumPy を使わないので、engine（1 セットずつ振る画面・import dicetool）は NumPy を読み込みません。
+NumPy は表・サンプリング・分布を作るときに、その関数の中で import します。
+"""
+import itertools
+import random
+import re
+from functools import lru_cache
+from math import prod
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MAX_DICE = 4            # 1 つの式で振れるダイスの数（記録する出目の幅 = batch.DICE_WIDTH）
+TABLE_MAX = 1 << 16     # table() を作る組み合わせ数の上限
+ENUM_MAX = 2_000_000    # dist() で kh/kl の組み合わせを列挙する上限
+
+_TOKEN = re.compile(r"\s*(?:(?P<num>\d+)|(?P<word>reroll|once|kh|kl|dh|dl|ro|[dkrs%])|(?P<op>[+\-,]))", re.I)
+
+
+class DiceSyntaxError(ValueError):
+    pass
+
+
+class Dice(NamedTuple):
+    """NdS の 1 項"""
+    n: int
+    sides: int
+    keep: int                 # 残す個数（n なら全部）
+    keep_high: bool           # True: 高い方を残す
+    reroll: frozenset         # 振り直す目
+    once: bool                # True: 振り直しは 1 回だけ
+    sign: int                 # +1 / -1
+
+    def raw_faces(self) -> "np.ndarray":
+        """生の一様乱数 i → 出目（振り直し込み。どの i も等確率）"""
+        import numpy as np
+
+        faces = np.arange(1, self.sides + 1)
+        if not self.reroll:
+            return faces
+        if not self.once:
+            return faces[~np.isin(faces, list(self.reroll))]
+        first, second = np.divmod(np.arange(self.sides * self.sides), self.sides)
+        first += 1
+        return np.where(np.isin(first, list(self.reroll)), second + 1, first)
+
+    def face_range(self) -> Tuple[int, int]:
+        """振り直し込みの 1 個の出目の (最小, 最大)（raw_faces の範囲。NumPy なし）"""
+        faces = set(range(1, self.sides + 1))
+        kept = faces - self.reroll
+        if self.once and kept != faces:   # 1 回だけなら振り直した目はどれでもありうる
+            kept = faces
+        return min(kept), max(kept)
+
+    def value(self, dice: "np.ndarray") -> "np.ndarray":
+        """出目 (..., n) → この項の値（kh/kl を適用して符号をかける）"""
+        if self.keep < self.n:
+            import numpy as np
+
+            dice = np.sort(dice, axis=-1)
+            dice = dice[..., self.n - self.keep:] if self.keep_high else dice[..., :self.keep]
+        return self.sign * dice.sum(axis=-1)
+
+
+class DiceSpec:
+    """コンパイル済みのダイス式"""
+
+    def __init__(self, source: str, terms: Tuple[Dice, ...], const: int):
+        self.source = source
+        self.terms = terms
+        self.const = const                       # 定数項（記録上の「固定加算」）
+        self.n_dice = sum(t.n for t in terms)
+        self._rollers = [_scalar_roller(t) for t in terms]
+        lo = hi = const
+        for t in terms:
+            f_lo, f_hi = t.face_range()
+            lo_t, hi_t = t.keep * f_lo, t.keep * f_hi
+            lo, hi = (lo + lo_t, hi + hi_t) if t.sign > 0 else (lo - hi_t, hi - lo_t)
+        self.min, self.max = lo, hi
+
+    def __repr__(self) -> str:
+        return f"DiceSpec({self.source!r})"
+
+    # --- 1 回ずつ ---
+    def roll(self, rand=random) -> Tuple[int, List[int]]:
+        """戻り: (合計, 出目配列)"""
+        total, dice = self.const, []
+        for t, roller in zip(self.terms, self._rollers):
+            d = roller(rand)
+            kept = d if t.keep == t.n else sorted(d)[t.n - t.keep:] if t.keep_high else sorted(d)[:t.keep]
+            total += t.sign * sum(kept)
+            dice += d
+        return total, dice
+
+    # --- まとめて ---
+    def raw_sizes(self) -> List[int]:
+        return [len(t.raw_faces()) for t in self.terms for _ in range(t.n)]
+
+    @lru_cache(maxsize=None)
+    def table(self) -> Optional[Tuple["np.ndarray", "np.ndarray"]]:
+        """生の乱数の全組み合わせの (合計 int16 (T,), 出目 int8 (T, n_dice))。T > TABLE_MAX なら None"""
+        import numpy as np
+
+        sizes = self.raw_sizes()
+        size = prod(sizes)
+        if size > TABLE_MAX:
+            return None
+        idx = np.unravel_index(np.arange(size), sizes) if sizes else ()
+        raw = [t.raw_faces() for t in self.terms for _ in range(t.n)]
+        dice = np.stack([raw[j][idx[j]] for j in range(len(raw))], axis=1) if raw else np.zeros((size, 0), int)
+        return self._sum(dice).astype(np.int16), dice.astype(np.int8)
+
+    def sample(self, rng: "np.random.Generator", n: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """表を使わずに n 回振る。戻り: (合計 int16 (n,), 出目 int8 (n, n_dice))"""
+        import numpy as np
+
+        raw = [rng.integers(0, size, size=n) for size in self.raw_sizes()]
+        return self.decode(np.stack(raw, axis=1) if raw else np.zeros((n, 0), np.int64))
+
+    def decode(self, raw: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """生の乱数 (n, n_dice)（j 個目は 0〜raw_sizes()[j]-1）→ (合計 int16 (n,), 出目 int8 (n, n_dice))"""
+        import numpy as np
+
+        faces = [t.raw_faces() for t in self.terms for _ in range(t.n)]
+        dice = (np.stack([f[raw[:, j]] for j, f in enumerate(faces)], axis=1) if faces
+                else np.zeros((len(raw), 0), int))
+        return self._sum(dice).astype(np.int16), dice.astype(np.int8)
+
+    def _sum(self, dice: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        total = np.full(len(dice), self.const, dtype=np.int64)
+        j = 0
+        for t in self.terms:
+            total += t.value(dice[:, j:j + t.n])
+            j += t.n
+        return total
+
+    # --- 厳密な分布 ---
+    @lru_cache(maxsize=None)
+    def dist(self) -> Tuple[Dict[int, int], int]:
+        """(値→場合の数, 全場合の数)。odds.Dist と同じ形"""
+        from .odds import convolve   # odds が dice を import するため遅延
+
+        d: Tuple[Dict[int, int], int] = ({self.const: 1}, 1)
+        for t in self.terms:
+            d = convolve(d, _term_dist(t))
+        return d
+
+
+def _scalar_roller(t: Dice):
+    """1 項分の出目を振る関数（振り直し込み）"""
+    s, bad, n = t.sides, t.reroll, t.n
+    if not bad:
+        return lambda rand: [rand.randint(1, s) for _ in range(n)]
+
+    def one(rand):
+        v = rand.randint(1, s)
+        if t.once:
+            return rand.randint(1, s) if v in bad else v
+        while v in bad:
+            v = rand.randint(1, s)
+        return v
+    return lambda rand: [one(rand) for _ in range(n)]
+
+
+def _term_dist(t: Dice) -> Tuple[Dict[int, int], int]:
+    import numpy as np
+
+    from .odds import convolve
+
+    faces = t.raw_faces()
+    values, counts = np.unique(faces, return_counts=True)
+    face: Tuple[Dict[int, int], int] = (dict(zip(values.tolist(), counts.tolist())), len(faces))
+    if t.keep == t.n:
+        d: Tuple[Dict[int, int], int] = ({0: 1}, 1)
+        for _ in range(t.n):
+            d = convolve(d, face)
+    else:
+        if len(face[0]) ** t.n > ENUM_MAX:
+            raise DiceSyntaxError(f"{t.n}d{t.sides} の kh/kl は組み合わせが多すぎて厳密計算できません")
+        out: Dict[int, int] = {}
+        for combo in itertools.product(face[0].items(), repeat=t.n):
+            vals = sorted(v for v, _ in combo)
+            kept = vals[t.n - t.keep:] if t.keep_high else vals[:t.keep]
+            out[sum(kept)] = out.get(sum(kept), 0) + prod(c for _, c in combo)
+        d = (out, face[1] ** t.n)
+    if t.sign < 0:
+        d = ({-v: c for v, c in d[0].items()}, d[1])
+    return d
+
+
+# =========================
+# パーサ
+# =========================
+def _tokenize(src: str) -> List[Tuple[str, str]]:
+    out, pos = [], 0
+    src = src.strip()
+    while pos < len(src):
+        m = _TOKEN.match(src, pos)
+        if not m or m.end() == pos:
+            raise DiceSyntaxError(f"読めない文字があります: {src[pos:pos + 10]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        out.append((kind, m.group(kind).lower()))
+    return out
+
+
+class _Parser:
+    def __init__(self, src: str):
+        self.toks = _tokenize(src)
+        self.i = 0
+
+    def peek(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.toks[self.i] if self.i < len(self.toks) else (None, None)
+
+    def take(self, kind: Optional[str] = None, text: Optional[str] = None) -> Tuple[str, str]:
+        tok = self.peek()
+        if tok[0] is None or (kind is not None and tok[0] != kind) or (text is not None and tok[1] != text):
+            raise DiceSyntaxError(f"'{text or kind or '式'}' が必要です（位置 {self.i}）")
+        self.i += 1
+        return tok
+
+    def number(self) -> int:
+        return int(self.take("num")[1])
+
+    def parse(self) -> Tuple[List[Dice], int]:
+        terms: List[Dice] = []
+        const = 0
+        sign = 1
+        if self.peek() == ("op", "-"):
+            self.take()
+            sign = -1
+        while True:
+            if self.peek()[0] == "num" and not self._dice_follows(1):
+                const += sign * self.number()
+            else:
+                terms.append(self.dice(sign))
+            if self.peek()[0] == "op" and self.peek()[1] in "+-":
+                sign = 1 if self.take()[1] == "+" else -1
+                continue
+            break
+        if self.peek() == ("word", "reroll"):
+            bad, once = self.reroll_clause()
+            terms = [t._replace(reroll=t.reroll | bad, once=once) for t in terms]
+        if self.peek()[0] is not None:
+            raise DiceSyntaxError(f"余分なトークン: {self.peek()[1]!r}")
+        return terms, const
+
+    def _dice_follows(self, k: int) -> bool:
+        return self.i + k < len(self.toks) and self.toks[self.i + k] == ("word", "d")
+
+    def dice(self, sign: int) -> Dice:
+        n = self.number() if self.peek()[0] == "num" else 1
+        self.take("word", "d")
+        if self.peek() == ("word", "%"):
+            self.take()
+            sides = 100
+        else:
+            sides = self.number()
+        if n < 1 or sides < 1:
+            raise DiceSyntaxError("ダイスの個数と面数は 1 以上にしてください")
+        keep, keep_high, bad, once = n, True, frozenset(), False
+        while self.peek()[0] == "word" and self.peek()[1] in ("k", "kh", "kl", "dh", "dl", "r", "ro"):
+            op = self.take()[1]
+            v = self.number()
+            if op in ("k", "kh", "kl"):
+                keep, keep_high = v, op != "kl"
+            elif op in ("dh", "dl"):
+                keep, keep_high = n - v, op == "dl"
+            else:
+                bad, once = bad | {v}, op == "ro"
+            if not 1 <= keep <= n:
+                raise DiceSyntaxError(f"{n}d{sides} で残せるのは 1〜{n} 個です")
+        return Dice(n, sides, keep, keep_high, bad, once, sign)
+
+    def reroll_clause(self) -> Tuple[frozenset, bool]:
+        self.take("word", "reroll")
+        bad = set()
+        while True:
+            bad.add(self.number())
+            if self.peek() == ("word", "s"):
+                self.take()
+            if self.peek() != ("op", ","):
+                break
+            self.take()
+        once = self.peek() == ("word", "once")
+        if once:
+            self.take()
+        return frozenset(bad), once
+
+
+@lru_cache(maxsize=256)
+def compile_spec(source: str) -> DiceSpec:
+    """ダイス式をコンパイル（同じ式は 2 回目以降キャッシュから）"""
+    terms, const = _Parser(source).parse()
+    for t in terms:
+        if not t.once and t.reroll >= set(range(1, t.sides + 1)):
+            raise DiceSyntaxError(f"d{t.sides} の目をすべて振り直すことになります")
+    spec = DiceSpec(source, tuple(terms), const)
+    if spec.n_dice > MAX_DICE:
+        raise DiceSyntaxError(f"1 つの式で振れるダイスは {MAX_DICE} 個までです（{source}）")
+    if any(t.sides > 127 for t in terms):
+        raise DiceSyntaxError("面数は 127 までです（出目を int8 で記録するため）")
+    return spec
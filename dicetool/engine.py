@@ -0,0 +1,47 @@
+"""ダイスエンジン（1回ずつのロール）
+
+rand は randint を持つ乱数（既定は random モジュール）。再現したいときは random.Random(seed) を渡します。
+画面のロールは batch.roll_batch(1, rng=SessionRNG.rolls) を使い、レコードに (seed, offset) を残します。
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+
+from .dice import compile_spec
+from .rules import ROLL_SPEC
+
+
+def roll_nd6(n: int, rand=random) -> Tuple[int, List[int]]:
+    dice = [rand.randint(1, 6) for _ in range(n)]
+    return sum(dice), dice
+
+
+def roll_for(stat: str, rand=random) -> Tuple[int, List[int], int]:
+    """戻り: (合計値=出目合計+固定加算, 出目配列, 固定加算)
+
+    ROLL_SPEC のダイス式（4d6kh3 や 2d6+6 reroll 1s も可）をコンパイル済みの関数で振ります。
+    """
+    spec = compile_spec(ROLL_SPEC[stat][0])
+    total, dice = spec.roll(rand)
+    return total, dice, spec.const
+
+
+def roll_effective(abil: str,
+                   fixed_values: Dict[str, Optional[int]],
+                   modifiers: Dict[str, int],
+                   apply_mod: bool,
+                   rand=random) -> Tuple[int, List[int], int, int]:
+    """
+    固定値/ダイス/モディファイアをまとめて適用
+    戻り: base, detail, add, final
+      base   … 固定ありなら固定値、なければダイス合計(+固定加算済)
+      detail … 出目配列（固定時は []）
+      add    … 固定加算（3d6=0, 2d6+6=6, 3d6+3=3）
+      final  … base + (モディファイア or 0)
+    """
+    fixed = fixed_values.get(abil)
+    if fixed is not None:
+        base = int(fixed); d = []; add = 0
+    else:
+        base, d, add = roll_for(abil, rand)
+    final = base + (modifiers[abil] if apply_mod else 0)
+    return base, d, add, final
@@ -0,0 +1,182 @@
+"""履歴/★ のエクスポート（CSV / Parquet / JSON Lines）
+
+ストアを CHUNK 件ずつ読み（store.iter_chunks、新しい順）、チャンクごとに書き出すので、
+何百万件でもメモリ使用量はチャンク 1 つ分で一定です。
+
+CSV / Parquet の列:
+  _uid, _seed, _offset, 能力（最終値）, TOTAL, 派生, DB, base_能力（ベース値）, dice_能力（出目）, mod_能力, apply_mod
+  出目は空白区切りの文字列（"4 2 6"。固定値の能力は空）。_seed が -1 の行は作り直せない
+JSON Lines は 1 行 1 レコードで、records.make_record と同じキー（_detail は出目のリスト）です。
+Parquet は pyarrow が必要です（なければ ImportError）。
+"""
+import csv
+import importlib.util
+import io
+import json
+import tempfile
+from typing import BinaryIO, Dict, Iterator, List
+
+import numpy as np
+
+from .batch import DICE_WIDTH, derived_columns, spec_adds
+from .lut import db_codes, db_labels
+from .rng import NO_SEED
+from .rules import ABILS, DERIVED_KEYS
+from .store import RecordStore, Rows
+
+CHUNK = 50_000
+FORMATS = {   # 形式 → (MIME, 拡張子)
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "jsonl": ("application/x-ndjson", ".jsonl"),
+}
+_JSON = json.JSONEncoder(ensure_ascii=False)
+
+
+def _db_labels(finals: np.ndarray) -> np.ndarray:
+    return db_labels(db_codes(finals[:, ABILS.index("STR")] + finals[:, ABILS.index("SIZ")]))
+
+
+def _dice_strings(dice: np.ndarray) -> np.ndarray:
+    """出目 (n, DICE_WIDTH) → "4 2 6" の配列（出目の組は種類が少ないので、種類ごとに 1 回だけ文字列化）"""
+    packed = np.ascontiguousarray(dice, np.int8).view(np.uint32).ravel()
+    uniq, inv = np.unique(packed, return_inverse=True)
+    labels = [" ".join(str(x) for x in row if x) for row in uniq.view(np.int8).reshape(-1, DICE_WIDTH).tolist()]
+    return np.array(labels, dtype=object)[inv] if len(dice) else np.array([], dtype=object)
+
+
+def table_chunk(rows: Rows) -> Dict[str, np.ndarray]:
+    """Rows → CSV / Parquet 用の列（列名 → 配列）"""
+    finals = rows.finals
+    cols: Dict[str, np.ndarray] = {"_uid": rows.uids, "_seed": rows.seeds, "_offset": rows.offsets}
+    cols.update({a: finals[:, c] for c, a in enumerate(ABILS)})
+    cols["TOTAL"] = finals.sum(axis=1, dtype=np.int16)
+    cols.update({k: v.astype(np.int16) for k, v in derived_columns(finals).items()})
+    cols["DB"] = _db_labels(finals)
+    cols.update({f"base_{a}": rows.base[:, c] for c, a in enumerate(ABILS)})
+    cols.update({f"dice_{a}": _dice_strings(rows.dice[:, c]) for c, a in enumerate(ABILS)})
+    cols.update({f"mod_{a}": rows.mods[:, c] for c, a in enumerate(ABILS)})
+    cols["apply_mod"] = rows.apply_mod
+    return cols
+
+
+def _dice_json(dice: np.ndarray) -> List[str]:
+    """出目 (n, DICE_WIDTH) → "[4, 2, 6]" のリスト（_dice_strings と同じく種類ごとに 1 回だけ文字列化）"""
+    packed = np.ascontiguousarray(dice, np.int8).view(np.uint32).ravel()
+    uniq, inv = np.unique(packed, return_inverse=True)
+    labels = [_JSON.encode([x for x in row if x]) for row in uniq.view(np.int8).reshape(-1, DICE_WIDTH).tolist()]
+    return [labels[i] for i in inv.tolist()]
+
+
+def _jsonl_template(seeded: bool) -> str:
+    """1 レコードの書式（% で値を入れる。json.dumps(make_record(...), ensure_ascii=False) と同じ文字列）"""
+    def obj(keys, fmt):
+        return "{" + ", ".join(f"{_JSON.encode(k)}: {fmt}" for k in keys) + "}"
+    body = (obj(ABILS + ["TOTAL"] + DERIVED_KEYS, "%d")[:-1]
+            + ", " + ", ".join(f"{_JSON.encode(k)}: {obj(ABILS, f)}" for k, f in
+                               (("_base", "%d"), ("_detail", "%s"), ("_adds", "%d"), ("_mods", "%d")))
+            + ', "_apply_mod": %s, "_uid": %d')
+    return body + (', "_seed": %d, "_offset": %d}' if seeded else "}")
+
+
+_JSONL = (_jsonl_template(False), _jsonl_template(True))
+
+
+def jsonl_chunk(rows: Rows) -> Iterator[str]:
+    """Rows → JSON Lines の各行（records.make_record と同じキー）
+
+    キーと並びはどの行も同じなので、行ごとに json.dumps せず、書式 1 つに値を入れるだけにしています
+    （出目のリストは種類ごとに 1 回だけエンコード）。
+    """
+    finals = rows.finals
+    rolled = rows.dice.any(axis=2)
+    adds_c = spec_adds()
+    cols = [finals[:, c] for c in range(len(ABILS))]
+    cols.append(finals.sum(axis=1))
+    cols += derived_columns(finals).values()
+    cols += [rows.base[:, c] for c in range(len(ABILS))]
+    cols = [c.tolist() for c in cols]
+    cols += [_dice_json(rows.dice[:, c]) for c in range(len(ABILS))]
+    cols += [np.where(rolled[:, c], int(adds_c[c]), 0).tolist() for c in range(len(ABILS))]
+    cols += [rows.mods[:, c].tolist() for c in range(len(ABILS))]
+    cols.append(["true" if a else "false" for a in rows.apply_mod.tolist()])
+    cols += [rows.uids.tolist(), rows.seeds.tolist(), rows.offsets.tolist()]
+    plain, seeded = _JSONL
+    for vals in zip(*cols):
+        yield seeded % vals if vals[-2] != NO_SEED else plain % vals[:-2]
+
+
+# =========================
+# 書き出し（f はバイナリのファイル）
+# =========================
+def write_csv(store, f: BinaryIO, chunk: int = CHUNK) -> int:
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="", write_through=True)
+    w = csv.writer(text)
+    n = 0
+    header = False
+    for rows in store.iter_chunks(chunk):
+        cols = table_chunk(rows)
+        if not header:
+            w.writerow(cols)
+            header = True
+        w.writerows(zip(*(c.tolist() for c in cols.values())))
+        n += len(rows.uids)
+    if not header:
+        w.writerow(table_chunk(_empty_rows()))
+    text.detach()   # f は閉じずに呼び出し側へ返す
+    return n
+
+
+def write_parquet(store, f: BinaryIO, chunk: int = CHUNK) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    n = 0
+    for rows in store.iter_chunks(chunk):
+        table = pa.table({k: pa.array(v) for k, v in table_chunk(rows).items()})
+        if writer is None:
+            writer = pq.ParquetWriter(f, table.schema)
+        writer.write_table(table)
+        n += len(rows.uids)
+    if writer is None:
+        table = pa.table({k: pa.array(v, type=pa.string() if k == "DB" else None)
+                          for k, v in table_chunk(_empty_rows()).items()})
+        writer = pq.ParquetWriter(f, table.schema)
+    writer.close()
+    return n
+
+
+def write_jsonl(store, f: BinaryIO, chunk: int = CHUNK) -> int:
+    n = 0
+    for rows in store.iter_chunks(chunk):
+        f.write(("\n".join(jsonl_chunk(rows)) + "\n").encode("utf-8"))
+        n += len(rows.uids)
+    return n
+
+
+_WRITERS = {"csv": write_csv, "parquet": write_parquet, "jsonl": write_jsonl}
+
+
+def available_formats() -> List[str]:
+    """この環境で使える形式（pyarrow がなければ parquet を除く）"""
+    return [f for f in FORMATS if f != "parquet" or importlib.util.find_spec("pyarrow") is not None]
+
+
+def write(store, fmt: str, f: BinaryIO, chunk: int = CHUNK) -> int:
+    """store（RecordStore / SQLiteStore）を fmt 形式で f に書く。戻り: 件数"""
+    if fmt not in _WRITERS:
+        raise ValueError(f"未対応の形式: {fmt}（{', '.join(FORMATS)}）")
+    return _WRITERS[fmt](store, f, chunk)
+
+
+def export_file(store, fmt: str, chunk: int = CHUNK) -> BinaryIO:
+    """一時ファイルに書き出して先頭に戻したものを返す（st.download_button の data 用）"""
+    f = tempfile.TemporaryFile()
+    write(store, fmt, f, chunk)
+    f.seek(0)
+    return f
+
+
+def _empty_rows() -> Rows:
+    return RecordStore(1).head(0)
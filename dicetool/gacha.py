@@ -0,0 +1,171 @@
+"""出身/性別ガチャのデータと抽選
+
+抽選は Walker のエイリアス法です。候補と重みから AliasTable を 1 度だけ作っておけば（import 時に作る
+COUNTRY_TABLE などの表）、1 回の抽選は一様乱数 2 つと配列の参照だけで、候補の数によらず O(1) です。
+  - AliasTable.draw(rng)              … 1 つ
+  - AliasTable.sample(rng, n)         … n 個（復元抽出。NumPy でまとめて）
+  - AliasTable.sample_unique(rng, n)  … 重複なしで n 個（重み付きの非復元抽出。グループごとにまとめて）
+  - profiles(rng, n, ...)             … 出身国・出身県・性別を n 人分まとめて（パーティーや NPC 用）
+出身県は国が日本の人だけ抽選し、それ以外は "-" です。rng は SessionRNG.gacha などの Generator です。
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+PREFECTURES = [
+    "北海道","青森","岩手","宮城","秋田","山形","福島",
+    "茨城","栃木","群馬","埼玉","千葉","東京","神奈川",
+    "新潟","富山","石川","福井","山梨","長野",
+    "岐阜","静岡","愛知","三重",
+    "滋賀","京都","大阪","兵庫","奈良","和歌山",
+    "鳥取","島根","岡山","広島","山口",
+    "徳島","香川","愛媛","高知",
+    "福岡","佐賀","長崎","熊本","大分","宮崎","鹿児島","沖縄"
+]
+COUNTRIES = [
+    "日本","アメリカ","イギリス","フランス","ドイツ","イタリア","スペイン","ロシア",
+    "カナダ","オーストラリア","中国","韓国","台湾","香港","インド","インドネシア",
+    "ベトナム","タイ","フィリピン","マレーシア","シンガポール","トルコ","エジプト",
+    "南アフリカ","ブラジル","メキシコ","アルゼンチン","チリ","ペルー","サウジアラビア"
+]
+GENDERS = ["男性", "女性", "X/その他", "不明"]
+
+# 重み（現代日本PCを想定して、日本を高めに）
+COUNTRY_WEIGHTS = {c: (8 if c == "日本" else 1) for c in COUNTRIES}
+
+# 都道府県の人口（令和2年国勢調査、千人）。出身県を人口比で抽選するときの重み
+PREFECTURE_POPULATION = {
+    "北海道": 5225, "青森": 1238, "岩手": 1211, "宮城": 2302, "秋田": 960, "山形": 1068, "福島": 1833,
+    "茨城": 2867, "栃木": 1933, "群馬": 1939, "埼玉": 7345, "千葉": 6284, "東京": 14048, "神奈川": 9237,
+    "新潟": 2201, "富山": 1035, "石川": 1133, "福井": 767, "山梨": 810, "長野": 2048,
+    "岐阜": 1979, "静岡": 3633, "愛知": 7542, "三重": 1770,
+    "滋賀": 1414, "京都": 2578, "大阪": 8838, "兵庫": 5465, "奈良": 1324, "和歌山": 923,
+    "鳥取": 553, "島根": 671, "岡山": 1888, "広島": 2800, "山口": 1342,
+    "徳島": 720, "香川": 950, "愛媛": 1335, "高知": 692,
+    "福岡": 5135, "佐賀": 811, "長崎": 1312, "熊本": 1738, "大分": 1124, "宮崎": 1070, "鹿児島": 1588,
+    "沖縄": 1467,
+}
+
+PROFILE_KEYS = ["出身国", "出身県", "性別"]
+NO_PREFECTURE = "-"   # 日本以外の人の出身県
+
+
+def _alias(p: np.ndarray):
+    """確率 p → (prob, alias)（Vose の作り方。O(k)）"""
+    k = len(p)
+    scaled = p * k
+    prob = np.ones(k)
+    alias = np.arange(k)
+    small = [i for i in range(k) if scaled[i] < 1.0]
+    large = [i for i in range(k) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    return prob, alias   # 残り（丸め誤差で 1 付近のもの）は prob 1 のまま
+
+
+class AliasTable:
+    """重み付きの抽選表（エイリアス法。作るのは O(k)、1 回の抽選は O(1)）"""
+
+    def __init__(self, items: Sequence[str], weights: Optional[Sequence[float]] = None):
+        self.items = list(items)
+        k = len(self.items)
+        w = np.ones(k) if weights is None else np.asarray(weights, dtype=float)
+        if not k or w.shape != (k,) or (w < 0).any() or not w.sum() > 0:
+            raise ValueError("重みは候補と同じ数の 0 以上の値で、合計が正です")
+        self.p = w / w.sum()
+        self.uniform = bool((w == w[0]).all())   # 均等なら乱数は index の 1 つだけ
+        self.prob, self.alias = _alias(self.p)
+        self._labels = np.array(self.items, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def draw(self, rng: np.random.Generator) -> str:
+        """1 つ選ぶ"""
+        i = int(rng.integers(len(self.items)))
+        if self.uniform or rng.random() < self.prob[i]:
+            return self.items[i]
+        return self.items[int(self.alias[i])]
+
+    def sample(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """n 個選ぶ（復元抽出）。戻り: index の配列"""
+        i = rng.integers(len(self.items), size=n)
+        if self.uniform:
+            return i
+        return np.where(rng.random(n) < self.prob[i], i, self.alias[i])
+
+    def sample_unique(self, rng: np.random.Generator, n: int, groups: int = 1) -> np.ndarray:
+        """グループごとに重複なしで n 個（重み付きの非復元抽出）。戻り: (groups, n) の index
+
+        エイリアス表は取り出すたびに作り直しになるので、非復元抽出は Gumbel top-k で行います
+        （log p にグンベル乱数を足して大きい順に n 個。1 個ずつ重みに比例して引いては除くのと同じ分布）。
+        """
+        if n > int((self.p > 0).sum()):
+            raise ValueError(f"重複なしで選べるのは {int((self.p > 0).sum())} 個までです（{n} 個）")
+        with np.errstate(divide="ignore"):   # 重み 0 は -inf で選ばれない
+            keys = np.log(self.p) - np.log(-np.log(rng.random((groups, len(self.items)))))
+        return np.argsort(-keys, axis=1, kind="stable")[:, :n]
+
+    def labels(self, idx: np.ndarray) -> List[str]:
+        """index の配列 → 候補の文字列のリスト"""
+        return self._labels[idx].tolist()
+
+
+COUNTRY_TABLE = AliasTable(COUNTRIES, [COUNTRY_WEIGHTS[c] for c in COUNTRIES])   # 日本に寄せる
+COUNTRY_UNIFORM = AliasTable(COUNTRIES)
+PREFECTURE_TABLE = AliasTable(PREFECTURES)
+PREFECTURE_POP_TABLE = AliasTable(PREFECTURES, [PREFECTURE_POPULATION[p] for p in PREFECTURES])   # 人口比
+GENDER_TABLE = AliasTable(GENDERS)
+_JAPAN = COUNTRIES.index("日本")
+
+
+def country_table(weighted: bool = True) -> AliasTable:
+    return COUNTRY_TABLE if weighted else COUNTRY_UNIFORM
+
+
+def prefecture_table(population: bool = False) -> AliasTable:
+    return PREFECTURE_POP_TABLE if population else PREFECTURE_TABLE
+
+
+def draw(rng: np.random.Generator, items: List[str], weights: Optional[Sequence[float]] = None) -> str:
+    """items から 1 つ選ぶ（weights が None なら均等。表をその場で作るので、決まった候補なら上の表を使う）"""
+    return AliasTable(items, weights).draw(rng)
+
+
+def profiles(rng: np.random.Generator, n: int, weighted: bool = True, population: bool = False,
+             unique_prefecture: bool = False, party_size: Optional[int] = None) -> Dict[str, List[str]]:
+    """n 人分の出身国・出身県・性別（PROFILE_KEYS の列）
+
+    weighted … 国を日本に寄せる、population … 県を人口比で引く、
+    unique_prefecture … 日本出身の人どうしで県が重ならないようにする（party_size 人ずつの組ごと。
+    None なら n 人全体で 1 組）。1 組の日本出身が 47 人を超えると ValueError です。
+    """
+    n = int(n)
+    size = n if party_size is None else int(party_size)
+    if n < 0 or party_size is not None and size < 1:
+        raise ValueError("人数と組の人数は 1 以上です")
+    country = country_table(weighted).sample(rng, n)
+    gender = GENDER_TABLE.sample(rng, n)
+    prefs = prefecture_table(population)
+    jp = country == _JAPAN
+    pref = np.full(n, -1)
+    if unique_prefecture and jp.any():
+        starts = np.arange(0, n, size)
+        per_group = np.add.reduceat(jp.astype(np.int64), starts)
+        # 組の中で何人目の日本出身か（0 始まり）→ その組の重複なし抽選の何番目を使うか
+        seen = np.cumsum(jp)
+        group = np.arange(n) // size
+        rank = seen - 1 - np.concatenate([[0], seen])[starts][group]
+        most = int(per_group.max())
+        if most > len(prefs):
+            raise ValueError(f"1 組の日本出身が {most} 人で、県の数（{len(prefs)}）より多いので重複なしにできません")
+        picks = prefs.sample_unique(rng, most, len(starts))
+        pref[jp] = picks[group[jp], rank[jp]]
+    else:
+        pref[jp] = prefs.sample(rng, int(jp.sum()))
+    labels = np.where(jp, prefs._labels[np.maximum(pref, 0)], NO_PREFECTURE)
+    return {"出身国": country_table(weighted).labels(country), "出身県": labels.tolist(),
+            "性別": GENDER_TABLE.labels(gender)}
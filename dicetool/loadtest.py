@@ -0,0 +1,172 @@
+"""HTTP API（dicetool.api）の負荷試験
+
+  python -m dicetool.loadtest --serve                       … API をこの場で起動して全シナリオを測る
+  python -m dicetool.loadtest --url http://127.0.0.1:8000 -s roll -c 64 -d 10
+                                                            … 起動済みの API の /roll を 64 並列で 10 秒
+  python -m dicetool.loadtest --serve --out load.json       … 結果を JSON に保存
+
+並列数ぶんのスレッドがそれぞれ keep-alive の接続を 1 本持ち、応答を最後まで読んでから次を送ります
+（閉ループ。NDJSON の応答も最後まで読む）。シナリオごとに 1 秒あたりのリクエスト数と
+レイテンシのパーセンタイル（p50/p90/p99）、失敗数、受け取ったバイト数を出します。
+標準ライブラリだけで動きます（--serve は API を別プロセスで起動するので uvicorn が必要）。
+"""
+import argparse
+import http.client
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+SCENARIOS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {   # 名前 → (メソッド, パス, 本文)
+    "health": ("GET", "/health", {}),
+    "roll": ("POST", "/roll", {"modifiers": {"EDU": 2}}),
+    "batch100": ("POST", "/batch", {"n": 100}),
+    "batch_filter": ("POST", "/batch", {"n": 10_000, "expr": "TOTAL >= 90"}),
+    "generate": ("POST", "/generate", {"n": 5, "auto_min": {"TOTAL": 95}}),
+    "odds": ("POST", "/odds", {"auto_min": {"HP": 14, "EDU": 15}, "keys": ["HP"]}),
+    "gacha": ("POST", "/gacha", {"kind": "country", "n": 3}),
+    "gacha_profile": ("POST", "/gacha", {"kind": "profile", "n": 6, "population": True, "unique_prefecture": True}),
+    "balanced_party": ("POST", "/party", {"k": 5, "pool": 100_000, "bands": {"TOTAL": 4}}),
+    "stream100k": ("POST", "/batch", {"n": 100_000, "stream": True}),
+}
+
+
+class Result(NamedTuple):
+    scenario: str
+    requests: int
+    errors: int
+    seconds: float
+    rps: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    bytes: int
+
+
+def _worker(host: str, port: int, method: str, path: str, body: bytes, deadline: float, limit: Optional[List[int]],
+            lat: List[float], stats: Dict[str, int], lock: threading.Lock):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    headers = {"Content-Type": "application/json"} if body else {}
+    while time.perf_counter() < deadline:
+        if limit is not None:
+            with lock:
+                if limit[0] <= 0:
+                    break
+                limit[0] -= 1
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body or None, headers=headers)
+            resp = conn.getresponse()
+            size = len(resp.read())
+            ok = resp.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            size, ok = 0, False
+        dt = time.perf_counter() - t0
+        with lock:
+            lat.append(dt)
+            stats["bytes"] += size
+            stats["errors"] += not ok
+    conn.close()
+
+
+def run(url: str, scenario: str, concurrency: int = 16, duration: float = 5.0,
+        requests: Optional[int] = None) -> Result:
+    """1 シナリオを concurrency 並列で duration 秒（requests を渡すとその件数で止める）"""
+    method, path, body = SCENARIOS[scenario]
+    u = urlsplit(url)
+    data = json.dumps(body).encode() if method == "POST" else b""
+    lat: List[float] = []
+    stats = {"bytes": 0, "errors": 0}
+    lock = threading.Lock()
+    limit = None if requests is None else [int(requests)]
+    t0 = time.perf_counter()
+    deadline = t0 + duration if requests is None else float("inf")
+    threads = [threading.Thread(target=_worker, daemon=True,
+                                args=(u.hostname, u.port or 80, method, path, data, deadline, limit, lat, stats, lock))
+               for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - t0
+    ms = np.asarray(lat) * 1e3 if lat else np.zeros(1)
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return Result(scenario, len(lat), stats["errors"], secs, len(lat) / secs, float(p50), float(p90), float(p99),
+                  float(ms.max()), stats["bytes"])
+
+
+# =========================
+# API の起動（--serve）
+# =========================
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(port: int, workers: int = 1, timeout: float = 30.0) -> subprocess.Popen:
+    """API を別プロセスで起動し、/health が応えるまで待つ"""
+    proc = subprocess.Popen([sys.executable, "-m", "dicetool.api", "--port", str(port), "--workers", str(workers)])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("API が起動しませんでした")
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("API の起動を待ちきれませんでした")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m dicetool.loadtest", description="HTTP API の負荷試験")
+    p.add_argument("--url", default="http://127.0.0.1:8000", help="API の URL（--serve なら無視）")
+    p.add_argument("--serve", action="store_true", help="API を空いているポートで起動して測る")
+    p.add_argument("--server-workers", type=int, default=1, help="--serve の API のプロセス数")
+    p.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS),
+                   help="測るシナリオ（複数可。既定: 全部）")
+    p.add_argument("-c", "--concurrency", type=int, default=16)
+    p.add_argument("-d", "--duration", type=float, default=5.0, help="1 シナリオの秒数")
+    p.add_argument("-n", "--requests", type=int, help="1 シナリオのリクエスト数（指定すると秒数より優先）")
+    p.add_argument("--out", help="結果を保存する JSON")
+    args = p.parse_args(argv)
+
+    proc, url = None, args.url
+    if args.serve:
+        port = _free_port()
+        proc, url = serve(port, args.server_workers), f"http://127.0.0.1:{port}"
+    try:
+        results = []
+        print(f"{'scenario':<14} {'req':>7} {'err':>5} {'req/s':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  (ms)")
+        for name in args.scenario or list(SCENARIOS):
+            r = run(url, name, args.concurrency, args.duration, args.requests)
+            results.append(r)
+            print(f"{r.scenario:<14} {r.requests:>7,} {r.errors:>5} {r.rps:>9,.1f} {r.p50_ms:>8.2f} {r.p90_ms:>8.2f} "
+                  f"{r.p99_ms:>8.2f} {r.max_ms:>8.2f}", flush=True)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "concurrency": args.concurrency, "results": [r._asdict() for r in results]},
+                      f, ensure_ascii=False, indent=1)
+        print(f"{args.out} に保存しました")
+    return 1 if any(r.errors for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
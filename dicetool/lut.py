@@ -0,0 +1,36 @@
+"""配列向けの早見表（ダメージボーナス区分と表示文字列）
+
+rules.db_code は比較を 5 回足し合わせる式なので、100 万行だと配列演算が十数回走ります。
+ここでは STR+SIZ の値ごとの区分コードを 1 度だけ表にして、np.take 1 回で引きます。
+表示文字列（"+1D4" など）は区分ごとに 1 つだけ作った（intern 済みの）文字列を配ります。
+表の範囲（SUM_MIN〜SUM_MAX）を外れる値が混ざっていたら、式（rules.db_code）で計算します。
+
+派生値（HP, SAN など）は掛け算・足し算 1〜2 回で出るので、表を引くより配列演算の方が速く、
+batch.derived_columns のままです。1 件ずつの derived_stats / damage_bonus の表は rules にあります。
+"""
+import sys
+
+import numpy as np
+
+from .rules import db_code, db_label
+
+SUM_MIN, SUM_MAX = -256, 1023   # 表で引く STR+SIZ の範囲
+DB_CODES = np.asarray(db_code(np.arange(SUM_MIN, SUM_MAX + 1)), dtype=np.int16)
+DB_LABELS = np.array([sys.intern(db_label(c)) for c in range(int(DB_CODES.max()) + 1)], dtype=object)
+
+
+def db_codes(total: np.ndarray) -> np.ndarray:
+    """STR+SIZ の配列 → 区分コード（int16）"""
+    total = np.asarray(total)
+    if total.size and (total.min() < SUM_MIN or total.max() > SUM_MAX):
+        return np.asarray(db_code(total.astype(np.int64)), dtype=np.int16)
+    return np.take(DB_CODES, np.subtract(total, SUM_MIN, dtype=np.intp))
+
+
+def db_labels(codes: np.ndarray) -> np.ndarray:
+    """区分コードの配列 → 表示文字列（object 配列。同じ区分は同じ文字列オブジェクト）"""
+    codes = np.asarray(codes)
+    if codes.size and codes.max() >= len(DB_LABELS):
+        labels = np.array([sys.intern(db_label(c)) for c in range(int(codes.max()) + 1)], dtype=object)
+        return labels[codes]
+    return np.take(DB_LABELS, codes)
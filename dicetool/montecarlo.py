@@ -0,0 +1,226 @@
+"""振り続ける統計（モンテカルロ。実測の頻度を厳密な分布と比べる）
+
+  python -m dicetool.montecarlo -n 100000000        … 1 億セット振って表を出す
+  python -m dicetool.montecarlo -n 1e9 --seed 1     … シードを決めて（同じシードなら同じ結果）
+
+StreamStats は能力・TOTAL・HP・職業P（STAT_KEYS）の値ごとの件数（ヒストグラム）と、
+ダメージボーナス区分ごとの件数を持ちます。ヒストグラムの幅は厳密な分布（odds）の値の範囲で最初に
+決まるので、何十億セット振ってもメモリは一定です（件数は int64）。
+平均と分散は Welford の更新（チャンクごとの平均・偏差平方和を合わせる Chan らの形）で、チャンクの
+平均・偏差平方和はそのチャンクのヒストグラムから出すので、振った値を float の配列にしません。
+
+MonteCarloRunner は別スレッドで CHUNK セットずつ振っては StreamStats に足します。
+画面が snapshot() を呼ばなくなって idle_timeout 秒たつと自分で止まります（セッションが閉じられても
+スレッドが残り続けないように）。
+"""
+import argparse
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from . import batch, odds
+from .lut import DB_LABELS, db_codes
+from .rng import RollStream
+from .rules import ABILS
+
+STAT_KEYS = ABILS + ["TOTAL", "HP", "職業P"]
+CHUNK = 200_000          # 1 回に振るセット数（1 回 40 ms ほど。止める・設定を変えるときの待ちもこれくらい）
+IDLE_TIMEOUT = 30.0      # snapshot が呼ばれないまま、この秒数たつと止まる
+_DB_CODE = {label: code for code, label in enumerate(DB_LABELS.tolist())}
+
+
+class StreamStats:
+    """振った分の件数・平均・分散（固定値/モディファイアの設定は作ったときのもの）"""
+
+    def __init__(self, keys: Optional[List[str]] = None,
+                 fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                 modifiers: Optional[Dict[str, int]] = None, apply_mod: bool = True):
+        self.keys = list(keys or STAT_KEYS)
+        self.settings = {"fixed_values": dict(fixed_values or {}), "modifiers": dict(modifiers or {}),
+                         "apply_mod": apply_mod}
+        self.exact: Dict[str, Dict[int, float]] = {k: odds.key_dist(k, **self.settings) for k in self.keys}
+        self.lo = {k: min(d) for k, d in self.exact.items()}
+        self.hist = {k: np.zeros(max(d) - min(d) + 1, np.int64) for k, d in self.exact.items()}
+        self.exact_db = odds.db_dist(**self.settings)
+        self.db_hist = np.zeros(max(_DB_CODE[t] for t in self.exact_db) + 1, np.int64)
+        self.n = 0
+        self.mean = np.zeros(len(self.keys))
+        self.m2 = np.zeros(len(self.keys))   # 偏差平方和（分散 = m2 / n）
+        self._names = frozenset(self.keys)
+
+    def update(self, finals: np.ndarray):
+        """最終値 (n, 能力数) を足す"""
+        m = len(finals)
+        if not m:
+            return
+        cols = batch.columns(finals, self._names)
+        b_mean = np.empty(len(self.keys))
+        b_m2 = np.empty(len(self.keys))
+        for i, k in enumerate(self.keys):
+            h = self.hist[k]
+            counts = np.bincount(np.subtract(cols[k], self.lo[k], dtype=np.intp), minlength=len(h))
+            if len(counts) > len(h):
+                raise ValueError(f"{k} に厳密な分布の範囲外の値があります（設定が変わった？）")
+            h += counts
+            vals = np.arange(self.lo[k], self.lo[k] + len(h))
+            b_mean[i] = counts @ vals / m
+            b_m2[i] = counts @ (vals - b_mean[i]) ** 2
+        # Welford（チャンク単位）: 今までの (n, mean, m2) とチャンクの (m, b_mean, b_m2) を合わせる
+        total = self.n + m
+        delta = b_mean - self.mean
+        self.mean += delta * (m / total)
+        self.m2 += b_m2 + delta ** 2 * (self.n * m / total)
+        self.n = total
+        str_siz = finals[:, ABILS.index("STR")] + finals[:, ABILS.index("SIZ")]
+        self.db_hist += np.bincount(db_codes(str_siz), minlength=len(self.db_hist))
+
+    def histogram(self, key: str) -> Dict[str, np.ndarray]:
+        """key の値ごとの 実測の割合 と 厳密な確率（"値" / "実測" / "理論"）"""
+        h = self.hist[key]
+        vals = np.arange(self.lo[key], self.lo[key] + len(h))
+        exact = np.array([self.exact[key].get(int(v), 0.0) for v in vals])
+        return {"値": vals, "実測": h / max(self.n, 1), "理論": exact}
+
+    def db_table(self) -> Dict[str, list]:
+        """ダメージボーナス区分ごとの 実測の割合 と 厳密な確率"""
+        tiers = list(self.exact_db)
+        counts = [int(self.db_hist[_DB_CODE[t]]) for t in tiers]
+        return {"区分": tiers, "件数": counts, "実測": [c / max(self.n, 1) for c in counts],
+                "理論": [self.exact_db[t] for t in tiers]}
+
+    def summary(self) -> Dict[str, list]:
+        """項目ごとの平均・標準偏差と厳密な値、平均のずれ（z）、全変動距離（TV）と χ² / 自由度"""
+        out: Dict[str, list] = {c: [] for c in ("項目", "平均", "理論平均", "標準偏差", "理論SD", "z", "TV", "χ²/自由度")}
+        for i, k in enumerate(self.keys):
+            hist = self.histogram(k)
+            vals, p = hist["値"], hist["理論"]
+            mu = float(p @ vals)
+            sd = float(np.sqrt(p @ (vals - mu) ** 2))
+            var = self.m2[i] / self.n if self.n else 0.0
+            expected = p * self.n
+            nz = expected > 0
+            chi2 = float(((self.hist[k][nz] - expected[nz]) ** 2 / expected[nz]).sum()) if self.n else 0.0
+            out["項目"].append(k)
+            out["平均"].append(float(self.mean[i]))
+            out["理論平均"].append(mu)
+            out["標準偏差"].append(float(np.sqrt(var)))
+            out["理論SD"].append(sd)
+            out["z"].append((float(self.mean[i]) - mu) / (sd / float(np.sqrt(self.n))) if self.n and sd else 0.0)
+            out["TV"].append(0.5 * float(np.abs(hist["実測"] - p).sum()) if self.n else 0.0)
+            out["χ²/自由度"].append(chi2 / max(int(nz.sum()) - 1, 1))
+        return out
+
+    def nbytes(self) -> int:
+        return sum(h.nbytes for h in self.hist.values()) + self.db_hist.nbytes + self.mean.nbytes + self.m2.nbytes
+
+
+# =========================
+# 別スレッドで振り続ける
+# =========================
+class MonteCarloRunner:
+    """StreamStats に CHUNK セットずつ足し続けるスレッド（start / stop、snapshot で読む）"""
+
+    def __init__(self, stats: StreamStats, rng: RollStream, chunk: int = CHUNK,
+                 idle_timeout: float = IDLE_TIMEOUT, limit: Optional[int] = None):
+        self.stats = stats
+        self.rng = rng
+        self.chunk = int(chunk)
+        self.idle_timeout = idle_timeout
+        self.limit = limit                 # このセット数で止まる（None なら止めるまで）
+        self.lock = threading.Lock()
+        self.error: Optional[BaseException] = None
+        self.elapsed = 0.0                 # 振っていた秒数（止めている間は数えない）
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._seen = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._seen = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, name="dicetool-montecarlo", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _loop(self):
+        s = self.stats.settings
+        t0 = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                n = self.chunk if self.limit is None else min(self.chunk, self.limit - self.stats.n)
+                if n <= 0:
+                    break
+                rb = batch.roll_batch(n, s["fixed_values"], s["modifiers"], s["apply_mod"], rng=self.rng,
+                                      with_dice=False)
+                with self.lock:
+                    self.stats.update(rb.finals)
+                    self.elapsed += time.perf_counter() - t0
+                t0 = time.perf_counter()
+                if self.idle_timeout is not None and time.monotonic() - self._seen > self.idle_timeout:
+                    break
+        except Exception as e:   # 画面に出す
+            self.error = e
+
+    def rate(self) -> float:
+        """1 秒あたりのセット数"""
+        return self.stats.n / self.elapsed if self.elapsed else 0.0
+
+    def touch(self):
+        """見ている印（idle_timeout を数え直す）"""
+        self._seen = time.monotonic()
+
+    def snapshot(self, key: str) -> Dict[str, Any]:
+        """画面用の今の値（ロックの中で小さな配列をコピーする。touch も兼ねる）"""
+        self.touch()
+        with self.lock:
+            return {"n": self.stats.n, "rate": self.rate(), "hist": self.stats.histogram(key),
+                    "summary": self.stats.summary(), "db": self.stats.db_table(), "running": self.running}
+
+
+# =========================
+# コマンドライン
+# =========================
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m dicetool.montecarlo", description="振り続ける統計")
+    p.add_argument("-n", "--sets", type=float, default=10_000_000, help="振るセット数（1e9 のようにも書ける）")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--chunk", type=int, default=CHUNK)
+    args = p.parse_args(argv)
+
+    stats = StreamStats()
+    runner = MonteCarloRunner(stats, RollStream(args.seed), args.chunk, idle_timeout=None, limit=int(args.sets))
+    runner.start()
+    try:
+        while runner.running:
+            time.sleep(1.0)
+            print(f"\r{stats.n:,} セット（{runner.rate():,.0f} セット/秒）", end="", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        runner.stop()
+    print(file=sys.stderr)
+    if runner.error is not None:
+        raise runner.error
+    summary = stats.summary()
+    print(f"シード {runner.rng.seed}  {stats.n:,} セット  メモリ {stats.nbytes():,} B")
+    print(f"{'項目':<6} {'平均':>9} {'理論平均':>9} {'SD':>8} {'理論SD':>8} {'z':>7} {'TV':>9} {'χ²/df':>7}")
+    for row in zip(*summary.values()):
+        k, mean, mu, sd, sd0, z, tv, chi = row
+        print(f"{k:<6} {mean:>9.4f} {mu:>9.4f} {sd:>8.4f} {sd0:>8.4f} {z:>7.2f} {tv:>9.2e} {chi:>7.3f}")
+    db = stats.db_table()
+    print("DB  " + "  ".join(f"{t}: {e:.5f}（理論 {p:.5f}）" for t, e, p in zip(db["区分"], db["実測"], db["理論"])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
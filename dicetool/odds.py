@@ -0,0 +1,226 @@
+"""厳密な確率分布（畳み込み）
+
+分布は (値→場合の数, 全場合の数) の組で持ち、整数のまま畳み込むので誤差がありません。
+固定値/モディファイアの設定ごとに lru_cache されるため、2回目以降の問い合わせは
+辞書を引くだけです。
+"""
+from fractions import Fraction
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from .dice import compile_spec
+from .rules import ABILS, ROLL_SPEC, damage_bonus
+
+Dist = Tuple[Dict[int, int], int]   # (値→場合の数, 全場合の数)
+Config = Tuple[Tuple[Optional[int], int, str], ...]   # 能力ごとの (固定値, 実効モディファイア, ダイス式)
+
+# 単一の能力だけで決まる派生値
+DERIVED_FROM = {
+    "MP": ("POW", 1), "SAN": ("POW", 5), "幸運": ("POW", 5),
+    "アイデア": ("INT", 5), "興味P": ("INT", 10),
+    "知識": ("EDU", 5), "職業P": ("EDU", 20),
+}
+
+
+# =========================
+# 分布の基本演算
+# =========================
+def convolve(a: Dist, b: Dist) -> Dist:
+    out: Dict[int, int] = {}
+    for va, ca in a[0].items():
+        for vb, cb in b[0].items():
+            out[va + vb] = out.get(va + vb, 0) + ca * cb
+    return out, a[1] * b[1]
+
+
+def map_values(d: Dist, f: Callable[[int], int]) -> Dist:
+    out: Dict[int, int] = {}
+    for v, c in d[0].items():
+        out[f(v)] = out.get(f(v), 0) + c
+    return out, d[1]
+
+
+def restrict(d: Dist, pred: Callable[[int], bool]) -> Dist:
+    """条件を満たす値だけ残す（全場合の数はそのまま＝部分確率）"""
+    return {v: c for v, c in d[0].items() if pred(v)}, d[1]
+
+
+def mass(d: Dist) -> Fraction:
+    return Fraction(sum(d[0].values()), d[1])
+
+
+def as_probs(d: Dist) -> Dict[int, float]:
+    return {v: c / d[1] for v, c in sorted(d[0].items())}
+
+
+@lru_cache(maxsize=None)
+def nd6(n: int) -> Dist:
+    d: Dist = ({0: 1}, 1)
+    for _ in range(n):
+        d = convolve(d, ({f: 1 for f in range(1, 7)}, 6))
+    return d
+
+
+# =========================
+# 設定（固定値・モディファイア）→ 分布
+# =========================
+def make_config(fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                modifiers: Optional[Dict[str, int]] = None,
+                apply_mod: bool = True) -> Config:
+    """dict の設定を lru_cache のキーにできる tuple へ（今の ROLL_SPEC の式も含める）"""
+    fixed_values = fixed_values or {}
+    modifiers = modifiers or {}
+    return tuple(
+        (None if fixed_values.get(a) is None else int(fixed_values[a]),
+         int(modifiers.get(a, 0)) if apply_mod else 0,
+         ROLL_SPEC[a][0])
+        for a in ABILS
+    )
+
+
+@lru_cache(maxsize=None)
+def _ability(fixed: Optional[int], mod: int, spec: str) -> Dist:
+    if fixed is not None:
+        return {fixed + mod: 1}, 1
+    return map_values(compile_spec(spec).dist(), lambda v: v + mod)
+
+
+def _abilities(cfg: Config) -> Dict[str, Dist]:
+    return {a: _ability(*cfg[i]) for i, a in enumerate(ABILS)}
+
+
+def _hp(con_siz: int) -> int:
+    return (con_siz + 1) // 2   # round_half_up((CON+SIZ)/2)
+
+
+@lru_cache(maxsize=256)
+def _key_dist(key: str, cfg: Config) -> Dist:
+    ab = _abilities(cfg)
+    if key in ab:
+        return ab[key]
+    if key in DERIVED_FROM:
+        src, mul = DERIVED_FROM[key]
+        return map_values(ab[src], lambda v: v * mul)
+    if key == "HP":
+        return map_values(convolve(ab["CON"], ab["SIZ"]), _hp)
+    if key == "TOTAL":
+        d: Dist = ({0: 1}, 1)
+        for a in ABILS:
+            d = convolve(d, ab[a])
+        return d
+    raise KeyError(key)
+
+
+@lru_cache(maxsize=256)
+def _db_dist(cfg: Config) -> Dict[str, Fraction]:
+    ab = _abilities(cfg)
+    counts, denom = convolve(ab["STR"], ab["SIZ"])
+    out: Dict[str, Fraction] = {}
+    for v, c in sorted(counts.items()):
+        tier = damage_bonus(v, 0)
+        out[tier] = out.get(tier, Fraction(0)) + Fraction(c, denom)
+    return out
+
+
+def key_dist(key: str,
+             fixed_values: Optional[Dict[str, Optional[int]]] = None,
+             modifiers: Optional[Dict[str, int]] = None,
+             apply_mod: bool = True) -> Dict[int, float]:
+    """ALL_KEYS_FOR_RULE の1項目の分布（値→確率）"""
+    return as_probs(_key_dist(key, make_config(fixed_values, modifiers, apply_mod)))
+
+
+def db_dist(fixed_values: Optional[Dict[str, Optional[int]]] = None,
+            modifiers: Optional[Dict[str, int]] = None,
+            apply_mod: bool = True) -> Dict[str, float]:
+    """ダメージボーナス区分の分布（区分→確率）"""
+    return {k: float(p) for k, p in _db_dist(make_config(fixed_values, modifiers, apply_mod)).items()}
+
+
+# =========================
+# 自動お気に入り条件の確率
+# =========================
+RuleKey = Tuple[Tuple[str, Optional[int], Optional[int]], ...]   # (項目, 下限, 上限)
+
+
+def _in_range(lo: Optional[int], hi: Optional[int], negate: bool) -> Callable[[int], bool]:
+    def pred(v: int) -> bool:
+        ok = (lo is None or v >= lo) and (hi is None or v <= hi)
+        return ok != negate
+    return pred
+
+
+def _all_of(preds) -> Callable[[int], bool]:
+    return lambda v: all(p(v) for p in preds)
+
+
+def _prob_all(conds: RuleKey, negate: bool, cfg: Config) -> Fraction:
+    """各条件（negate=True なら各条件の否定）がすべて成り立つ確率"""
+    per_key: Dict[str, list] = {}
+    for k, lo, hi in conds:
+        per_key.setdefault(k, []).append(_in_range(lo, hi, negate))
+
+    # 能力ごとに、その能力だけで決まる条件（能力自身・単独派生）で絞る
+    ab = dict(_abilities(cfg))
+    for k, preds in per_key.items():
+        if k in ab:
+            ab[k] = restrict(ab[k], _all_of(preds))
+        elif k in DERIVED_FROM:
+            src, mul = DERIVED_FROM[k]
+            ab[src] = restrict(ab[src], (lambda p, m: lambda v: p(v * m))(_all_of(preds), mul))
+
+    # HP は CON+SIZ の和だけで決まるので、和の分布を1変数として扱う
+    con_siz = convolve(ab.pop("CON"), ab.pop("SIZ"))
+    if "HP" in per_key:
+        hp_ok = _all_of(per_key["HP"])
+        con_siz = restrict(con_siz, lambda s: hp_ok(_hp(s)))
+
+    if "TOTAL" not in per_key:
+        p = mass(con_siz)
+        for d in ab.values():
+            p *= mass(d)
+        return p
+    total = con_siz
+    for d in ab.values():
+        total = convolve(total, d)
+    return mass(restrict(total, _all_of(per_key["TOTAL"])))
+
+
+@lru_cache(maxsize=1024)
+def _rule_fraction(conds: RuleKey, mode: str, cfg: Config) -> Fraction:
+    if not conds:
+        return Fraction(0)
+    if mode == "AND":
+        return _prob_all(conds, False, cfg)
+    return 1 - _prob_all(conds, True, cfg)
+
+
+def rule_key(auto_min: Dict[str, Optional[int]], auto_max: Dict[str, Optional[int]]) -> RuleKey:
+    keys = [k for k in dict.fromkeys(list(auto_min) + list(auto_max))
+            if auto_min.get(k) is not None or auto_max.get(k) is not None]
+    return tuple(
+        (k,
+         None if auto_min.get(k) is None else int(auto_min[k]),
+         None if auto_max.get(k) is None else int(auto_max[k]))
+        for k in keys
+    )
+
+
+def rule_fraction(mode: str,
+                  auto_min: Dict[str, Optional[int]],
+                  auto_max: Dict[str, Optional[int]],
+                  fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                  modifiers: Optional[Dict[str, int]] = None,
+                  apply_mod: bool = True) -> Fraction:
+    """1セットが min/max 条件（AND/OR）を満たす厳密な確率（条件なしは 0）"""
+    return _rule_fraction(rule_key(auto_min, auto_max), mode,
+                          make_config(fixed_values, modifiers, apply_mod))
+
+
+def rule_probability(mode: str,
+                     auto_min: Dict[str, Optional[int]],
+                     auto_max: Dict[str, Optional[int]],
+                     fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                     modifiers: Optional[Dict[str, int]] = None,
+                     apply_mod: bool = True) -> float:
+    return float(rule_fraction(mode, auto_min, auto_max, fixed_values, modifiers, apply_mod))
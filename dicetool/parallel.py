@@ -0,0 +1,260 @@
+"""複数プロセスでのまとめ振り（1 億セットから条件に合うものを集めるようなオフライン用）
+
+ジョブのストリーム（rng.RollStream）を chunk セットずつの区間に分け、区間をプロセスプールで振ります。
+区間 i は位置 offset + i * chunk * stride から始まるので、ワーカー数や処理の順番によらず結果は同じです。
+各ワーカーは
+  1. 区間を batch.roll_batch で振り
+  2. 条件式（ruleexpr。自動お気に入りと同じ書き方）で絞り込み
+  3. 残った行（最終値・ベース値・出目・乱数の位置）を共有メモリの自分の領域に直接書き
+区間ごとの件数だけを返します（大きな配列を pickle で送り返さない）。
+残すのはストリーム順で先頭から keep 件です。各ワーカーは自分の区間を若い順に処理するので、
+ワーカーごとの領域も keep 行あれば足ります（あふれた行はそれより前に keep 行あるので不要）。
+score（スコア式）を渡すと、先頭からではなくスコアの上位 keep 件を残します。各ワーカーは自分の
+上位 keep 件（topk.TopK）を持ち、区間ごとに領域を書き直します。親は全領域を合わせて上位 keep 件にします
+（同点は乱数の位置の若い方なので、これもワーカー数によらず同じ結果です）。
+派生値は最終値から決まるので書きません（ストアが追加時に計算します）。
+
+結果の RollBatch は履歴/★ のストア（RecordStore / SQLiteStore）の extend_batch にそのまま渡せます。
+コマンドラインからは
+  python -m dicetool.parallel 100000000 --expr "TOTAL >= 100" --keep 100 --db coc6_rolls.sqlite3
+  python -m dicetool.parallel 100000000 --score "職業P+興味P" --keep 100
+で、見つかったセットを画面と同じ SQLite ファイルの★に追加できます。
+"""
+import argparse
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import batch
+from .rng import NO_SEED, RollStream
+from .rules import ABILS, ROLL_SPEC
+from .ruleexpr import compile_rule, compile_score
+from .topk import TopK
+
+CHUNK = 1_000_000       # 1 タスクで振るセット数
+N_ABILS = len(ABILS)
+
+# 共有メモリ上の列（名前, 1 行の形, dtype）
+_FIELDS = [
+    ("finals", (N_ABILS,), np.int16),
+    ("base", (N_ABILS,), np.int16),
+    ("dice", (N_ABILS, batch.DICE_WIDTH), np.int8),
+    ("offsets", (), np.int64),
+]
+
+
+class ParallelResult(NamedTuple):
+    batch: batch.RollBatch   # 残った行（ストリーム順、最大 keep 件）
+    rolled: int              # 振ったセット数
+    passed: int              # 条件を満たしたセット数（keep で切る前）
+    seconds: float           # かかった時間
+    workers: int
+
+
+def _views(buf, regions: int, keep: int) -> Dict[str, np.ndarray]:
+    """共有メモリ → 列ごとの (regions, keep, ...) 配列"""
+    out, pos = {}, 0
+    for name, shape, dtype in _FIELDS:
+        full = (regions, keep) + shape
+        size = int(np.prod(full)) * np.dtype(dtype).itemsize
+        out[name] = np.ndarray(full, dtype, buffer=buf, offset=pos)
+        pos += size
+    return out
+
+
+def _nbytes(regions: int, keep: int) -> int:
+    return sum(regions * keep * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+               for _name, shape, dtype in _FIELDS)
+
+
+# =========================
+# ワーカー側
+# =========================
+_W: Dict[str, Any] = {}   # ワーカープロセスの状態（_init で設定）
+
+
+def _init(shm_name: str, regions: int, keep: int, free, specs: Dict[str, Tuple[str, str]],
+          fixed_values, modifiers, apply_mod: bool, src: Optional[str], score: Optional[str], seed: int,
+          with_dice: bool):
+    shm = shared_memory.SharedMemory(name=shm_name)   # 後始末（unlink）は親がする
+    ROLL_SPEC.update(specs)   # 親で書き換えた ROLL_SPEC に合わせる
+    region = free.get()
+    _W.update(shm=shm, views={k: v[region] for k, v in _views(shm.buf, regions, keep).items()},
+              region=region, used=0, keep=keep, fixed=fixed_values, mods=modifiers, apply_mod=apply_mod,
+              rule=compile_rule(src) if src else None, seed=seed, with_dice=with_dice,
+              top=TopK(keep, score, where=src) if score else None)
+
+
+def _work(task: Tuple[int, int, int]) -> Tuple[int, int, int, int, int]:
+    """区間 1 つを振って残った行を自分の領域に書く。戻り: (区間, 領域, 書いた位置, 書いた件数, 合格数)"""
+    i, offset, n = task
+    rb = batch.roll_batch(n, _W["fixed"], _W["mods"], _W["apply_mod"],
+                          rng=RollStream(_W["seed"], offset), with_dice=_W["with_dice"])
+    if _W["top"] is not None:
+        return _work_top(i, rb)
+    rows = (np.arange(n) if _W["rule"] is None
+            else np.flatnonzero(_W["rule"].mask(batch.columns(rb.finals))))
+    start = _W["used"]
+    take = rows[:_W["keep"] - start]
+    v, end = _W["views"], start + len(take)
+    v["finals"][start:end] = rb.finals[take]
+    v["base"][start:end] = rb.base[take]
+    if rb.dice is not None:
+        v["dice"][start:end] = rb.dice[take]
+    v["offsets"][start:end] = rb.offsets[take]
+    _W["used"] = end
+    return i, _W["region"], start, len(take), len(rows)
+
+
+def _work_top(i: int, rb: batch.RollBatch) -> Tuple[int, int, int, int, int]:
+    """スコア上位モード: 自分の上位 keep 件を更新して領域の先頭から書き直す"""
+    top = _W["top"]
+    before = top.matched
+    top.feed_batch(rb, {}, True, 0, order=rb.offsets)
+    v, rows, n = _W["views"], top.rows, len(top)
+    v["finals"][:n] = rows.finals
+    v["base"][:n] = rows.base
+    v["dice"][:n] = rows.dice
+    v["offsets"][:n] = rows.offsets
+    return i, _W["region"], 0, n, top.matched - before
+
+
+# =========================
+# 親側
+# =========================
+def roll_parallel(n: int,
+                  expr: Optional[str] = None,
+                  keep: int = 100_000,
+                  fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                  modifiers: Optional[Dict[str, int]] = None,
+                  apply_mod: bool = True,
+                  rng: Optional[RollStream] = None,
+                  workers: Optional[int] = None,
+                  chunk: int = CHUNK,
+                  with_dice: bool = True,
+                  score: Optional[str] = None) -> ParallelResult:
+    """n セットを workers プロセスで振り、expr を満たす行を先頭から keep 件集める（expr なしは全行）
+
+    score を渡すと先頭からではなく score の上位 keep 件（良い順）を集めます。
+    rng はジョブのストリーム（None なら新しいシード）で、振った分だけ先へ進めます。
+    workers が 1 以下ならこのプロセスで振ります（結果は同じ）。
+    """
+    n, keep, chunk = int(n), max(1, int(keep)), max(1, int(chunk))
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    if expr is not None:
+        compile_rule(expr)   # 構文エラーはワーカーを起動する前に出す
+    if score is not None:
+        compile_score(score)
+    rng = rng if rng is not None else RollStream()
+    stride = batch.stride()
+    start = rng.offset
+    rng.split(n * stride)   # このジョブの分だけストリームを進める
+    tasks = [(i, start + s * stride, min(chunk, n - s)) for i, s in enumerate(range(0, n, chunk))]
+    regions = min(workers, max(1, len(tasks)))
+    specs = {a: tuple(ROLL_SPEC[a]) for a in ABILS}
+
+    t0 = time.perf_counter()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, _nbytes(regions, keep)))
+    try:
+        views = _views(shm.buf, regions, keep)
+        ctx = get_context()
+        free = ctx.Queue() if regions > 1 else queue.Queue()
+        for r in range(regions):
+            free.put(r)
+        initargs = (shm.name, regions, keep, free, specs, fixed_values, modifiers, apply_mod, expr, score,
+                    rng.seed, with_dice)
+        if regions > 1:
+            with ProcessPoolExecutor(regions, mp_context=ctx, initializer=_init, initargs=initargs) as ex:
+                done = list(ex.map(_work, tasks))
+        else:
+            _init(*initargs)
+            try:
+                done = [_work(t) for t in tasks]
+            finally:
+                worker_shm = _W["shm"]
+                _W.clear()
+                worker_shm.close()
+        out = (_gather(views, sorted(done), keep, with_dice) if score is None
+               else _gather_top(views, done, keep, with_dice, score))
+        del views   # ビューが残っていると共有メモリを閉じられない
+    finally:
+        shm.close()
+        shm.unlink()
+    seconds = time.perf_counter() - t0
+    rb = batch.RollBatch(out["finals"], out["base"], out["dice"] if with_dice else None, rng.seed, out["offsets"])
+    return ParallelResult(rb, n, sum(d[4] for d in done), seconds, regions)
+
+
+def _gather(views: Dict[str, np.ndarray], done: List[Tuple[int, int, int, int, int]], keep: int,
+            with_dice: bool) -> Dict[str, np.ndarray]:
+    """区間順に各ワーカーの領域から行を集めて keep 件で切る（共有メモリを閉じる前にコピー）"""
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name, _s, _d in _FIELDS}
+    total = 0
+    for _i, region, start, count, _passed in done:
+        count = min(count, keep - total)
+        if count <= 0:
+            break
+        for name in parts:
+            if name != "dice" or with_dice:
+                parts[name].append(views[name][region, start:start + count].copy())
+        total += count
+    return {name: (np.concatenate(p) if p else np.zeros((0,) + shape, dtype))
+            for (name, shape, dtype), p in zip(_FIELDS, parts.values())}
+
+
+def _gather_top(views: Dict[str, np.ndarray], done: List[Tuple[int, int, int, int, int]], keep: int,
+                with_dice: bool, score: str) -> Dict[str, np.ndarray]:
+    """各ワーカーの上位 keep 件を合わせて上位 keep 件にする（良い順。同点は乱数の位置順）"""
+    counts: Dict[int, int] = {}
+    for _i, region, _start, count, _passed in done:   # 領域の件数は増える一方なので最大が最終
+        counts[region] = max(counts.get(region, 0), count)
+    top = TopK(keep, score)
+    for region, count in sorted(counts.items()):
+        part = {name: views[name][region, :count] for name, _s, _d in _FIELDS}
+        top.feed_batch(batch.RollBatch(part["finals"], part["base"], part["dice"], NO_SEED, part["offsets"]),
+                       {}, True, 0, order=part["offsets"])
+    rows = top.rows   # feed_batch がコピーを取るので、共有メモリを閉じても残る
+    return {"finals": rows.finals, "base": rows.base,
+            "dice": rows.dice if with_dice else None, "offsets": rows.offsets}
+
+
+# =========================
+# コマンドライン
+# =========================
+def main(argv: Optional[List[str]] = None):
+    p = argparse.ArgumentParser(prog="python -m dicetool.parallel", description="複数プロセスでまとめて振る")
+    p.add_argument("n", type=int, help="振るセット数")
+    p.add_argument("--expr", help="残す条件（例: 'TOTAL >= 100 and EDU >= 15'）。なしは全部")
+    p.add_argument("--keep", type=int, default=100, help="残す件数（ストリーム順で先頭から。--score なら上位から）")
+    p.add_argument("--score", help="上位を残すスコア式（例: 'TOTAL', '職業P+興味P', 'TOTAL + 2*EDU'）")
+    p.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    p.add_argument("--chunk", type=int, default=CHUNK, help="1 タスクのセット数")
+    p.add_argument("--seed", type=int, default=None, help="乱数のシード（既定: ランダム）")
+    p.add_argument("--db", help="結果を追加する SQLite ファイル（画面と同じファイルの★に入る）")
+    args = p.parse_args(argv)
+
+    res = roll_parallel(args.n, args.expr, args.keep, rng=RollStream(args.seed),
+                        workers=args.workers, chunk=args.chunk, score=args.score)
+    kept = len(res.batch.finals)
+    print(f"{res.rolled:,} セット / {res.seconds:.2f} 秒（{res.rolled / max(res.seconds, 1e-9):,.0f} セット/秒、"
+          f"{res.workers} プロセス）")
+    print(f"条件を満たした {res.passed:,} 件のうち {kept:,} 件を残しました（seed={res.batch.seed}）")
+    if args.db:
+        from .sqlite_store import SQLiteStore
+
+        favs = SQLiteStore(args.db, "favorites", 256, growable=True)
+        hist = SQLiteStore(args.db, "history")   # 保存済みの容量で開く（履歴は読むだけ）
+        uid0 = max(favs.max_uid(), hist.max_uid()) + 1
+        favs.extend_batch(res.batch, range(kept), {}, True, uid0)
+        print(f"{args.db} の★に {kept:,} 件を追加しました")
+        favs.close()
+        hist.close()
+
+
+if __name__ == "__main__":
+    main()
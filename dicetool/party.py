@@ -0,0 +1,213 @@
+"""バランスの取れたパーティー（能力差の小さい k 人を候補から選ぶ）
+
+  python -m dicetool.party -k 5                              … 候補 10 万セットから 5 人
+  python -m dicetool.party -k 4 --band TOTAL=4 --members "HP >= 12" --seed 1
+
+候補（batch.roll_batch で振った N セット）から k 人を選び、keys（既定 PARTY_KEYS = TOTAL / HP / 職業P / SAN）の
+ばらつき（最大 - 最小）を小さくします。項目ごとに単位が違うので、ばらつきは厳密な分布の標準偏差で割って
+比べ、いちばん大きい項目の値（spread）を最小にします。
+  - members … 1 人ずつの条件（ruleexpr の式。例: "HP >= 12"）。合わない候補は最初に除く
+  - bands   … 項目ごとのばらつきの上限（値の単位。例: {"TOTAL": 4}）
+  - prefer  … spread が同じ組が複数あれば、keys の先頭の項目が high（高い）/ mid（候補の中央）/ low（低い）組
+
+組み合わせ（10 万から 5 人なら 10^23 通り）は数えません。k 人のばらつきが d 以下 ⇔ 各項目の幅が
+d × 標準偏差 の箱に k 人入る、なので
+  1. 候補を keys の値の格子（TOTAL 90 × HP 16 × 職業P 16 × SAN 16 ほど）ごとの件数にまとめる
+  2. 箱の幅を決めたら、すべての位置の箱の件数を軸ごとの累積和の差（スライディングウィンドウ）で一度に数える
+  3. k 人入る箱のある最小の d を、d の候補（どれかの項目の幅が 1 目盛り変わる値）の二分探索で探す
+     （d を広げれば入る件数は減らないので、二分探索の打ち切りがそのまま枝刈りになる）
+見つけた箱の中から中心に近い k 人を取ります。spread は厳密に最小で、10 万件でも 0.1 秒ほどです。
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import batch, odds
+from .rng import RollStream
+from .ruleexpr import compile_rule
+from .rules import ABILS, DERIVED_KEYS
+
+PARTY_KEYS = ["TOTAL", "HP", "職業P", "SAN"]
+NUMERIC_KEYS = ABILS + ["TOTAL"] + DERIVED_KEYS   # そろえられる項目
+PREFER = ("high", "mid", "low")
+POOL = 100_000
+MAX_KEYS = 4
+MAX_CELLS = 4_000_000   # 格子のマス数の上限（件数の配列が int64 で 32 MB）
+
+
+class Party(NamedTuple):
+    rows: np.ndarray          # 選んだ候補の行番号（keys の先頭の項目の高い順）
+    spread: float             # ばらつき / 標準偏差 の最大（項目の中でいちばん大きいもの）
+    ranges: Dict[str, int]    # 項目ごとのばらつき（最大 - 最小。値の単位）
+    candidates: int           # members に合った候補の数
+
+
+def scales(keys: Sequence[str],
+           fixed_values: Optional[Dict[str, Optional[int]]] = None,
+           modifiers: Optional[Dict[str, int]] = None,
+           apply_mod: bool = True) -> Dict[str, float]:
+    """項目ごとの厳密な標準偏差（固定値などで 0 の項目は 0）"""
+    out = {}
+    for k in keys:
+        d = odds.key_dist(k, fixed_values, modifiers, apply_mod)
+        mu = sum(v * p for v, p in d.items())
+        out[k] = float(np.sqrt(sum((v - mu) ** 2 * p for v, p in d.items())))
+    return out
+
+
+def _check(keys: Optional[Sequence[str]], bands: Optional[Dict[str, int]], prefer: str) -> List[str]:
+    keys = list(keys or PARTY_KEYS)
+    if not 1 <= len(keys) <= MAX_KEYS or len(set(keys)) != len(keys):
+        raise ValueError(f"項目は重複なしで 1〜{MAX_KEYS} 個です")
+    if any(key not in NUMERIC_KEYS for key in keys):
+        raise ValueError(f"項目は {', '.join(NUMERIC_KEYS)} のどれかです")
+    if any(key not in keys or w < 0 for key, w in (bands or {}).items()):
+        raise ValueError("ばらつきの上限は、選んだ項目に 0 以上の値です")
+    if prefer not in PREFER:
+        raise ValueError(f"prefer は {' / '.join(PREFER)} です")
+    return keys
+
+
+def _box_counts(hist: np.ndarray, widths: Sequence[int]) -> np.ndarray:
+    """各マスを下端とする箱（軸 j の幅 widths[j] 目盛り）に入る件数"""
+    out = hist
+    for axis, w in enumerate(widths):
+        g = out.shape[axis]
+        cum = np.concatenate([np.zeros_like(np.take(out, [0], axis=axis)), np.cumsum(out, axis=axis)], axis=axis)
+        hi = np.minimum(np.arange(g) + w + 1, g)
+        out = np.take(cum, hi, axis=axis) - np.take(cum, np.arange(g), axis=axis)
+    return out
+
+
+def find_party(cols: Dict[str, np.ndarray], k: int, keys: Optional[Sequence[str]] = None,
+               scale: Optional[Dict[str, float]] = None, bands: Optional[Dict[str, int]] = None,
+               mask: Optional[np.ndarray] = None, prefer: str = "high") -> Party:
+    """候補の列（batch.columns）から spread が最小の k 人（条件に合う組がなければ ValueError）
+
+    scale は項目ごとの標準偏差（省略時は固定値・モディファイアなしの厳密な値）、mask は members の結果。
+    """
+    keys = _check(keys, bands, prefer)
+    scale = scale or scales(keys)
+    bands = bands or {}
+    sel = np.arange(len(cols[keys[0]])) if mask is None else np.flatnonzero(mask)
+    if not 1 <= k <= len(sel):
+        raise ValueError(f"条件に合う候補が {len(sel):,} 件なので {k} 人は選べません")
+
+    # 1. 格子（項目ごとに 最小値 と 目盛り = 値の差の最大公約数）
+    coords, steps, unit = [], [], []
+    for key in keys:
+        v = cols[key][sel].astype(np.int64)
+        lo = int(v.min())
+        step = int(np.gcd.reduce(v - lo)) or 1
+        coords.append((v - lo) // step)
+        steps.append(step)
+        unit.append(step / scale[key] if scale[key] > 0 else 0.0)   # 1 目盛りの spread
+    shape = tuple(int(c.max()) + 1 for c in coords)
+    if int(np.prod(shape)) > MAX_CELLS:
+        raise ValueError("項目の値の組み合わせが多すぎます（項目を減らしてください）")
+    hist = np.bincount(np.ravel_multi_index(coords, shape), minlength=int(np.prod(shape))).reshape(shape)
+    caps = [min(g - 1, bands[key] // s) if bands.get(key) is not None else g - 1
+            for key, g, s in zip(keys, shape, steps)]
+
+    def widths(d: float) -> List[int]:
+        return [c if u == 0 else min(c, int(np.floor(d / u + 1e-9))) for c, u in zip(caps, unit)]
+
+    # 3. d の候補（目盛りの境目）を二分探索
+    ds = np.unique(np.concatenate([np.arange(c + 1) * u for c, u in zip(caps, unit)]))
+    if _box_counts(hist, widths(float(ds[-1]))).max() < k:
+        raise ValueError("ばらつきの上限の中に収まる組がありません（上限を広げるか、候補を増やしてください）")
+    lo_i, hi_i = 0, len(ds) - 1
+    while lo_i < hi_i:
+        mid = (lo_i + hi_i) // 2
+        if _box_counts(hist, widths(float(ds[mid]))).max() >= k:
+            hi_i = mid
+        else:
+            lo_i = mid + 1
+    w = widths(float(ds[lo_i]))
+    counts = _box_counts(hist, w)
+
+    # 箱を選ぶ（先頭の項目の位置で prefer、同じなら候補の多い箱）
+    corners = np.nonzero(counts >= k)
+    first = corners[0]
+    target = {"high": -first, "low": first,
+              "mid": np.abs(first + w[0] / 2 - np.median(coords[0]))}[prefer]
+    best = np.lexsort((-counts[corners], target))[0]
+    corner = [int(c[best]) for c in corners]
+
+    # 箱の中から中心に近い k 人
+    inside = np.ones(len(sel), bool)
+    for c, lo, wd in zip(coords, corner, w):
+        inside &= (c >= lo) & (c <= lo + wd)
+    idx = np.flatnonzero(inside)
+    dist = sum(((coords[j][idx] - corner[j] - w[j] / 2) * (unit[j] or 1.0)) ** 2 for j in range(len(keys)))
+    pick = idx[np.argsort(dist, kind="stable")[:k]]
+    pick = pick[np.argsort(-coords[0][pick], kind="stable")]
+    ranges = {key: int(np.ptp(cols[key][sel[pick]])) for key in keys}
+    spread = max((ranges[key] / scale[key] if scale[key] > 0 else 0.0) for key in keys)
+    return Party(sel[pick], spread, ranges, len(sel))
+
+
+def balanced_party(k: int, pool: int = POOL,
+                   fixed_values: Optional[Dict[str, Optional[int]]] = None,
+                   modifiers: Optional[Dict[str, int]] = None,
+                   apply_mod: bool = True,
+                   rng: Optional[RollStream] = None,
+                   keys: Optional[Sequence[str]] = None,
+                   bands: Optional[Dict[str, int]] = None,
+                   members: str = "",
+                   prefer: str = "high") -> Tuple[batch.RollBatch, Party]:
+    """候補を pool セット振って find_party。戻り: (候補の RollBatch, Party)。式の誤りは RuleSyntaxError"""
+    keys = _check(keys, bands, prefer)
+    rule = compile_rule(members) if members.strip() else None
+    rb = batch.roll_batch(pool, fixed_values, modifiers, apply_mod, rng=rng)
+    cols = batch.columns(rb.finals, frozenset(keys) | (rule.names if rule is not None else frozenset()))
+    mask = None if rule is None else rule.mask(cols)
+    return rb, find_party(cols, k, keys, scales(keys, fixed_values, modifiers, apply_mod), bands, mask, prefer)
+
+
+# =========================
+# コマンドライン
+# =========================
+def _band(text: str) -> Tuple[str, int]:
+    key, _, value = text.partition("=")
+    if not value:
+        raise argparse.ArgumentTypeError("KEY=幅 の形です（例: TOTAL=4）")
+    return key.strip(), int(value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="python -m dicetool.party", description="バランスの取れたパーティー")
+    p.add_argument("-k", type=int, default=5, help="人数")
+    p.add_argument("--pool", type=int, default=POOL, help="候補のセット数")
+    p.add_argument("--keys", nargs="+", default=PARTY_KEYS, help="そろえる項目（最大 4 つ）")
+    p.add_argument("--band", type=_band, action="append", default=[], help="ばらつきの上限 KEY=幅")
+    p.add_argument("--members", default="", help="1 人ずつの条件式")
+    p.add_argument("--prefer", choices=PREFER, default="high")
+    p.add_argument("--seed", type=int, default=None)
+    args = p.parse_args(argv)
+
+    rng = RollStream(args.seed)
+    t0 = time.perf_counter()
+    try:
+        rb, party = balanced_party(args.k, args.pool, rng=rng, keys=args.keys, bands=dict(args.band),
+                                   members=args.members, prefer=args.prefer)
+    except ValueError as e:   # RuleSyntaxError も ValueError
+        print(e, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - t0
+    print(f"シード {rng.seed}  候補 {party.candidates:,} / {args.pool:,}  spread {party.spread:.3f}  "
+          f"{elapsed * 1000:.0f} ms")
+    print("ばらつき  " + "  ".join(f"{k}: {v}" for k, v in party.ranges.items()))
+    cols = batch.columns(rb.finals[party.rows])
+    show = ABILS + ["TOTAL"] + DERIVED_KEYS
+    print("  ".join(f"{c:>4}" for c in show))
+    for i in range(len(party.rows)):
+        print("  ".join(f"{int(cols[c][i]):>4}" for c in show))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
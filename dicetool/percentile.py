@@ -0,0 +1,89 @@
+"""パーセンタイルとレア度（履歴/★ の表の列）
+
+  - "TOTAL%" など（PCT_KEYS の各項目） … その値以下になる確率（%）。50 なら真ん中、99 なら上位 1%
+  - "レア度"（RARITY）                  … -log10 Π P(能力 >= 値)。能力は独立に振るので、
+                                         全能力でこのセット以上になる確率の -log10（3 なら 1/1000）
+
+分布は odds の厳密な分布で、ROLL_SPEC とモディファイア（適用した分）ごとに値 → 確率の表（CDF）を
+1 度だけ作って lru_cache に置きます。1 行の計算は表を引くだけ（O(1)）で、表全体は np.take でまとめて
+引きます。モディファイアの組み合わせが違う行が混ざっていれば、組み合わせごとに分けて引きます。
+レア度は 0.001 刻みの整数（× RARITY_SCALE）で足し合わせるので、並べ替えは TOTAL と同じ整数の並べ替えです
+（float の並べ替えは 100 万行で 2 倍ほど遅い）。表示するときに RARITY_SCALE で割ります。
+固定値の能力も振った場合の分布で比べます（範囲外の値は端の値として扱う）。
+"""
+from functools import lru_cache
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import odds
+from .batch import columns, spec_key
+from .rules import ABILS, DERIVED_KEYS
+
+PCT_KEYS = ["TOTAL"] + DERIVED_KEYS
+RARITY = "レア度"
+RANK_KEYS = [f"{k}%" for k in PCT_KEYS] + [RARITY]   # rank_columns が返す列
+RARITY_SCALE = 1000
+
+
+class _Table(NamedTuple):
+    lo: int
+    cdf: np.ndarray    # [0] = 値が範囲より下（0%）、[i] = P(X <= lo + i - 1) × 100
+    tail: np.ndarray   # [i] = -log10 P(X >= lo + i) × RARITY_SCALE（int32）
+
+
+@lru_cache(maxsize=256)
+def _table(key: str, specs: Tuple[str, ...], mods: Tuple[int, ...]) -> _Table:
+    """key の表（specs は今の ROLL_SPEC。変わったら別のキャッシュになる）"""
+    dist = odds.key_dist(key, modifiers=dict(zip(ABILS, mods)))
+    lo, hi = min(dist), max(dist)
+    p = np.array([dist.get(v, 0.0) for v in range(lo, hi + 1)])
+    cdf = np.concatenate([[0.0], np.minimum(np.cumsum(p), 1.0) * 100])
+    tail = -np.log10(np.cumsum(p[::-1])[::-1])   # 最大値 hi の確率は正なので 0 にはならない
+    return _Table(lo, cdf, np.round(tail * RARITY_SCALE).astype(np.int32))
+
+
+def _lookup(table: np.ndarray, values: np.ndarray, start: int) -> np.ndarray:
+    """table[values - start]（範囲外は端へ寄せる）"""
+    return np.take(table, values - start, mode="clip")
+
+
+def _groups(mods: np.ndarray, apply_mod: np.ndarray) -> Iterator[Tuple[Tuple[int, ...], Optional[np.ndarray]]]:
+    """適用したモディファイアの組み合わせごとの (モディファイア, 行)。1 種類だけなら行は None（全行）"""
+    mods = np.ascontiguousarray(mods, np.int8)
+    codes = np.where(apply_mod, mods.view(np.int64).ravel(), 0)   # 8 能力 × int8 = 1 行 8 バイト
+    if not len(codes) or (codes == codes[0]).all():
+        yield tuple(codes[:1].view(np.int8).tolist()) if len(codes) else (0,) * len(ABILS), None
+        return
+    uniq, inverse = np.unique(codes, return_inverse=True)
+    for g in range(len(uniq)):
+        yield tuple(uniq[g:g + 1].view(np.int8).tolist()), np.flatnonzero(inverse == g)
+
+
+def rarity(finals: np.ndarray, mods: np.ndarray, apply_mod: np.ndarray) -> np.ndarray:
+    """レア度 × RARITY_SCALE の列（int32。mods は (n, 8)、apply_mod は (n,)）"""
+    out = np.zeros(len(finals), np.int32)
+    specs = spec_key()
+    for m, rows in _groups(mods, apply_mod):
+        sub = finals if rows is None else finals[rows]
+        score = np.zeros(len(sub), np.int32)
+        for i, a in enumerate(ABILS):
+            t = _table(a, specs, m)
+            score += _lookup(t.tail, sub[:, i], t.lo)
+        out[slice(None) if rows is None else rows] = score
+    return out
+
+
+def rank_columns(finals: np.ndarray, mods: np.ndarray, apply_mod: np.ndarray,
+                 cols: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+    """RANK_KEYS の列（表示用の float。cols に batch.columns の結果があれば使い回す）"""
+    cols = cols if cols is not None else columns(finals, frozenset(PCT_KEYS))
+    out = {f"{k}%": np.empty(len(finals)) for k in PCT_KEYS}
+    specs = spec_key()
+    for m, rows in _groups(mods, apply_mod):
+        at = slice(None) if rows is None else rows
+        for k in PCT_KEYS:
+            t = _table(k, specs, m)
+            out[f"{k}%"][at] = _lookup(t.cdf, cols[k][at], t.lo - 1)
+    out[RARITY] = rarity(finals, mods, apply_mod) / RARITY_SCALE
+    return out
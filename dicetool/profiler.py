@@ -0,0 +1,167 @@
+"""再実行（rerun）ごとの区間計測（画面のデバッグ用。既定はオフ）
+
+Streamlit は操作のたびにスクリプト（または fragment）を頭から実行し直すので、どこが遅いかは
+1 回の実行の中の区間ごとに測らないと分かりません。RerunProfiler は
+  - run(kind)     … 1 回の実行（全体なら "app"、fragment だけならその key）。実行中に呼ぶと区間になる
+  - section(name) … 実行の中の区間（入れ子は "current/derived" のように / でつなぐ）
+で区間ごとの時間を集め、直近 window 回分を持ちます。同じ区間を 1 回の実行で何度も通ったら合計します。
+st.rerun() などで実行が途中で止まったときは interrupted として残します。
+実行の終わりに snapshot（画面側が渡す関数）を呼び、セッション状態の大きさや件数も一緒に残します。
+summary は区間ごとの p50/p90/p99、to_json はオフライン解析用のトレースです。
+オフのときの run/section は何もしない（ほぼコストのない）コンテキストです。
+計測中の実行はスレッドごとに持つので、ダウンロードのようにスクリプトの外（別スレッド）で呼ばれる関数も
+別の実行として測れます。
+"""
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+WINDOW = 200   # 持っておく実行の数
+_OFF = nullcontext()   # 計測しないときの区間
+
+
+class RerunProfiler:
+    """区間計測（enabled のときだけ記録）"""
+
+    def __init__(self, window: int = WINDOW, enabled: bool = False):
+        self.enabled = enabled
+        self.runs: deque = deque(maxlen=window)
+        self.snapshot: Optional[Callable[[], Dict[str, Any]]] = None   # 実行の終わりに残す状態
+        self._local = threading.local()   # 計測中の実行（run）と区間のパス
+        self._seq = 0
+
+    # =========================
+    # 計測
+    # =========================
+    @contextmanager
+    def run(self, kind: str, section: bool = True, snapshot: bool = True) -> Iterator[None]:
+        """1 回の実行を測る（すでに実行中なら kind という区間）
+
+        section=False なら kind を区間にしない（全体の実行用）。snapshot=False なら状態を残さない
+        （スクリプトの外で呼ばれてセッション状態を読めない関数用）。
+        """
+        if not self.enabled:
+            yield
+            return
+        local = self._local
+        if getattr(local, "run", None) is not None:
+            with self.section(kind):
+                yield
+            return
+        self._seq += 1
+        run = {"id": self._seq, "at": time.time(), "kind": kind, "ms": 0.0, "sections": {},
+               "interrupted": True}
+        local.run, local.path = run, []
+        t0 = time.perf_counter()
+        try:
+            if section:
+                with self.section(kind):
+                    yield
+            else:
+                yield
+            run["interrupted"] = False
+        finally:
+            local.run = None
+            run["ms"] = (time.perf_counter() - t0) * 1e3
+            if snapshot and self.snapshot is not None:
+                try:
+                    run.update(self.snapshot())
+                except Exception as e:   # 計測のせいで画面を落とさない
+                    run["snapshot_error"] = repr(e)
+            self.runs.append(run)
+
+    def section(self, name: str):
+        """実行中の区間を測る（実行の外や計測オフなら何もしない）"""
+        run = getattr(self._local, "run", None) if self.enabled else None
+        return _OFF if run is None else self._section(run, name)
+
+    @contextmanager
+    def _section(self, run: Dict[str, Any], name: str) -> Iterator[None]:
+        path = self._local.path
+        path.append(name)
+        key = "/".join(path)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            run["sections"][key] = run["sections"].get(key, 0.0) + (time.perf_counter() - t0) * 1e3
+            path.pop()
+
+    def timed(self, kind: str, snapshot: bool = True):
+        """関数を run(kind) で包むデコレータ（fragment の本体や、ダウンロードのように後で呼ばれる関数用）"""
+        def deco(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.run(kind, snapshot=snapshot):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def clear(self):
+        self.runs.clear()
+
+    # =========================
+    # 集計・書き出し
+    # =========================
+    def summary(self, qs: Sequence[float] = (50, 90, 99)) -> List[Dict[str, Any]]:
+        """区間ごとの回数・パーセンタイル・最大（ミリ秒）。実行全体は "[kind]" の行"""
+        samples: Dict[str, List[float]] = {}
+        for run in self.runs:
+            samples.setdefault(f"[{run['kind']}]", []).append(run["ms"])
+            for name, ms in run["sections"].items():
+                samples.setdefault(name, []).append(ms)
+        out = []
+        for name, ms in samples.items():
+            a = np.asarray(ms)
+            row = {"区間": name, "回数": len(a)}
+            row.update({f"p{q:g}": float(v) for q, v in zip(qs, np.percentile(a, qs))})
+            row["最大"] = float(a.max())
+            out.append(row)
+        return out
+
+    def last(self) -> Optional[Dict[str, Any]]:
+        return self.runs[-1] if self.runs else None
+
+    def to_json(self) -> str:
+        """トレース（実行ごとの区間・状態）を JSON で"""
+        return json.dumps({"window": self.runs.maxlen, "python": sys.version.split()[0],
+                           "runs": list(self.runs)}, ensure_ascii=False, indent=1)
+
+
+# =========================
+# セッション状態の大きさ
+# =========================
+def sizeof(obj: Any) -> int:
+    """おおよそのバイト数（配列・ストア・DataFrame は中身、dict/list/set は 1 段下まで）"""
+    nbytes = getattr(obj, "nbytes", None)
+    if callable(nbytes):     # RecordStore / SQLiteStore
+        return int(nbytes())
+    if isinstance(nbytes, (int, np.integer)):   # ndarray
+        return int(nbytes)
+    usage = getattr(obj, "memory_usage", None)
+    if callable(usage):      # pandas.DataFrame
+        return int(usage(index=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, Mapping):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(sys.getsizeof(v) for v in obj)
+    return size
+
+
+def state_sizes(state: Mapping[str, Any]) -> Dict[str, int]:
+    """キーごとのおおよそのバイト数"""
+    out = {}
+    for k in list(state.keys()):
+        try:
+            out[str(k)] = sizeof(state[k])
+        except Exception:   # 読めない値（ウィジェットの内部状態など）は数えない
+            continue
+    return out
@@ -0,0 +1,47 @@
+"""履歴/★ に保存するレコードのスキーマ
+
+レコードは dict で、表示用の値（能力・TOTAL・派生）と、採用時に現在セットへ
+戻すための内部値（先頭が `_` のキー）を持ちます。
+  _base   … ベース値（出目合計+固定加算 or 固定値）
+  _detail … 出目配列
+  _adds   … 固定加算
+  _mods   … ロール時のモディファイア
+  _apply_mod … モディファイアを最終値に適用したか
+  _uid    … 安定ID（チェック保持用）
+  _seed / _offset … 乱数のシードと位置（batch.replay で出目を作り直せる。ないものは作り直せない）
+"""
+from typing import Any, Dict, List, Optional
+
+from .rules import ABILS, derived_stats, total_score
+
+
+def make_record(finals: Dict[str, int],
+                base_vals: Dict[str, int],
+                detail: Dict[str, List[int]],
+                adds: Dict[str, int],
+                mods: Dict[str, int],
+                apply_mod: bool,
+                uid: Optional[int] = None,
+                seed: Optional[int] = None,
+                offset: Optional[int] = None) -> Dict[str, Any]:
+    rec = {
+        **finals,
+        "TOTAL": total_score(finals),
+        **derived_stats(finals),
+        "_base": base_vals, "_detail": detail, "_adds": adds,
+        "_mods": dict(mods),
+        "_apply_mod": apply_mod,
+    }
+    if uid is not None:
+        rec["_uid"] = uid
+    if offset is not None and seed is not None and seed >= 0:
+        rec["_seed"], rec["_offset"] = int(seed), int(offset)
+    return rec
+
+
+def record_base(rec: Dict[str, Any]) -> Dict[str, int]:
+    """ベース値（古いレコードで `_base` がなければ最終値からモディファイアを引いて復元）"""
+    finals = {a: int(rec[a]) for a in ABILS}
+    return rec.get("_base", {
+        a: finals[a] - (rec.get("_mods", {}).get(a, 0) if rec.get("_apply_mod", True) else 0) for a in ABILS
+    })
@@ -0,0 +1,99 @@
+"""再現できる乱数ストリーム（PCG64）
+
+乱数はすべて「シード seed の PCG64 が出す 64bit 語の列」から取り、何語目から使ったか（offset）を
+記録します。PCG64 は advance() で任意の位置へ O(log) で飛べるので、
+  - レコードは (seed, offset) だけで同じ出目を作り直せる（batch.replay）
+  - 1 つのジョブを複数のワーカーで分けても、各ワーカーが自分の担当位置へ飛べば結果は分け方によらない
+ようになります。
+
+SessionRNG はセッション（画面）ごとの乱数で、1 つのシードから
+  rolls … 全能力を振る/1 能力だけ振り直すときのストリーム
+  job() … まとめて振る・条件付きサンプリングなどのジョブごとの独立ストリーム（シードを派生）
+  gacha … 出身/性別ガチャ用の Generator
+を作ります。同じシードで同じ操作をすれば同じ結果になります。
+"""
+import secrets
+from typing import Optional, Tuple
+
+import numpy as np
+
+SEED_BITS = 63     # SQLite の INTEGER（符号付き 64bit）に入るように
+NO_SEED = -1       # 作り直せないレコード（古いデータ・外から追加したもの）
+NO_OFFSET = -1     # RollBatch.offsets で、その行だけ作り直せない印（自動配置で並べ替えた行）
+
+_JOB, _GACHA = 1, 2   # derive_seed の系統
+
+
+def new_seed() -> int:
+    return secrets.randbits(SEED_BITS)
+
+
+def derive_seed(seed: int, *path: int) -> int:
+    """seed と path から独立なシードを作る（SeedSequence のハッシュ。同じ入力なら同じ値）"""
+    state = np.random.SeedSequence([int(seed), *map(int, path)]).generate_state(1, np.uint64)
+    return int(state[0]) >> (64 - SEED_BITS)
+
+
+class RollStream:
+    """seed の PCG64 を先頭から順に使うカーソル（offset は 64bit 語の位置）"""
+
+    def __init__(self, seed: Optional[int] = None, offset: int = 0):
+        self.seed = new_seed() if seed is None else int(seed)
+        if not 0 <= self.seed < 1 << SEED_BITS:
+            raise ValueError(f"シードは 0〜2^{SEED_BITS}-1 の整数です: {seed}")
+        self.offset = int(offset)
+        self._bg = np.random.PCG64(self.seed)
+        self._bg.advance(self.offset)
+
+    def __repr__(self) -> str:
+        return f"RollStream(seed={self.seed}, offset={self.offset})"
+
+    def raw(self, n_words: int) -> Tuple[int, np.ndarray]:
+        """次の n_words 語。戻り: (先頭の offset, uint64 配列)"""
+        start = self.offset
+        words = self._bg.random_raw(int(n_words))
+        self.offset += int(n_words)
+        return start, words
+
+    def split(self, n_words: int) -> "RollStream":
+        """次の n_words 語を受け持つ別カーソルを作り、自分はその先へ進める（並列ワーカー用）"""
+        sub = RollStream(self.seed, self.offset)
+        self.offset += int(n_words)
+        self._bg.advance(int(n_words))
+        return sub
+
+
+def words_at(seed: int, offsets: np.ndarray, n_words: int) -> np.ndarray:
+    """各 offset から n_words 語ずつ（(len(offsets), n_words) の uint64）。offset の昇順に前から飛んで読む"""
+    offsets = np.asarray(offsets, np.int64)
+    out = np.empty((len(offsets), int(n_words)), np.uint64)
+    if not len(offsets):
+        return out
+    bg = np.random.PCG64(int(seed))
+    pos = 0
+    for i in np.argsort(offsets, kind="stable"):
+        off = int(offsets[i])
+        if off < pos:   # 同じ offset が重なったときだけ作り直す
+            bg, pos = np.random.PCG64(int(seed)), 0
+        bg.advance(off - pos)
+        out[i] = bg.random_raw(int(n_words))
+        pos = off + int(n_words)
+    return out
+
+
+class SessionRNG:
+    """セッション 1 つ分の乱数（シード 1 つからすべて決まる）"""
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rolls = RollStream(seed)
+        self.seed = self.rolls.seed
+        self.jobs = 0
+        self.gacha = np.random.Generator(np.random.PCG64(derive_seed(self.seed, _GACHA)))
+
+    def __repr__(self) -> str:
+        return f"SessionRNG(seed={self.seed}, rolls={self.rolls.offset}, jobs={self.jobs})"
+
+    def job(self) -> RollStream:
+        """次のジョブ用の独立ストリーム（k 番目のジョブのシード = derive_seed(seed, 1, k)）"""
+        self.jobs += 1
+        return RollStream(derive_seed(self.seed, _JOB, self.jobs))
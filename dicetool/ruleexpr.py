@@ -0,0 +1,438 @@
+"""自動お気に入りの条件式（小さな式言語 → 列単位の判定関数にコンパイル）
+
+例:
+  STR+SIZ >= 30
+  DB in {+1D4, +1D6}
+  HP >= 14 and (EDU >= 18 or INT >= 17)
+  12 <= HP <= 15 and not DB == -1D6
+
+使える名前は ALL_KEYS_FOR_RULE（能力・派生・TOTAL）と DB（ダメージボーナス区分）。
+コンパイル結果は NumPy の列（dict of ndarray）にも、1件の dict レコードにも使えます
+（演算子 & | ^ と比較だけで組み立てるので、値が int でも配列でも同じ関数で動く）。
+四則演算は int64 にしてから計算するので、int16 の列でも Python の int（1 件の判定・SQLite）と同じ値になります。
+0 で割る行（/ と // の右辺が 0）は、どの実装でも条件を満たさない扱いです（not で囲んでも同じ）。
+スコア式（compile_score）では、0 で割る行のスコアは -inf（いちばん悪い）です。
+同じ構文木から SQLite の WHERE 句（Rule.sql）も作るので、DB 側での絞り込みにも使えます。
+"""
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .rules import ALL_KEYS_FOR_RULE, db_code, db_code_of
+
+NAMES = set(ALL_KEYS_FOR_RULE) | {"DB"}
+KEYWORDS = {"and", "or", "not", "in"}
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<db>[+-]?\d+[dD]\d+)
+   |(?P<num>\d+(?:\.\d+)?)
+   |(?P<op>>=|<=|==|!=|//|[<>+\-*/(){},])
+   |(?P<name>[^\W\d]\w*)
+)""", re.X | re.U)
+
+Env = Dict[str, Any]
+Fn = Callable[[Env], Any]
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+class _Node:
+    """kind: "num" / "bool" / "db"（DB 区分コード）。const は数値リテラルのときだけ。sql は同じ式の SQL"""
+    __slots__ = ("kind", "fn", "sql", "const")
+
+    def __init__(self, kind: str, fn: Fn, sql: str, const: Optional[float] = None):
+        self.kind = kind
+        self.fn = fn
+        self.sql = sql
+        self.const = const
+
+
+def _tokenize(src: str) -> List[Tuple[str, str]]:
+    out, pos = [], 0
+    src = src.strip()
+    while pos < len(src):
+        m = _TOKEN.match(src, pos)
+        if not m or m.end() == pos:
+            raise RuleSyntaxError(f"読めない文字があります: {src[pos:pos + 10]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "name" and text.lower() in KEYWORDS:
+            kind, text = "kw", text.lower()
+        out.append((kind, text))
+    return out
+
+
+_CMP = {
+    ">=": lambda a, b: a >= b, "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b, "<": lambda a, b: a < b,
+    "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+}
+_ARITH = {
+    "+": lambda a, b: a + b, "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b, "/": lambda a, b: a / b, "//": lambda a, b: a // b,
+}
+_SQL_CMP = {">=": ">=", "<=": "<=", ">": ">", "<": "<", "==": "=", "!=": "<>"}
+_SQL_ARITH = {
+    "+": "({a} + {b})", "-": "({a} - {b})", "*": "({a} * {b})",
+    "/": "(CAST({a} AS REAL) / {b})",
+    "//": "(({a} - ((({a}) % ({b})) + ({b})) % ({b})) / ({b}))",   # SQLite の / は 0 方向に丸めるので床除算に直す
+}
+
+
+def sql_name(name: str) -> str:
+    """列名を SQL の識別子に（日本語名もそのまま使えるよう二重引用符で囲む）"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _Parser:
+    def __init__(self, src: str):
+        self.toks = _tokenize(src)
+        self.i = 0
+        self.names: set = set()
+        self.divisors: List[_Node] = []   # / と // の右辺（0 になる行は条件を満たさない）
+
+    def peek(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.toks[self.i] if self.i < len(self.toks) else (None, None)
+
+    def take(self, text: Optional[str] = None) -> Tuple[str, str]:
+        tok = self.peek()
+        if tok[0] is None or (text is not None and tok[1] != text):
+            raise RuleSyntaxError(f"'{text or '式'}' が必要です（位置 {self.i}）")
+        self.i += 1
+        return tok
+
+    def parse(self) -> _Node:
+        node = self.or_()
+        if self.peek()[0] is not None:
+            raise RuleSyntaxError(f"余分なトークン: {self.peek()[1]!r}")
+        return node
+
+    # --- 論理 ---
+    def or_(self) -> _Node:
+        node = self.and_()
+        while self.peek() == ("kw", "or"):
+            self.take()
+            right = self.and_()
+            a, b = _want_bool(node), _want_bool(right)
+            node = _Node("bool", lambda e, a=a, b=b: a(e) | b(e), f"({node.sql} OR {right.sql})")
+        return node
+
+    def and_(self) -> _Node:
+        node = self.not_()
+        while self.peek() == ("kw", "and"):
+            self.take()
+            right = self.not_()
+            a, b = _want_bool(node), _want_bool(right)
+            node = _Node("bool", lambda e, a=a, b=b: a(e) & b(e), f"({node.sql} AND {right.sql})")
+        return node
+
+    def not_(self) -> _Node:
+        if self.peek() == ("kw", "not"):
+            self.take()
+            inner = self.not_()
+            a = _want_bool(inner)
+            return _Node("bool", lambda e: a(e) ^ True, f"(NOT {inner.sql})")
+        return self.cmp()
+
+    # --- 比較（連鎖可）・集合 ---
+    def cmp(self) -> _Node:
+        left = self.sum_()
+        if self.peek() == ("kw", "in") or (self.peek() == ("kw", "not") and self._next_is_in()):
+            negate = self.take()[1] == "not"
+            if negate:
+                self.take("in")
+            items = self.set_(left)
+            f = left.fn
+            def fn(e, f=f, items=items):
+                v = f(e)
+                hit = v != v   # False（配列なら全 False）
+                for c in items:
+                    hit = hit | (v == c)
+                return hit
+            sql = f"({left.sql} {'NOT IN' if negate else 'IN'} ({', '.join(map(str, items))}))"
+            node = _Node("bool", fn, sql)
+            return _Node("bool", lambda e: fn(e) ^ True, sql) if negate else node
+
+        parts, sqls = [], []
+        while self.peek()[0] == "op" and self.peek()[1] in _CMP:
+            op = self.take()[1]
+            right = self.sum_()
+            (a, sa), (b, sb) = _coerce_db(left, right)
+            parts.append((lambda e, a=a, b=b, f=_CMP[op]: f(a(e), b(e))))
+            sqls.append(f"{sa} {_SQL_CMP[op]} {sb}")
+            left = right
+        if not parts:
+            return left
+        sql = "(" + " AND ".join(sqls) + ")"
+        if len(parts) == 1:
+            return _Node("bool", parts[0], sql)
+        return _Node("bool", lambda e: _all(parts, e), sql)
+
+    def _next_is_in(self) -> bool:
+        return self.i + 1 < len(self.toks) and self.toks[self.i + 1] == ("kw", "in")
+
+    def set_(self, left: _Node) -> List[Any]:
+        self.take("{")
+        items = []
+        while True:
+            kind, text = self.take()
+            sign = 1
+            if kind == "op" and text in "+-" and self.peek()[0] == "num":
+                sign = -1 if text == "-" else 1
+                kind, text = self.take()
+            if kind == "db":
+                if left.kind != "db":
+                    raise RuleSyntaxError(f"{text} は DB とだけ比較できます")
+                items.append(db_code_of(text if text[0] in "+-" else "+" + text))
+            elif kind == "num":
+                v = sign * float(text)
+                if left.kind == "db":
+                    if v != 0:
+                        raise RuleSyntaxError("DB は +1D4 のような区分表記で指定してください")
+                    items.append(db_code_of("+0"))
+                else:
+                    items.append(int(v) if v.is_integer() else v)
+            else:
+                raise RuleSyntaxError(f"集合の要素が不正です: {text!r}")
+            if self.peek() == ("op", "}"):
+                self.take()
+                return items
+            self.take(",")
+
+    # --- 算術 ---
+    def sum_(self) -> _Node:
+        node = self.term()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-"):
+            op = self.take()[1]
+            node = _arith(op, node, self.term())
+        return node
+
+    def term(self) -> _Node:
+        node = self.unary()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/", "//"):
+            op = self.take()[1]
+            right = self.unary()
+            if op in ("/", "//"):
+                self.divisors.append(right)
+            node = _arith(op, node, right)
+        return node
+
+    def unary(self) -> _Node:
+        if self.peek() == ("op", "-"):
+            self.take()
+            inner = self.unary()
+            a = _want_num(inner)
+            return _Node("num", lambda e: -_wide(a(e)), f"(-{inner.sql})")
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.atom()
+
+    def atom(self) -> _Node:
+        kind, text = self.take()
+        if kind == "num":
+            v = float(text)
+            v = int(v) if v.is_integer() else v
+            return _Node("num", lambda e: v, repr(v), const=v)
+        if kind == "db":
+            code = db_code_of(text if text[0] in "+-" else "+" + text)
+            return _Node("dblit", lambda e: code, str(code))
+        if kind == "name":
+            if text not in NAMES:
+                raise RuleSyntaxError(f"未知の項目名: {text}（使える名前: {', '.join(sorted(NAMES))}）")
+            self.names.add(text)
+            return _Node("db" if text == "DB" else "num", lambda e: e[text], sql_name(text))
+        if (kind, text) == ("op", "("):
+            node = self.or_()
+            self.take(")")
+            return node
+        raise RuleSyntaxError(f"予期しないトークン: {text!r}")
+
+
+def _all(parts, e):
+    out = parts[0](e)
+    for p in parts[1:]:
+        out = out & p(e)
+    return out
+
+
+def _want_bool(node: _Node) -> Fn:
+    if node.kind != "bool":
+        raise RuleSyntaxError("and / or / not の両側は比較式にしてください")
+    return node.fn
+
+
+def _want_num(node: _Node) -> Fn:
+    if node.kind != "num":
+        raise RuleSyntaxError("計算できるのは数値の項目だけです（DB は比較のみ）")
+    return node.fn
+
+
+def _wide(v):
+    """整数の列は int64 にしてから計算する（batch.columns の列は int16 なので、積などが桁あふれする）"""
+    dtype = getattr(v, "dtype", None)
+    return v.astype("int64") if dtype is not None and dtype.kind in "iub" and dtype.itemsize < 8 else v
+
+
+def _arith(op: str, a: _Node, b: _Node) -> _Node:
+    fa, fb, f = _want_num(a), _want_num(b), _ARITH[op]
+    return _Node("num", lambda e: f(_wide(fa(e)), _wide(fb(e))), _SQL_ARITH[op].format(a=a.sql, b=b.sql))
+
+
+def _coerce_db(a: _Node, b: _Node) -> Tuple[Tuple[Fn, str], Tuple[Fn, str]]:
+    """DB と比較するときは数値 0 を "+0" 区分として扱う。戻り: 両辺の (関数, SQL)"""
+    kinds = {a.kind, b.kind}
+    if "db" in kinds or "dblit" in kinds:
+        sides = []
+        for n in (a, b):
+            if n.kind == "num" and n.const == 0:
+                code = db_code_of("+0")
+                sides.append((lambda e, code=code: code, str(code)))
+            elif n.kind in ("db", "dblit"):
+                sides.append((n.fn, n.sql))
+            else:
+                raise RuleSyntaxError("DB は +1D4 のような区分表記と比較してください")
+        return sides[0], sides[1]
+    if "bool" in kinds:
+        raise RuleSyntaxError("比較の両側は数値にしてください")
+    return (a.fn, a.sql), (b.fn, b.sql)
+
+
+# =========================
+# コンパイル結果
+# =========================
+class Rule:
+    """コンパイル済みの条件式（mask: 列 → bool 配列 / test: レコード → bool / sql: WHERE 句）"""
+    __slots__ = ("source", "names", "_fn", "sql", "_divisors")
+
+    def __init__(self, source: str, names: frozenset, fn: Fn, sql: str, divisors: Tuple[Fn, ...] = ()):
+        self.source = source
+        self.names = names
+        self._fn = fn
+        self.sql = sql
+        self._divisors = divisors
+
+    def _env(self, cols: Env) -> Env:
+        if "DB" in self.names and "DB" not in cols:
+            cols = dict(cols)
+            total = cols["STR"] + cols["SIZ"]
+            if hasattr(total, "shape"):   # 列なら早見表（NumPy を使うのは列のときだけ）
+                from .lut import db_codes
+                cols["DB"] = db_codes(total)
+            else:
+                cols["DB"] = db_code(total)
+        return cols
+
+    def mask(self, cols: Env):
+        import numpy as np
+
+        env = self._env(cols)
+        n = len(next(iter(cols.values())))
+        with np.errstate(divide="ignore", invalid="ignore"):   # 0 除算の行は下で False にする
+            try:
+                out = self._fn(env)
+            except ZeroDivisionError:   # 定数どうしの 0 除算
+                return np.zeros(n, bool)
+            for d in self._divisors:
+                out = out & (d(env) != 0)
+        if not hasattr(out, "shape") or out.shape != (n,):   # 項目を参照しない定数式
+            return np.full(n, bool(out))
+        return out
+
+    def test(self, rec: Dict[str, Any]) -> bool:
+        try:
+            return bool(self._fn(self._env(rec)))
+        except ZeroDivisionError:
+            return False
+
+    def __repr__(self) -> str:
+        return f"Rule({self.source!r})"
+
+
+class Score(Rule):
+    """コンパイル済みの数値式（values: 列 → 数値配列 / value: レコード → 数値。0 で割る行は -inf）"""
+    __slots__ = ()
+
+    def values(self, cols: Env):
+        import numpy as np
+
+        env = self._env(cols)
+        n = len(next(iter(cols.values())))
+        with np.errstate(divide="ignore", invalid="ignore"):   # 0 除算の行は下で -inf にする
+            try:
+                out = self._fn(env)
+            except ZeroDivisionError:   # 定数どうしの 0 除算
+                return np.full(n, -np.inf)
+            if not hasattr(out, "shape") or out.shape != (n,):   # 項目を参照しない定数式
+                out = np.full(n, out)
+            if self._divisors:
+                bad = np.zeros(n, bool)
+                for d in self._divisors:
+                    bad |= d(env) == 0
+                if bad.any():
+                    out = np.where(bad, -np.inf, out)
+        return out
+
+    def value(self, rec: Dict[str, Any]) -> float:
+        try:
+            return self._fn(self._env(rec))
+        except ZeroDivisionError:
+            return float("-inf")
+
+
+@lru_cache(maxsize=256)
+def compile_rule(source: str) -> Rule:
+    p = _Parser(source)
+    node = p.parse()
+    sql = node.sql
+    if p.divisors:   # SQLite の 0 除算は NULL なので、ほかの実装と同じく行ごと外す
+        sql = "(" + " AND ".join([sql] + [f"({d.sql}) <> 0" for d in p.divisors]) + ")"
+    return Rule(source, frozenset(p.names), _want_bool(node), sql, tuple(_want_num(d) for d in p.divisors))
+
+
+@lru_cache(maxsize=256)
+def compile_score(source: str) -> Score:
+    p = _Parser(source)
+    node = p.parse()
+    sql = node.sql
+    if p.divisors:   # SQLite の 0 除算は NULL なので、ほかの実装と同じく -inf（-9e999）にする
+        zero = " OR ".join(f"({d.sql}) = 0" for d in p.divisors)
+        sql = f"(CASE WHEN {zero} THEN -9e999 ELSE {sql} END)"
+    return Score(source, frozenset(p.names), _want_num(node), sql, tuple(_want_num(d) for d in p.divisors))
+
+
+# =========================
+# min/max 表からの変換（既存の自動お気に入り表はこの式言語のフロントエンド）
+# =========================
+def minmax_source(mode: str,
+                  auto_min: Dict[str, Optional[int]],
+                  auto_max: Dict[str, Optional[int]]) -> Optional[str]:
+    """表の下限/上限を式に変換（条件なしは None）"""
+    flags = []
+    for k in ALL_KEYS_FOR_RULE:
+        lo, hi = auto_min.get(k), auto_max.get(k)
+        if lo is not None and hi is not None:
+            flags.append(f"{int(lo)} <= {k} <= {int(hi)}")
+        elif lo is not None:
+            flags.append(f"{k} >= {int(lo)}")
+        elif hi is not None:
+            flags.append(f"{k} <= {int(hi)}")
+    if not flags:
+        return None
+    joiner = " and " if mode == "AND" else " or "
+    return joiner.join(f"({f})" for f in flags) if len(flags) > 1 else flags[0]
+
+
+def combined_source(mode: str,
+                    auto_min: Dict[str, Optional[int]],
+                    auto_max: Dict[str, Optional[int]],
+                    expr: Optional[str] = None) -> Optional[str]:
+    """表の条件と自由入力の式を、同じ結合（AND/OR）でつなぐ"""
+    parts = [s for s in (minmax_source(mode, auto_min, auto_max), (expr or "").strip()) if s]
+    if not parts:
+        return None
+    joiner = " and " if mode == "AND" else " or "
+    return joiner.join(f"({s})" for s in parts) if len(parts) > 1 else parts[0]
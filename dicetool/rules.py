@@ -0,0 +1,126 @@
+"""CoC6 のルール定数と計算（派生値・ダメージボーナス・自動お気に入り条件）"""
+import math
+import sys
+from typing import Any, Dict, Optional
+
+# =========================
+# 定数
+# =========================
+ABILS = ["STR", "CON", "POW", "DEX", "APP", "SIZ", "INT", "EDU"]
+DERIVED_KEYS = ["HP", "MP", "SAN", "アイデア", "幸運", "知識", "職業P", "興味P"]
+ALL_KEYS_FOR_RULE = ABILS + DERIVED_KEYS + ["TOTAL"]
+
+# (ダイス式, 固定加算)。式は dice.compile_spec の書式（4d6kh3, 1d10+8, 2d6+6 reroll 1s なども可）。
+# 固定加算は表示用で、振るときは式の定数項を使う
+ROLL_SPEC = {
+    "STR": ("3d6", 0),  "CON": ("3d6", 0),  "POW": ("3d6", 0),
+    "DEX": ("3d6", 0),  "APP": ("3d6", 0),
+    "SIZ": ("2d6+6", 6), "INT": ("2d6+6", 6), "EDU": ("3d6+3", 3),
+}
+
+WARN_MIN = {k: 3 for k in ABILS}
+WARN_MAX = {k: 18 for k in ABILS}  # 警告のみ（ブロックしない）
+# EDU のみ 6～21 に拡張
+WARN_MIN["EDU"] = 6
+WARN_MAX["EDU"] = 21
+
+
+# =========================
+# 計算
+# =========================
+def round_half_up(x: float) -> int:
+    return int(math.floor(x + 0.5))
+
+
+def damage_bonus(str_val: int, siz_val: int) -> str:
+    total = str_val + siz_val
+    return _DB_BY_TOTAL.get(total) or db_label(db_code(total))
+
+
+# ダメージボーナス区分コード（小さいほど弱い）。5 以上は +2D6, +3D6, ...
+DB_TIERS = ["-1D6", "-1D4", "+0", "+1D4", "+1D6"]
+
+
+def db_code(total):
+    """STR+SIZ → 区分コード（int でも NumPy 配列でもそのまま計算できる式）"""
+    return ((total >= 13) * 1 + (total >= 17) * 1 + (total >= 25) * 1 + (total >= 33) * 1
+            + ((total - 33) // 8) * (total >= 41))
+
+
+def db_label(code: int) -> str:
+    return DB_TIERS[code] if code < len(DB_TIERS) else f"+{code - 3}D6"
+
+
+def db_code_of(label: str) -> int:
+    """区分表記 → コード（"+0" / "0" も可）"""
+    label = label.strip().upper()
+    if label in ("0", "+0", "-0"):
+        return DB_TIERS.index("+0")
+    if label in DB_TIERS:
+        return DB_TIERS.index(label)
+    if label.startswith("+") and label.endswith("D6") and label[1:-2].isdigit() and int(label[1:-2]) >= 2:
+        return int(label[1:-2]) + 3
+    raise ValueError(f"Unknown damage bonus: {label}")
+
+
+def derived_stats(stats: Dict[str, int]) -> Dict[str, int]:
+    CON = stats["CON"]; SIZ = stats["SIZ"]; POW = stats["POW"]; INT = stats["INT"]; EDU = stats["EDU"]
+    HP = _HP_BY_CON_SIZ.get(CON + SIZ)
+    if HP is None:
+        HP = round_half_up((CON + SIZ) / 2)
+    MP, SAN, LUCK = _POW_ROW.get(POW) or _pow_row(POW)
+    IDEA, INTEREST = _INT_ROW.get(INT) or _int_row(INT)
+    KNOW, OCCUPATION = _EDU_ROW.get(EDU) or _edu_row(EDU)
+    return {
+        "HP": HP, "MP": MP, "SAN": SAN,
+        "アイデア": IDEA, "幸運": LUCK, "知識": KNOW,
+        "職業P": OCCUPATION, "興味P": INTEREST,
+    }
+
+
+# =========================
+# 早見表（1 件ずつの derived_stats / damage_bonus 用。範囲外の値は式で計算）
+# 配列向けの表は lut.py
+# =========================
+LUT_RANGE = range(-64, 256)              # 能力値
+LUT_SUM_RANGE = range(-128, 512)         # 能力 2 つの和（CON+SIZ, STR+SIZ）
+
+
+def _pow_row(v: int):   # MP, SAN, 幸運
+    return v, v * 5, v * 5
+
+
+def _int_row(v: int):   # アイデア, 興味P
+    return v * 5, v * 10
+
+
+def _edu_row(v: int):   # 知識, 職業P
+    return v * 5, v * 20
+
+
+_POW_ROW = {v: _pow_row(v) for v in LUT_RANGE}
+_INT_ROW = {v: _int_row(v) for v in LUT_RANGE}
+_EDU_ROW = {v: _edu_row(v) for v in LUT_RANGE}
+_HP_BY_CON_SIZ = {s: round_half_up(s / 2) for s in LUT_SUM_RANGE}
+_DB_BY_TOTAL = {s: sys.intern(db_label(db_code(s))) for s in LUT_SUM_RANGE}   # 同じ区分は同じ文字列オブジェクト
+
+
+def total_score(stats: Dict[str, int]) -> int:
+    return sum(stats[a] for a in ABILS)
+
+
+# =========================
+# 自動お気に入り条件
+# =========================
+def auto_fav_ok(rec: Dict[str, Any],
+                enabled: bool,
+                mode: str,
+                auto_min: Dict[str, Optional[int]],
+                auto_max: Dict[str, Optional[int]],
+                expr: Optional[str] = None) -> bool:
+    """min/max 条件（と任意の条件式）を AND/OR で結合して判定（条件が1つもなければ False）"""
+    if not enabled:
+        return False
+    from .ruleexpr import combined_source, compile_rule   # ruleexpr が rules を import するため遅延
+    src = combined_source(mode, auto_min, auto_max, expr)
+    return src is not None and compile_rule(src).test(rec)
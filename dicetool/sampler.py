@@ -0,0 +1,98 @@
+"""条件付きサンプラー（自動お気に入り条件を満たすセットだけを N 件集める）
+
+合格率 p から 1 回に振る数を決めてバッチで棄却サンプリングします。
+期待される総ロール数は N / p です。p は min/max 表だけなら厳密値（odds.rule_probability）、
+条件式を含むときはパイロットロールによる推定値です。
+"""
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from . import batch, odds
+from .rng import NO_SEED, RollStream
+from .rules import ABILS
+from .ruleexpr import combined_source, compile_rule
+
+MAX_CHUNK = 2_000_000   # 1 回に振る最大セット数（メモリ上限）
+PILOT = 200_000         # 条件式の合格率を推定するパイロットロール数
+
+
+class SampleResult(NamedTuple):
+    batch: batch.RollBatch   # 条件を満たした N セット
+    rolled: int              # 実際に振ったセット数
+    p: float                 # 1 セットの合格率
+    exact: bool              # p が厳密値か（False ならパイロット推定）
+    expected_rolls: float    # 期待される総ロール数（N / p）
+
+
+@lru_cache(maxsize=64)
+def _pilot(src: str, cfg: odds.Config) -> float:
+    fixed_values = {a: cfg[i][0] for i, a in enumerate(ABILS)}
+    modifiers = {a: cfg[i][1] for i, a in enumerate(ABILS)}
+    rb = batch.roll_batch(PILOT, fixed_values, modifiers, True, rng=np.random.default_rng(0), with_dice=False)
+    return float(compile_rule(src).mask(batch.columns(rb.finals)).mean())
+
+
+def acceptance(mode: str,
+               auto_min: Dict[str, Optional[int]],
+               auto_max: Dict[str, Optional[int]],
+               expr: Optional[str] = None,
+               fixed_values: Optional[Dict[str, Optional[int]]] = None,
+               modifiers: Optional[Dict[str, int]] = None,
+               apply_mod: bool = True) -> Tuple[float, bool]:
+    """1 セットの合格率と、それが厳密値かどうか（条件なしは (0, True)）"""
+    if not (expr or "").strip():
+        return odds.rule_probability(mode, auto_min, auto_max, fixed_values, modifiers, apply_mod), True
+    src = combined_source(mode, auto_min, auto_max, expr)
+    return _pilot(src, odds.make_config(fixed_values, modifiers, apply_mod)), False
+
+
+def roll_until(n_fav: int,
+               mode: str,
+               auto_min: Dict[str, Optional[int]],
+               auto_max: Dict[str, Optional[int]],
+               fixed_values: Optional[Dict[str, Optional[int]]] = None,
+               modifiers: Optional[Dict[str, int]] = None,
+               apply_mod: bool = True,
+               rng: Union[RollStream, np.random.Generator, None] = None,
+               max_rolls: int = 1_000_000_000,
+               expr: Optional[str] = None) -> SampleResult:
+    """条件を満たすセットが n_fav 件そろうまで振る（max_rolls に達したらそこまでの分）
+
+    rng が RollStream（None なら新しいシード）なら、結果の各行は (seed, offset) で replay できます。
+    """
+    src = combined_source(mode, auto_min, auto_max, expr)
+    if src is None:
+        raise ValueError("条件が指定されていません")
+    p, exact = acceptance(mode, auto_min, auto_max, expr, fixed_values, modifiers, apply_mod)
+    if exact and p <= 0:
+        raise ValueError("条件を満たすセットは出ません（確率 0）")
+    p_size = max(p, 0.5 / PILOT)   # 推定で 0 件でも振れるように
+    rule = compile_rule(src)
+    rng = rng if rng is not None else RollStream()
+
+    parts = []
+    got = rolled = 0
+    while got < n_fav and rolled < max_rolls:
+        need = n_fav - got
+        # 期待値より少し多め（+3σ 相当）に振って、だいたい 1 回で終わらせる
+        size = int(need / p_size + 3 * np.sqrt(need * (1 - p_size)) / p_size) + 1
+        size = max(1, min(size, MAX_CHUNK, max_rolls - rolled))
+        rb = batch.roll_batch(size, fixed_values, modifiers, apply_mod, rng=rng)
+        mask = rule.mask(batch.columns(rb.finals))
+        rows = mask.nonzero()[0][:need]
+        if len(rows):
+            parts.append(batch.RollBatch(rb.finals[rows], rb.base[rows], rb.dice[rows], rb.seed,
+                                         None if rb.offsets is None else rb.offsets[rows]))
+            got += len(rows)
+        rolled += size
+
+    out = batch.RollBatch(
+        np.concatenate([b.finals for b in parts]) if parts else np.zeros((0, len(ABILS)), np.int16),
+        np.concatenate([b.base for b in parts]) if parts else np.zeros((0, len(ABILS)), np.int16),
+        np.concatenate([b.dice for b in parts]) if parts else np.zeros((0, len(ABILS), batch.DICE_WIDTH), np.int8),
+        parts[0].seed if parts else NO_SEED,
+        np.concatenate([b.offsets for b in parts]) if parts and parts[0].offsets is not None else None,
+    )
+    return SampleResult(out, rolled, p, exact, n_fav / p if p > 0 else float("inf"))
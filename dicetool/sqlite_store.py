@@ -0,0 +1,405 @@
+"""履歴/★ の SQLite 版ストア（再起動しても残る）
+
+RecordStore と同じメソッドを持ち、1 テーブル = 1 ストアです（履歴と★は同じファイルの別テーブル）。
+  - WAL モード・synchronous=NORMAL。まとめて振った分は 1 トランザクションの executemany で入れる
+  - 並べ替え・絞り込み・ページ送りは SQL（ORDER BY ... LIMIT/OFFSET、WHERE は ruleexpr の Rule.sql）
+  - 能力・TOTAL・HP にインデックス（末尾に rowid = seq が付くので同値の並びもインデックス順）。
+    単一能力の派生値（MP, 職業P など）は元の能力の列で並べ替えるので、同じインデックスが使える
+行の新旧は seq（INTEGER PRIMARY KEY）で表し、新しい順 = seq の降順です。
+同じファイルをほかの接続（別のセッション・parallel --db）も書くので、書き込む前と len / version を見るときに
+PRAGMA data_version で変化を調べ、変わっていれば行数と容量を読み直します。
+容量はテーブルを作ったときから meta テーブルに保存し、開き直したときはそちらを使います
+（容量の記録がない古いファイルは、保存済みの行を消さないよう 行数 と 引数 の大きい方にします）。
+乱数のシードと位置（rng_seed, rng_offset）の列がない古いファイルは、開いたときに列を足します。
+レア度（percentile.RARITY）は並べ替えにインデックスを使えるよう、追加時に計算して整数（× RARITY_SCALE）の
+列に持ちます（列がない古いファイルは開いたときに保存済みの行から計算して埋める）。パーセンタイルは表示する行だけです。
+大量追加はインデックス更新が支配的で、おおよそ 10 万件/1〜2 秒です。
+"""
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from .batch import DICE_WIDTH, RollBatch, columns, derived_columns
+from .odds import DERIVED_FROM
+from .percentile import RARITY, rank_columns, rarity
+from .rng import NO_SEED
+from .lut import db_codes
+from .rules import ABILS, DERIVED_KEYS
+from .ruleexpr import sql_name
+from .store import DISPLAY_KEYS, N_ABILS, PAGE_KEYS, Rows, _batch_seeds, _mods_row, empty_rows, record_rows
+
+# 値を持つ列（表示列＋DB 区分）。base/dice/mods は表示しないので BLOB にまとめる
+VALUE_KEYS = DISPLAY_KEYS + ["DB"]
+INDEXED_KEYS = ABILS + ["TOTAL", "HP"]
+SORT_COLUMN = {k: src for k, (src, _mul) in DERIVED_FROM.items()}   # 派生値 → 同じ順序になる能力
+DEFAULT_CAPACITY = 20   # 容量の記録がないテーブルを新しく作るときの容量（画面の履歴の既定と同じ）
+
+_RNG_COLS = {"rng_seed": NO_SEED, "rng_offset": 0}   # 後から足した列（古いファイルには既定値で追加）
+_ROW_COLS = ["uid"] + VALUE_KEYS + ["base", "dice", "mods", "apply_mod"] + list(_RNG_COLS) + [RARITY]
+_SELECT_ROWS = ", ".join(sql_name(c) for c in
+                         ["uid"] + ABILS + ["base", "dice", "mods", "apply_mod"] + list(_RNG_COLS))
+
+
+class SQLiteStore:
+    """SQLite のテーブル 1 つを新しい順のレコード列として扱う（growable=True なら容量無制限）"""
+
+    def __init__(self, path: str, table: str, capacity: Optional[int] = None, growable: bool = False):
+        self.path = path
+        self.table = table
+        self.growable = growable
+        self._version = 0
+        self._t = sql_name(table)
+        self.conn = sqlite3.connect(path, check_same_thread=False)   # Streamlit は再実行ごとにスレッドが変わる
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create()
+        self._size = self.conn.execute(f"SELECT COUNT(*) FROM {self._t}").fetchone()[0]
+        saved = self.conn.execute("SELECT value FROM meta WHERE key = ?", (f"{table}.capacity",)).fetchone()
+        if saved is not None:
+            # 保存済みの容量を使う（capacity は新しく作るときの値。開いただけで古い履歴を切り詰めない）
+            self.capacity = max(1, int(saved[0]))
+        else:
+            # 新しいテーブルか、容量を記録していなかった古いファイル。保存済みの行は消さない
+            self.capacity = max(1, int(capacity or DEFAULT_CAPACITY), self._size)
+            self._save_capacity()
+        if growable:
+            self.capacity = max(self.capacity, self._size)
+        else:
+            self._trim()
+        self._seen = self._data_version()
+
+    def _save_capacity(self):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"{self.table}.capacity", self.capacity))
+
+    def _create(self):
+        cols = ", ".join(f"{sql_name(k)} INTEGER NOT NULL" for k in VALUE_KEYS)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._t} ("
+                f"seq INTEGER PRIMARY KEY, uid INTEGER NOT NULL, {cols}, "
+                f"base BLOB NOT NULL, dice BLOB NOT NULL, mods BLOB NOT NULL, apply_mod INTEGER NOT NULL, "
+                f"{', '.join(f'{c} INTEGER NOT NULL DEFAULT {v}' for c, v in _RNG_COLS.items())}, "
+                f"{sql_name(RARITY)} INTEGER NOT NULL DEFAULT 0)"
+            )
+            have = {r[1] for r in self.conn.execute(f"PRAGMA table_info({self._t})")}
+            for c, v in _RNG_COLS.items():
+                if c not in have:
+                    self.conn.execute(f"ALTER TABLE {self._t} ADD COLUMN {c} INTEGER NOT NULL DEFAULT {v}")
+            if RARITY not in have:
+                self.conn.execute(f"ALTER TABLE {self._t} ADD COLUMN {sql_name(RARITY)} INTEGER NOT NULL DEFAULT 0")
+                self._fill_rarity()
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {sql_name(self.table + '_uid')} ON {self._t}(uid)")
+            for i, k in enumerate(INDEXED_KEYS):
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {sql_name(f'{self.table}_k{i}')} "
+                                  f"ON {self._t}({sql_name(k)})")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {sql_name(self.table + '_rarity')} "
+                              f"ON {self._t}({sql_name(RARITY)})")
+
+    def _fill_rarity(self, chunk: int = 100_000):
+        """レア度の列を保存済みの能力値とモディファイアから埋める（列を足したときに 1 度だけ）"""
+        names = ", ".join(sql_name(a) for a in ABILS)
+        last = 0
+        while True:
+            fetched = self.conn.execute(f"SELECT seq, {names}, mods, apply_mod FROM {self._t} "
+                                        f"WHERE seq > ? ORDER BY seq LIMIT ?", (last, chunk)).fetchall()
+            if not fetched:
+                return
+            seq, *rest = zip(*fetched)
+            finals = np.array(rest[:N_ABILS], np.int16).T
+            mods = np.frombuffer(b"".join(rest[N_ABILS]), np.int8).reshape(-1, N_ABILS)
+            score = rarity(finals, mods, np.array(rest[N_ABILS + 1], bool))
+            self.conn.executemany(f"UPDATE {self._t} SET {sql_name(RARITY)} = ? WHERE seq = ?",
+                                  zip(score.tolist(), seq))
+            last = seq[-1]
+
+    def _data_version(self) -> int:
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        """ほかの接続（別のセッション・parallel --db）が書き込んでいたら、行数と容量を読み直して version を進める"""
+        seen = self._data_version()
+        if seen == self._seen:
+            return
+        self._seen = seen
+        self._size = self.conn.execute(f"SELECT COUNT(*) FROM {self._t}").fetchone()[0]
+        saved = self.conn.execute("SELECT value FROM meta WHERE key = ?", (f"{self.table}.capacity",)).fetchone()
+        if saved is not None:
+            self.capacity = max(1, int(saved[0]))
+        if self.growable:
+            self.capacity = max(self.capacity, self._size)
+        self._version += 1
+
+    @property
+    def version(self) -> int:
+        """中身が変わるたびに増える（表示キャッシュのキー。ほかの接続の書き込みでも増える）"""
+        self._sync()
+        return self._version
+
+    def __len__(self) -> int:
+        self._sync()
+        return self._size
+
+    def close(self):
+        self.conn.close()
+
+    # =========================
+    # 追加
+    # =========================
+    def extend(self,
+               finals: np.ndarray,
+               base: np.ndarray,
+               dice: Optional[np.ndarray],
+               mods: np.ndarray,
+               apply_mod,
+               uids: np.ndarray,
+               seeds=NO_SEED,
+               offsets=0):
+        """古い順に並んだ n 行を追加（mods/apply_mod/seeds/offsets は行ごとでも全体共通でもよい）"""
+        n = len(finals)
+        if n == 0:
+            return
+        self._sync()
+        if self.growable and self._size + n > self.capacity:
+            self.capacity = self._size + n
+        if n > self.capacity:   # 入りきらない分は古い方から捨てる
+            cut = n - self.capacity
+            finals, base, uids = finals[cut:], base[cut:], uids[cut:]
+            dice = None if dice is None else dice[cut:]
+            mods = mods[cut:] if np.ndim(mods) == 2 else mods
+            apply_mod, seeds, offsets = (a[cut:] if np.ndim(a) == 1 else a for a in (apply_mod, seeds, offsets))
+            n = self.capacity
+
+        finals = np.asarray(finals, np.int16)
+        derived = derived_columns(finals)
+        values = np.column_stack(
+            [finals, finals.sum(axis=1)]
+            + [derived[k] for k in DERIVED_KEYS]
+            + [db_codes(finals[:, ABILS.index("STR")] + finals[:, ABILS.index("SIZ")])]
+        ).tolist()
+        base_b = _blobs(np.asarray(base, "<i2"))
+        dice_b = _blobs(np.zeros((n, N_ABILS, DICE_WIDTH), np.int8) if dice is None else np.asarray(dice, np.int8))
+        mods = np.broadcast_to(np.asarray(mods, np.int8), (n, N_ABILS))
+        mods_b = _blobs(mods)
+        apply_a = np.broadcast_to(np.asarray(apply_mod, bool), (n,))
+        apply_l = apply_a.astype(int).tolist()
+        rarity_l = rarity(finals, mods, apply_a).tolist()
+        uid_l = np.asarray(uids, np.int64).tolist()
+        seed_l, offset_l = (np.broadcast_to(np.asarray(a, np.int64), (n,)).tolist() for a in (seeds, offsets))
+
+        marks = ", ".join("?" * len(_ROW_COLS))
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {self._t} ({', '.join(sql_name(c) for c in _ROW_COLS)}) VALUES ({marks})",
+                ((u, *v, b, d, m, a, sd, o, r)
+                 for u, v, b, d, m, a, sd, o, r in zip(uid_l, values, base_b, dice_b, mods_b, apply_l, seed_l,
+                                                       offset_l, rarity_l)),
+            )
+        self._size += n
+        self._trim()
+        self._version += 1
+
+    def extend_batch(self, rb: RollBatch, rows, mods: Dict[str, int], apply_mod: bool, uid_start: int):
+        """RollBatch の指定行を、rows の先頭が一番上（最新）に来るよう追加（_uid は uid_start + 行番号）"""
+        rows = np.asarray(rows, dtype=np.int64)[::-1]
+        self.extend(rb.finals[rows], rb.base[rows], None if rb.dice is None else rb.dice[rows],
+                    _mods_row(mods), apply_mod, uid_start + rows, *_batch_seeds(rb, rows))
+
+    def append(self, rec: Dict[str, Any]):
+        """dict レコード 1 件を追加"""
+        self.add_rows(record_rows(rec))
+
+    def add_rows(self, rows: Rows):
+        """Rows（新しい順）を、先頭が一番上に来るよう追加"""
+        r = slice(None, None, -1)
+        self.extend(rows.finals[r], rows.base[r], rows.dice[r], rows.mods[r], rows.apply_mod[r], rows.uids[r],
+                    rows.seeds[r], rows.offsets[r])
+
+    def copy_uids(self, other, uids: Iterable[int]) -> int:
+        """別ストア（RecordStore / SQLiteStore）の UID が一致する行を、並びを保って追加。戻り: 件数"""
+        rows = other.take_uids(uids)
+        self.add_rows(rows)
+        return len(rows.uids)
+
+    # =========================
+    # 参照（新しい順）
+    # =========================
+    def _select(self, tail: str, params=()) -> Rows:
+        cur = self.conn.execute(f"SELECT {_SELECT_ROWS} FROM {self._t} {tail}", params)
+        return _to_rows(cur.fetchall())
+
+    def _columns(self, names: List[str], tail: str, params=()) -> Dict[str, np.ndarray]:
+        cur = self.conn.execute(f"SELECT {', '.join(sql_name(c) for c in names)} FROM {self._t} {tail}", params)
+        data = np.array(cur.fetchall(), np.int64).reshape(-1, len(names))
+        return {c: data[:, i] for i, c in enumerate(names)}
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """表示用の列（能力・TOTAL・派生・_uid）を全件読み込む（新しい順）"""
+        cols = self._columns(DISPLAY_KEYS + ["uid"], "ORDER BY seq DESC")
+        cols["_uid"] = cols.pop("uid")
+        return cols
+
+    def finals(self) -> np.ndarray:
+        cols = self._columns(ABILS, "ORDER BY seq DESC")
+        return np.stack([cols[a] for a in ABILS], axis=1).astype(np.int16)
+
+    def uids(self) -> np.ndarray:
+        return self._columns(["uid"], "ORDER BY seq DESC")["uid"]
+
+    def max_uid(self) -> int:
+        return int(self.conn.execute(f"SELECT COALESCE(MAX(uid), 0) FROM {self._t}").fetchone()[0])
+
+    def head(self, n: int) -> Rows:
+        """新しい方から n 件"""
+        return self._select("ORDER BY seq DESC LIMIT ?", (int(n),))
+
+    def iter_chunks(self, size: int) -> Iterator[Rows]:
+        """新しい順に size 件ずつ（seq でキーセットページングするので OFFSET の読み飛ばしなし）"""
+        last = None
+        while True:
+            cond, params = ("", (int(size),)) if last is None else ("WHERE seq < ?", (last, int(size)))
+            fetched = self.conn.execute(
+                f"SELECT seq, {_SELECT_ROWS} FROM {self._t} {cond} ORDER BY seq DESC LIMIT ?", params).fetchall()
+            if not fetched:
+                return
+            last = fetched[-1][0]
+            yield _to_rows([r[1:] for r in fetched])
+
+    def take(self, idx) -> Rows:
+        """新しい順の index の行（idx の順。1 件ずつ引くので少数向け）"""
+        parts = [self._select("ORDER BY seq DESC LIMIT 1 OFFSET ?", (int(i),)) for i in idx]
+        return _concat(parts)
+
+    def take_uids(self, uids: Iterable[int]) -> Rows:
+        """UID が一致する行（新しい順）"""
+        with self.conn:
+            self._load_selection(uids)
+        return self._select("WHERE uid IN (SELECT uid FROM temp._sel) ORDER BY seq DESC")
+
+    def get(self, i: int) -> Dict[str, Any]:
+        """新しい順の i 件目を dict レコードにする"""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.take([i]).record(0)
+
+    def records(self, idx: Iterable[int]) -> List[Dict[str, Any]]:
+        rows = self.take(list(idx))
+        return [rows.record(i) for i in range(len(rows.uids))]
+
+    # =========================
+    # 並べ替え・絞り込み・ページ送り（SQL）
+    # =========================
+    @staticmethod
+    def _where(where) -> str:
+        return "" if where is None else f"WHERE {where.sql}"
+
+    def count(self, where=None) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self._t} {self._where(where)}").fetchone()[0]
+
+    def page(self, sort_key: str, ascending: bool, limit: int, offset: int = 0, where=None) -> Dict[str, np.ndarray]:
+        """並べ替え（と絞り込み）後の offset 件目から limit 件の表示列（並びは store.sort_order と同じ）"""
+        key = sql_name(SORT_COLUMN.get(sort_key, sort_key))
+        d = "ASC" if ascending else "DESC"
+        rows = self._select(f"{self._where(where)} ORDER BY {key} {d}, seq {d} LIMIT ? OFFSET ?",
+                            (int(limit), int(offset)))
+        cols = columns(rows.finals)   # 派生値とパーセンタイルは表示する行だけ
+        cols.update(rank_columns(rows.finals, rows.mods, rows.apply_mod, cols))
+        cols["_uid"] = rows.uids
+        return {c: cols[c] for c in PAGE_KEYS + ["_uid"]}
+
+    # =========================
+    # 削除・容量変更
+    # =========================
+    def _load_selection(self, uids: Iterable[int]):
+        """UID の集合を一時テーブル temp._sel に入れる（IN 句の引数上限を避ける）"""
+        c = self.conn
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS _sel (uid INTEGER PRIMARY KEY)")
+        c.execute("DELETE FROM temp._sel")
+        c.executemany("INSERT OR IGNORE INTO temp._sel VALUES (?)", ((int(u),) for u in uids))
+
+    def _trim(self):
+        """容量を超えた分を古い順に消す"""
+        over = self._size - self.capacity
+        if over <= 0:
+            return
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {self._t} WHERE seq IN "
+                              f"(SELECT seq FROM {self._t} ORDER BY seq LIMIT ?)", (over,))
+        self._size = self.capacity
+
+    def remove_uids(self, uids: Iterable[int]) -> int:
+        """UID が一致する行を削除。戻り: 削除件数"""
+        self._sync()
+        with self.conn:
+            self._load_selection(uids)
+            removed = self.conn.execute(
+                f"DELETE FROM {self._t} WHERE uid IN (SELECT uid FROM temp._sel)").rowcount
+        if removed:
+            self._size -= removed
+            self._version += 1
+        return removed
+
+    def resize(self, capacity: int):
+        """容量を変更（減らすときは新しい方から残す）"""
+        capacity = max(1, int(capacity))
+        self._sync()
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        self._save_capacity()
+        if self._size > capacity:
+            self._trim()
+            self._version += 1
+
+    def clear(self):
+        self._sync()
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {self._t}")
+        self._size = 0
+        self._version += 1
+
+    def nbytes(self) -> int:
+        """データベースファイル全体の大きさ（履歴と★の合計）"""
+        pages, size = (self.conn.execute(f"PRAGMA {p}").fetchone()[0] for p in ("page_count", "page_size"))
+        return pages * size
+
+
+def _blobs(a: np.ndarray) -> List[bytes]:
+    """行ごとのバイト列（base/dice/mods の BLOB）"""
+    raw = np.ascontiguousarray(a).reshape(len(a), -1)
+    return [r.tobytes() for r in raw]
+
+
+def _to_rows(fetched) -> Rows:
+    n = len(fetched)
+    if not n:
+        return _concat([])
+    uid, *rest = zip(*fetched)
+    finals = np.array(rest[:N_ABILS], np.int16).T
+    base_b, dice_b, mods_b, apply_l, seed_l, offset_l = rest[N_ABILS:]
+    return Rows(
+        np.ascontiguousarray(finals),
+        np.frombuffer(b"".join(base_b), "<i2").reshape(n, N_ABILS).astype(np.int16),
+        _dice_from_blobs(dice_b, n),
+        np.frombuffer(b"".join(mods_b), np.int8).reshape(n, N_ABILS).copy(),
+        np.array(apply_l, bool),
+        np.array(uid, np.int64),
+        np.array(seed_l, np.int64),
+        np.array(offset_l, np.int64),
+    )
+
+
+def _dice_from_blobs(blobs, n: int) -> np.ndarray:
+    """出目の BLOB → (n, 8, DICE_WIDTH)。幅の違う古いファイル（幅 3）も読めるよう末尾を 0 埋めする"""
+    raw = np.frombuffer(b"".join(blobs), np.int8).reshape(n, N_ABILS, -1)
+    out = np.zeros((n, N_ABILS, DICE_WIDTH), np.int8)
+    out[..., :raw.shape[2]] = raw
+    return out
+
+
+def _concat(parts: List[Rows]) -> Rows:
+    if not parts:
+        return empty_rows()
+    return Rows(*(np.concatenate(f) for f in zip(*parts)))
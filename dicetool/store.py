@@ -0,0 +1,355 @@
+"""履歴/★ の列指向リングバッファ
+
+1 レコード = 各列の 1 行（ベース値・出目・モディファイア・UID・乱数のシードと位置。1 行 81 バイト）。
+最終値はベース値 + モディファイア（適用したときだけ）、派生値と TOTAL は最終値から決まるので持たず、
+使うときに列でまとめて計算します（表示は並べ替え・絞り込みに使う列だけを全行分、残りは表示する行だけ）。
+バッファは容量の 2 倍を確保し、各行を i と i+capacity の 2 か所に書きます。
+こうすると「新しい順の最新 size 件」は常に連続領域になり、列はコピーなしの
+ビュー（逆順スライス）で返せます。追加は O(1)、容量超過分は古い順に消えます。
+
+SQLite 版（sqlite_store.SQLiteStore）も同じメソッドを持つので、画面側はどちらでも動きます。
+ストア間の受け渡しは Rows（新しい順の行の束）で行います。
+"""
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from .batch import DICE_WIDTH, RollBatch, columns, replay, spec_adds
+from .percentile import RANK_KEYS, RARITY, rank_columns, rarity
+from .records import make_record
+from .rng import NO_OFFSET, NO_SEED
+from .rules import ABILS, DERIVED_KEYS
+
+N_ABILS = len(ABILS)
+DISPLAY_KEYS = ABILS + ["TOTAL"] + DERIVED_KEYS   # columns() が返す列（と _uid）
+PAGE_KEYS = DISPLAY_KEYS + RANK_KEYS               # page() はパーセンタイルとレア度も返す
+INT16_MAX = int(np.iinfo(np.int16).max)
+
+
+class Rows(NamedTuple):
+    """ストアから取り出した行（新しい順）"""
+    finals: np.ndarray      # (n, 8) int16
+    base: np.ndarray        # (n, 8) int16
+    dice: np.ndarray        # (n, 8, DICE_WIDTH) int8（固定値の能力は 0）
+    mods: np.ndarray        # (n, 8) int8
+    apply_mod: np.ndarray   # (n,) bool
+    uids: np.ndarray        # (n,) int64
+    seeds: np.ndarray       # (n,) int64 乱数のシード（NO_SEED なら作り直せない）
+    offsets: np.ndarray     # (n,) int64 乱数の位置
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """i 行目を dict レコードにする（採用用）"""
+        finals = {a: int(self.finals[i, c]) for c, a in enumerate(ABILS)}
+        base = {a: int(self.base[i, c]) for c, a in enumerate(ABILS)}
+        detail = {a: [int(x) for x in self.dice[i, c] if x] for c, a in enumerate(ABILS)}
+        adds_c = spec_adds()
+        adds = {a: int(adds_c[c]) if detail[a] else 0 for c, a in enumerate(ABILS)}
+        mods = {a: int(self.mods[i, c]) for c, a in enumerate(ABILS)}
+        return make_record(finals, base, detail, adds, mods, bool(self.apply_mod[i]), uid=int(self.uids[i]),
+                           seed=int(self.seeds[i]), offset=int(self.offsets[i]))
+
+    def replayed(self) -> "Rows":
+        """(seed, offset) から出目とベース値を作り直した Rows（シードのない行と固定値の能力はそのまま）"""
+        base, dice = self.base.copy(), self.dice.copy()
+        for seed in np.unique(self.seeds[self.seeds != NO_SEED]).tolist():
+            rows = np.flatnonzero(self.seeds == seed)
+            rb = replay(seed, self.offsets[rows])
+            rolled = self.dice[rows].any(axis=2)   # 出目のない能力は固定値
+            base[rows] = np.where(rolled, rb.base, base[rows])
+            dice[rows] = np.where(rolled[..., None], rb.dice, dice[rows])
+        return self._replace(base=base, dice=dice)
+
+
+def sort_order(col: np.ndarray, ascending: bool) -> np.ndarray:
+    """並べ替え順（col は新しい順）。降順は同値を新しい順に、昇順はそのちょうど逆
+
+    SQLite 版の ORDER BY 値, seq と同じ並びになり、インデックス 1 本で両方向を読めます。
+    値が int16 に収まれば int16 のまま並べ替えます（NumPy の安定ソートが基数ソートになり、100 万行で 5 倍ほど速い）。
+    """
+    small = len(col) and -INT16_MAX <= col.min() and col.max() <= INT16_MAX
+    order = np.argsort(-col.astype(np.int16 if small else np.int64), kind="stable")
+    return order[::-1] if ascending else order
+
+
+class RecordStore:
+    """新しい順に並ぶ固定容量のレコード列（growable=True なら満杯で容量を倍にする）"""
+
+    def __init__(self, capacity: int, growable: bool = False):
+        self.growable = growable
+        self.version = 0      # 中身が変わるたびに +1（表示キャッシュのキー）
+        self._alloc(max(1, int(capacity)))
+
+    def _alloc(self, capacity: int):
+        self.capacity = capacity
+        n = 2 * capacity
+        self._base = np.zeros((n, N_ABILS), np.int16)
+        self._dice = np.zeros((n, N_ABILS, DICE_WIDTH), np.int8)
+        self._mods = np.zeros((n, N_ABILS), np.int8)
+        self._apply_mod = np.zeros(n, bool)
+        self._uid = np.zeros(n, np.int64)
+        self._seed = np.full(n, NO_SEED, np.int64)
+        self._offset = np.zeros(n, np.int64)
+        self._arrays = [self._base, self._dice, self._mods, self._apply_mod, self._uid, self._seed, self._offset]
+        self._written = 0     # これまでに書いた行数（書き込み位置 = _written % capacity）
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _window(self) -> slice:
+        """古い順の最新 size 件（常に連続）"""
+        start = (self._written - self._size) % self.capacity
+        return slice(start, start + self._size)
+
+    # =========================
+    # 追加
+    # =========================
+    def extend(self,
+               finals: np.ndarray,
+               base: np.ndarray,
+               dice: Optional[np.ndarray],
+               mods: np.ndarray,
+               apply_mod,
+               uids: np.ndarray,
+               seeds=NO_SEED,
+               offsets=0):
+        """古い順に並んだ n 行を追加（mods/apply_mod/seeds/offsets は行ごとでも全体共通でもよい）
+
+        finals は base + モディファイアなので保存しません（SQLiteStore と同じ引数にしてある）。
+        """
+        n = len(finals)
+        if n == 0:
+            return
+        if self.growable and self._size + n > self.capacity:
+            self.resize(max(2 * self.capacity, self._size + n))
+        if n > self.capacity:   # 入りきらない分は古い方から捨てる
+            cut = n - self.capacity
+            finals, base, uids = finals[cut:], base[cut:], uids[cut:]
+            dice = None if dice is None else dice[cut:]
+            mods = mods[cut:] if np.ndim(mods) == 2 else mods
+            apply_mod, seeds, offsets = (a[cut:] if np.ndim(a) == 1 else a for a in (apply_mod, seeds, offsets))
+            n = self.capacity
+
+        cols = [base, 0 if dice is None else dice, mods, apply_mod, uids, seeds, offsets]
+        pos = self._written % self.capacity
+        first = min(n, self.capacity - pos)   # 折り返し前に書ける行数
+        for dst, src in zip(self._arrays, cols):
+            for off in (0, self.capacity):
+                if np.ndim(src) == dst.ndim:
+                    dst[pos + off:pos + off + first] = src[:first]
+                    dst[off:off + n - first] = src[first:]
+                else:
+                    dst[pos + off:pos + off + first] = src
+                    dst[off:off + n - first] = src
+        self._written += n
+        self._size = min(self.capacity, self._size + n)
+        self.version += 1
+
+    def extend_batch(self, rb: RollBatch, rows, mods: Dict[str, int], apply_mod: bool, uid_start: int):
+        """RollBatch の指定行を、rows の先頭が一番上（最新）に来るよう追加（_uid は uid_start + 行番号）"""
+        rows = np.asarray(rows, dtype=np.int64)[::-1]
+        self.extend(rb.finals[rows], rb.base[rows], None if rb.dice is None else rb.dice[rows],
+                    _mods_row(mods), apply_mod, uid_start + rows, *_batch_seeds(rb, rows))
+
+    def append(self, rec: Dict[str, Any]):
+        """dict レコード 1 件を追加"""
+        self.add_rows(record_rows(rec))
+
+    def add_rows(self, rows: Rows):
+        """Rows（新しい順）を、先頭が一番上に来るよう追加"""
+        r = slice(None, None, -1)
+        self.extend(rows.finals[r], rows.base[r], rows.dice[r], rows.mods[r], rows.apply_mod[r], rows.uids[r],
+                    rows.seeds[r], rows.offsets[r])
+
+    def copy_uids(self, other, uids: Iterable[int]) -> int:
+        """別ストア（RecordStore / SQLiteStore）の UID が一致する行を、並びを保って追加。戻り: 件数"""
+        rows = other.take_uids(uids)
+        self.add_rows(rows)
+        return len(rows.uids)
+
+    # =========================
+    # 参照（新しい順・コピーなし）
+    # =========================
+    def _rows(self, idx: np.ndarray) -> np.ndarray:
+        """新しい順の index → 物理行"""
+        w = self._window()
+        return w.stop - 1 - idx
+
+    def columns(self, names: Optional[frozenset] = None) -> Dict[str, np.ndarray]:
+        """表示用の列（能力・TOTAL・派生・_uid）。新しい順。names を渡すと派生と TOTAL は使う時だけ作る"""
+        cols = columns(self.finals(), names)
+        cols["_uid"] = self.uids()
+        return cols
+
+    def finals(self) -> np.ndarray:
+        """最終値 (size, 8)（新しい順。ベース値 + 適用したモディファイアから作る）"""
+        w = self._window()
+        return _finals(self._base[w], self._mods[w], self._apply_mod[w])[::-1]
+
+    def uids(self) -> np.ndarray:
+        w = self._window()
+        return self._uid[w][::-1]
+
+    def max_uid(self) -> int:
+        return int(self.uids().max()) if self._size else 0
+
+    def index_of(self, uids: Iterable[int]) -> np.ndarray:
+        """UID → 新しい順の index（見つかったものだけ、新しい順）"""
+        return np.flatnonzero(np.isin(self.uids(), np.fromiter(uids, np.int64)))
+
+    def head(self, n: int) -> Rows:
+        """新しい方から n 件"""
+        return self.take(np.arange(min(int(n), self._size)))
+
+    def iter_chunks(self, size: int) -> Iterator[Rows]:
+        """新しい順に size 件ずつ（エクスポート用。コピーは 1 チャンク分だけ）"""
+        for start in range(0, self._size, size):
+            yield self.take(np.arange(start, min(start + size, self._size)))
+
+    def take(self, idx) -> Rows:
+        """新しい順の index の行（idx の順）"""
+        r = self._rows(np.asarray(idx, dtype=np.int64))
+        base, mods, apply_mod = self._base[r], self._mods[r], self._apply_mod[r]
+        finals = _finals(base, mods, apply_mod)
+        return Rows(base.copy() if finals is base else finals, base, self._dice[r], mods, apply_mod, self._uid[r],
+                    self._seed[r], self._offset[r])
+
+    def take_uids(self, uids: Iterable[int]) -> Rows:
+        """UID が一致する行（新しい順）"""
+        return self.take(self.index_of(uids))
+
+    def get(self, i: int) -> Dict[str, Any]:
+        """新しい順の i 件目を dict レコードにする（採用・エクスポート用）"""
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        return self.take([i]).record(0)
+
+    def records(self, idx: Iterable[int]) -> List[Dict[str, Any]]:
+        rows = self.take(list(idx))
+        return [rows.record(i) for i in range(len(rows.uids))]
+
+    # =========================
+    # 並べ替え・絞り込み・ページ送り
+    # =========================
+    def _match(self, where, finals: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """条件式（ruleexpr.Rule）に合う新しい順の index（条件なしは None）"""
+        if where is None:
+            return None
+        return np.flatnonzero(where.mask(columns(self.finals() if finals is None else finals, where.names)))
+
+    def count(self, where=None) -> int:
+        idx = self._match(where)
+        return self._size if idx is None else len(idx)
+
+    def page(self, sort_key: str, ascending: bool, limit: int, offset: int = 0, where=None) -> Dict[str, np.ndarray]:
+        """並べ替え（と絞り込み）後の offset 件目から limit 件の表示列（PAGE_KEYS と _uid）"""
+        finals = self.finals()
+        idx = self._match(where, finals)
+        if sort_key == RARITY:   # レア度も TOTAL と同じく全行分を整数の列でまとめて出す（表を引くだけ）
+            w = self._window()
+            key = rarity(finals, self._mods[w][::-1], self._apply_mod[w][::-1])
+        else:
+            key = columns(finals, frozenset([sort_key]))[sort_key]
+        key = key if idx is None else key[idx]
+        order = sort_order(key, ascending)[offset:offset + limit]
+        if idx is not None:
+            order = idx[order]
+        cols = columns(finals[order])   # 派生値とパーセンタイルは表示する行だけ
+        r = self._rows(order)
+        cols.update(rank_columns(finals[order], self._mods[r], self._apply_mod[r], cols))
+        cols["_uid"] = self.uids()[order]
+        return {c: cols[c] for c in PAGE_KEYS + ["_uid"]}
+
+    # =========================
+    # 削除・容量変更
+    # =========================
+    def _rebuild(self, keep_rows: np.ndarray, capacity: int):
+        """物理行（古い順）だけを残して作り直す"""
+        old = [a[keep_rows] for a in self._arrays]
+        self._alloc(capacity)
+        n = len(keep_rows)
+        for dst, src in zip(self._arrays, old):
+            dst[:n] = src
+            dst[capacity:capacity + n] = src
+        self._written = self._size = n
+        self.version += 1
+
+    def remove_uids(self, uids: Iterable[int]) -> int:
+        """UID が一致する行を削除（O(n) の詰め直し）。戻り: 削除件数"""
+        w = self._window()
+        rows = np.arange(w.start, w.stop)
+        keep = ~np.isin(self._uid[w], np.fromiter(uids, np.int64))
+        removed = int((~keep).sum())
+        if removed:
+            self._rebuild(rows[keep], self.capacity)
+        return removed
+
+    def resize(self, capacity: int):
+        """容量を変更（減らすときは新しい方から残す）"""
+        capacity = max(1, int(capacity))
+        if capacity == self.capacity:
+            return
+        w = self._window()
+        rows = np.arange(w.start, w.stop)[-capacity:]
+        self._rebuild(rows, capacity)
+
+    def clear(self):
+        self._alloc(self.capacity)
+        self.version += 1
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self._arrays)
+
+
+def _finals(base: np.ndarray, mods: np.ndarray, apply_mod: np.ndarray) -> np.ndarray:
+    """ベース値 + モディファイア（適用した行だけ）。モディファイアがなければ base をそのまま返す"""
+    if not mods.any() or not apply_mod.any():
+        return base
+    return base + mods * apply_mod[:, None].astype(np.int16)
+
+
+def _mods_row(mods: Dict[str, int]) -> np.ndarray:
+    return np.array([int(mods.get(a, 0)) for a in ABILS], np.int8)
+
+
+def empty_rows() -> Rows:
+    return Rows(np.zeros((0, N_ABILS), np.int16), np.zeros((0, N_ABILS), np.int16),
+                np.zeros((0, N_ABILS, DICE_WIDTH), np.int8), np.zeros((0, N_ABILS), np.int8),
+                np.zeros(0, bool), np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64))
+
+
+def record_rows(rec: Dict[str, Any]) -> Rows:
+    """dict レコード 1 件 → 1 行の Rows"""
+    finals = np.array([[int(rec[a]) for a in ABILS]], np.int16)
+    base_d = rec.get("_base") or {a: int(rec[a]) for a in ABILS}
+    base = np.array([[int(base_d[a]) for a in ABILS]], np.int16)
+    dice = np.zeros((1, N_ABILS, DICE_WIDTH), np.int8)
+    for c, a in enumerate(ABILS):
+        d = (rec.get("_detail") or {}).get(a) or []
+        dice[0, c, :len(d)] = d
+    return Rows(finals, base, dice, _mods_row(rec.get("_mods") or {})[None],
+                np.array([bool(rec.get("_apply_mod", True))]), np.array([int(rec.get("_uid", 0))], np.int64),
+                np.array([int(rec.get("_seed", NO_SEED))], np.int64), np.array([int(rec.get("_offset", 0))], np.int64))
+
+
+def batch_rows(rb: RollBatch, rows, mods: Dict[str, int], apply_mod: bool, uid_start: int) -> Rows:
+    """RollBatch の指定行 → Rows（rows の順。_uid は uid_start + 行番号。出目のないバッチは 0）"""
+    rows = np.asarray(rows, dtype=np.int64)
+    n = len(rows)
+    seeds, offsets = _batch_seeds(rb, rows)
+    dice = rb.dice[rows] if rb.dice is not None else np.zeros((n, N_ABILS, DICE_WIDTH), np.int8)
+    return Rows(rb.finals[rows].astype(np.int16), rb.base[rows].astype(np.int16), dice,
+                np.tile(_mods_row(mods), (n, 1)), np.full(n, bool(apply_mod)), uid_start + rows,
+                np.broadcast_to(np.asarray(seeds, np.int64), (n,)).copy(),
+                np.broadcast_to(np.asarray(offsets, np.int64), (n,)).copy())
+
+
+def _batch_seeds(rb: RollBatch, rows: np.ndarray):
+    """RollBatch の行の (seeds, offsets)（replay できないバッチ・行は NO_SEED）"""
+    if rb.offsets is None:
+        return NO_SEED, 0
+    offsets = rb.offsets[rows]
+    lost = offsets == NO_OFFSET
+    if not lost.any():
+        return rb.seed, offsets
+    return np.where(lost, NO_SEED, rb.seed), np.where(lost, 0, offsets)
@@ -0,0 +1,121 @@
+"""スコア式の上位 K セット（まとめ振りから流し込むリーダーボード）
+
+全件を並べ替えずに、スコア（ruleexpr.compile_score の式。TOTAL, 職業P+興味P, TOTAL + 2*EDU など）
+の高い K セットだけを持ち続けます。feed 1 回あたり
+  1. 新しい行のスコアを列でまとめて計算し、今の K 位のスコア以下の行はその場で捨てる
+  2. 残った候補と今の K 行を合わせて np.partition で K 位のスコアを求め、上位 K 行を残す
+なので、N 行流し込んで O(N + K log K)、メモリは O(K) です（100 万行を流しても保持は K 行）。
+同点は UID の小さい（先に振った）行を優先します（order を渡せばその小さい方。parallel では乱数の位置）。
+並びは UID で決まるので、流し込む順番（履歴から新しい順に流し直すなど）によらず同じ結果です。
+スコア式が 0 で割る行（スコア -inf）は入れません。
+保持している行は store.Rows なので、そのまま★（store.add_rows）に入れられます。
+"""
+from typing import Optional
+
+import numpy as np
+
+from . import batch
+from .ruleexpr import compile_rule, compile_score
+from .store import Rows, batch_rows, empty_rows, record_rows
+
+
+class TopK:
+    """スコアの上位 k 行（rows / scores は良い順）"""
+
+    def __init__(self, k: int, score: str = "TOTAL", where: Optional[str] = None):
+        self.k = max(1, int(k))
+        self.score = compile_score(score)
+        self.where = compile_rule(where) if where else None
+        self._names = self.score.names | (self.where.names if self.where else frozenset())
+        self.rows: Rows = empty_rows()
+        self.scores = np.zeros(0, np.float64)
+        self._order = np.zeros(0, np.int64)   # 同点の並び（小さい方が先。既定は UID）
+        self.seen = 0                         # 流し込んだ行数（where で落ちた分も含む）
+        self.matched = 0                      # そのうち where を満たした行数
+        self.version = 0                      # 中身が変わるたびに +1（表示キャッシュのキー）
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def threshold(self) -> float:
+        """入るのに必要なスコア（今の K 位。同点は UID の小さい方が残る。まだ k 行ないなら -inf）"""
+        return float(self.scores[-1]) if len(self) >= self.k else -np.inf
+
+    def feed(self, rows: Rows, order: Optional[np.ndarray] = None) -> int:
+        """行を流し込む。order は同点の並び（省略時は UID）。戻り: 新しく入った行数"""
+        cand, scores, order = self._candidates(rows.finals, rows.uids if order is None else order)
+        return self._merge(_take(rows, cand), scores, order)
+
+    def feed_batch(self, rb: batch.RollBatch, mods, apply_mod: bool, uid_start: int,
+                   order: Optional[np.ndarray] = None) -> int:
+        """RollBatch 全行を流し込む（_uid は uid_start + 行番号。Rows にするのは候補の行だけ）"""
+        if order is None:
+            order = uid_start + np.arange(len(rb.finals), dtype=np.int64)
+        cand, scores, order = self._candidates(rb.finals, order)
+        return self._merge(batch_rows(rb, cand, mods, apply_mod, uid_start), scores, order)
+
+    def _candidates(self, finals: np.ndarray, order: np.ndarray):
+        """K 位のスコアに届く（と where を満たす）行 → (行番号, スコア, 同点の並び)"""
+        n = len(finals)
+        self.seen += n
+        cols = batch.columns(finals, self._names)
+        scores = np.asarray(self.score.values(cols), np.float64)
+        # 同点でも order が小さければ入れ替わる。0 で割る行（-inf）は入れない
+        keep = (scores >= self.threshold()) & (scores > -np.inf)
+        if self.where is not None:
+            ok = self.where.mask(cols)
+            keep &= ok
+            self.matched += int(np.count_nonzero(ok))
+        else:
+            self.matched += n
+        cand = np.flatnonzero(keep)
+        order = np.asarray(order, np.int64)[cand]
+        if len(cand) > self.k:   # 候補だけで K を超えたら先に K に絞る（Rows を作るのは K 行まで）
+            sel = _best(scores[cand], order, self.k)
+            cand, order = cand[sel], order[sel]
+        return cand, scores[cand], order
+
+    def _merge(self, rows: Rows, scores: np.ndarray, order: np.ndarray) -> int:
+        if len(scores) == 0:
+            return 0
+        old = len(self)
+        rows_all = _concat(self.rows, rows)
+        scores_all = np.concatenate([self.scores, scores])
+        order_all = np.concatenate([self._order, order])
+        best = _best(scores_all, order_all, self.k)
+        self.rows, self.scores, self._order = _take(rows_all, best), scores_all[best], order_all[best]
+        self.version += 1
+        return int((best >= old).sum())
+
+    def feed_record(self, rec) -> int:
+        """dict レコード 1 件を流し込む（1 セットずつ振ったとき）"""
+        return self.feed(record_rows(rec))
+
+    def nbytes(self) -> int:
+        return sum(f.nbytes for f in self.rows) + self.scores.nbytes + self._order.nbytes
+
+    def clear(self):
+        self.rows, self.scores, self._order = empty_rows(), np.zeros(0, np.float64), np.zeros(0, np.int64)
+        self.seen = self.matched = 0
+        self.version += 1
+
+
+def _best(scores: np.ndarray, order: np.ndarray, k: int) -> np.ndarray:
+    """スコアの高い順（同点は order の小さい順）に k 個の index"""
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]   # k 番目に大きいスコア
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)
+        tied = tied[np.argsort(order[tied], kind="stable")][:k - len(above)]
+        idx = np.concatenate([above, tied])
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.lexsort((order[idx], -scores[idx]))]
+
+
+def _take(rows: Rows, idx: np.ndarray) -> Rows:
+    return Rows(*(f[idx] for f in rows))
+
+
+def _concat(a: Rows, b: Rows) -> Rows:
+    return Rows(*(np.concatenate([x, y]) for x, y in zip(a, b)))
@@ -0,0 +1,66 @@
+"""履歴/★ の表示用 DataFrame キャッシュ
+
+並べ替え済みの表は (ストアの version, 並べ替えキー, 昇順, ページ, 絞り込み) が変わらない限り
+作り直しません。並べ替え・絞り込み・ページ送りはストア側（store.page）で行うので、
+SQLite 版ではインデックスを使ったクエリになります。
+チェック列はその上に載せるだけなので、チェック状態が変わったときも並べ替えは再利用します。
+pandas は表を初めて作るときに import します。
+"""
+from typing import Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+class TableView:
+    """1 つの表（履歴 or ★）の表示キャッシュ"""
+
+    def __init__(self, check_col: str, show_cols: List[str], limit: int):
+        self.check_col = check_col
+        self.show_cols = show_cols
+        self.limit = limit
+        self._base_key: Optional[Tuple[Hashable, ...]] = None
+        self._base = None          # 並べ替え済み（チェック列なし）
+        self._view_key: Optional[Tuple[Hashable, ...]] = None
+        self._view = None          # チェック列つき
+        self._count_key: Optional[Tuple[Hashable, ...]] = None
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, store, where=None) -> int:
+        """絞り込み後の件数（ページ数の計算用。ストアが変わるまでキャッシュ）"""
+        key = (id(store), store.version, None if where is None else where.source)
+        if key != self._count_key:
+            self._count, self._count_key = store.count(where), key
+        return self._count
+
+    def frame(self, store, sort_key: str, ascending: bool, selected: Set[int], page: int = 0, where=None):
+        """表示用 DataFrame（page ページ目の limit 行）。変更がなければ前回と同じオブジェクトを返す
+
+        store は RecordStore / SQLiteStore、where は ruleexpr.Rule（None なら全件）。
+        """
+        import pandas as pd
+
+        base_key = (id(store), store.version, sort_key, ascending, page, None if where is None else where.source)
+        if base_key != self._base_key:
+            cols = store.page(sort_key, ascending, self.limit, page * self.limit, where)
+            self._base = pd.DataFrame({c: cols[c] for c in self.show_cols})
+            self._base_key = base_key
+            self._view_key = None
+
+        view_key = base_key + (frozenset(selected),)
+        if view_key == self._view_key:
+            self.hits += 1
+            return self._view
+        self.misses += 1
+        view = self._base.copy(deep=False)
+        view.insert(0, self.check_col, np.isin(view["_uid"].to_numpy(), np.fromiter(selected, np.int64)))
+        self._view, self._view_key = view, view_key
+        return view
+
+    def nbytes(self) -> int:
+        """キャッシュしている表のおおよそのバイト数（チェック列つきの表は列を共有するのでチェック列の分だけ）"""
+        size = 0 if self._base is None else int(self._base.memory_usage(index=True).sum())
+        if self._view is not None:
+            size += int(self._view[self.check_col].nbytes)
+        return size
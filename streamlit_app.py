@@ -1,99 +1,25 @@
-import math
-import random
-from typing import Dict, List, Tuple, Any
+import os
+from functools import partial
+from typing import Any, Dict, List, Optional
 
-import pandas as pd
+import numpy as np
 import streamlit as st
 
-st.set_page_config(page_title="CoC6 能力値振りツール", layout="wide", initial_sidebar_state="expanded")
-
-# =========================
-# 定数・ユーティリティ
-# =========================
-ABILS = ["STR", "CON", "POW", "DEX", "APP", "SIZ", "INT", "EDU"]
-DERIVED_KEYS = ["HP", "MP", "SAN", "アイデア", "幸運", "知識", "職業P", "興味P"]
-ALL_KEYS_FOR_RULE = ABILS + DERIVED_KEYS + ["TOTAL"]
-
-ROLL_SPEC = {  # (UI表記, 固定加算)
-    "STR": ("3d6", 0),  "CON": ("3d6", 0),  "POW": ("3d6", 0),
-    "DEX": ("3d6", 0),  "APP": ("3d6", 0),
-    "SIZ": ("2d6+6", 6), "INT": ("2d6+6", 6), "EDU": ("3d6+3", 3),
-}
-
-WARN_MIN = {k: 3 for k in ABILS}
-WARN_MAX = {k: 18 for k in ABILS}  # 警告のみ（ブロックしない）
-# EDU のみ 6～21 に拡張
-WARN_MIN["EDU"] = 6
-WARN_MAX["EDU"] = 21
-
-# --- ガチャ用データ ---
-PREFECTURES = [
-    "北海道","青森","岩手","宮城","秋田","山形","福島",
-    "茨城","栃木","群馬","埼玉","千葉","東京","神奈川",
-    "新潟","富山","石川","福井","山梨","長野",
-    "岐阜","静岡","愛知","三重",
-    "滋賀","京都","大阪","兵庫","奈良","和歌山",
-    "鳥取","島根","岡山","広島","山口",
-    "徳島","香川","愛媛","高知",
-    "福岡","佐賀","長崎","熊本","大分","宮崎","鹿児島","沖縄"
-]
-COUNTRIES = [
-    "日本","アメリカ","イギリス","フランス","ドイツ","イタリア","スペイン","ロシア",
-    "カナダ","オーストラリア","中国","韓国","台湾","香港","インド","インドネシア",
-    "ベトナム","タイ","フィリピン","マレーシア","シンガポール","トルコ","エジプト",
-    "南アフリカ","ブラジル","メキシコ","アルゼンチン","チリ","ペルー","サウジアラビア"
-]
-GENDERS = ["男性", "女性", "X/その他", "不明"]
-
-# 重み（現代日本PCを想定して、日本を高めに）
-COUNTRY_WEIGHTS = {c: (8 if c == "日本" else 1) for c in COUNTRIES}
-
-
-def round_half_up(x: float) -> int:
-    return int(math.floor(x + 0.5))
-
-
-def roll_nd6(n: int) -> Tuple[int, List[int]]:
-    dice = [random.randint(1, 6) for _ in range(n)]
-    return sum(dice), dice
-
-
-def roll_for(stat: str) -> Tuple[int, List[int], int]:
-    """戻り: (合計値=出目合計+固定加算, 出目配列, 固定加算)"""
-    spec, add = ROLL_SPEC[stat]
-    if spec.startswith("3d6"):
-        s, dice = roll_nd6(3)
-    elif spec.startswith("2d6"):
-        s, dice = roll_nd6(2)
-    else:
-        raise ValueError("Unknown dice spec")
-    return s + add, dice, add
-
-
-def damage_bonus(str_val: int, siz_val: int) -> str:
-    total = str_val + siz_val
-    if 2 <= total <= 12:  return "-1D6"
-    if 13 <= total <= 16: return "-1D4"
-    if 17 <= total <= 24: return "+0"
-    if 25 <= total <= 32: return "+1D4"
-    if 33 <= total <= 40: return "+1D6"
-    if total < 2:        return "-1D6"
-    extra = (total - 33) // 8
-    return f"+{extra+1}D6"
-
-
-def derived_stats(stats: Dict[str, int]) -> Dict[str, int]:
-    CON = stats["CON"]; SIZ = stats["SIZ"]; POW = stats["POW"]; INT = stats["INT"]; EDU = stats["EDU"]
-    HP = round_half_up((CON + SIZ) / 2)
-    return {
-        "HP": HP, "MP": POW, "SAN": POW * 5,
-        "アイデア": INT * 5, "幸運": POW * 5, "知識": EDU * 5,
-        "職業P": EDU * 20, "興味P": INT * 10,
-    }
+from dicetool import (
+    ABILS, DERIVED_KEYS, ALL_KEYS_FOR_RULE, ROLL_SPEC, WARN_MIN, WARN_MAX,
+    damage_bonus, derived_stats, total_score,
+)
+from dicetool import arrange, batch, export, gacha, montecarlo, party, records, ruleexpr, rules, sampler
+from dicetool.rng import SEED_BITS, SessionRNG
+from dicetool.percentile import PCT_KEYS, RANK_KEYS, RARITY
+from dicetool.profiler import RerunProfiler, state_sizes
+from dicetool.store import RecordStore, Rows, batch_rows
+from dicetool.topk import TopK
+from dicetool.sqlite_store import SQLiteStore
+from dicetool.views import TableView
+from dicetool.gacha import GENDER_TABLE, country_table, prefecture_table
 
-
-def total_score(stats: Dict[str, int]) -> int:
-    return sum(stats[a] for a in ABILS)
+st.set_page_config(page_title="CoC6 能力値振りツール", layout="wide", initial_sidebar_state="expanded")
 
 
 # =========================
@@ -108,18 +34,33 @@ if "current_stats" not in st.session_state:
     st.session_state.modifiers     = {a: 0 for a in ABILS}
     st.session_state.fixed_values  = {a: None for a in ABILS}
 
-    st.session_state.history       = []   # 最新が先頭
-    st.session_state.favorites     = []
+    st.session_state.history       = RecordStore(20)                   # 最新が先頭（列指向リングバッファ）
+    st.session_state.favorites     = RecordStore(256, growable=True)
 
     # 自動お気に入り設定
     st.session_state.auto_fav_enabled = True
     st.session_state.auto_fav_mode    = "AND"
+    st.session_state.auto_fav_expr    = ""      # 条件式（入力欄）
+    st.session_state.auto_fav_expr_ok = ""      # 条件式（コンパイルできたもの）
     st.session_state.auto_min         = {k: None for k in ALL_KEYS_FOR_RULE}
     st.session_state.auto_max         = {k: None for k in ALL_KEYS_FOR_RULE}
 
     st.session_state.history_max_keep = 20
     st.session_state.add_roll_to_history = True  # 全体ロールを履歴へ
 
+TABLE_ROWS = 1_000   # 履歴/★ の表に出す最大行数（1 ページ分）
+MEMORY_MAX_KEEP = 500_000        # メモリ保存での履歴の上限
+SQLITE_MAX_KEEP = 10_000_000     # SQLite 保存での履歴の上限
+SQLITE_PATH = "coc6_rolls.sqlite3"
+UNTIL_MAX_ROLLS = 5_000_000      # 「★が N 件出るまで振る」で 1 回に振る上限（1 秒ほど。画面が止まらないように）
+
+# 保存先（SQLite はセッションごとに選んだときだけ。同じファイルを複数のセッションで開くこともあるので、
+# SQLiteStore は書き込む前に行数を読み直し、UID は保存済みの最大から振る）
+if "use_sqlite" not in st.session_state:
+    st.session_state.use_sqlite = False
+    st.session_state.sqlite_path = SQLITE_PATH
+    st.session_state.backend = ("memory",)
+
 # ★/履歴のチェック保持＆安定ID
 if "uid_counter" not in st.session_state:
     st.session_state.uid_counter = 0
@@ -128,6 +69,183 @@ if "hist_selected_uids" not in st.session_state:
 if "fav_selected_uids" not in st.session_state:
     st.session_state.fav_selected_uids = set()
 
+# 表示用 DataFrame のキャッシュ（ストアの version・並べ替え・チェックが同じなら再利用）
+if "hist_view" not in st.session_state:
+    st.session_state.hist_view = TableView("★チェック", ["_uid"] + ABILS + ["TOTAL"] + DERIVED_KEYS + RANK_KEYS,
+                                           TABLE_ROWS)
+if "fav_view" not in st.session_state:
+    st.session_state.fav_view = TableView("✓", ["_uid"] + ABILS + ["TOTAL"] + DERIVED_KEYS + RANK_KEYS, TABLE_ROWS)
+
+
+def switch_backend(use_sqlite: bool, path: str):
+    """履歴/★ の保存先を切り替える（今の中身は新しい保存先へ引き継ぐ）"""
+    backend = ("sqlite", path) if use_sqlite else ("memory",)
+    if st.session_state.backend == backend:
+        return
+    old_h, old_f = st.session_state.history, st.session_state.favorites
+    if use_sqlite:
+        new_h = SQLiteStore(path, "history", old_h.capacity)
+        new_f = SQLiteStore(path, "favorites", 256, growable=True)
+        off = max(new_h.max_uid(), new_f.max_uid())   # 保存済みの UID と重ならないようにずらす
+    else:
+        new_h = RecordStore(min(old_h.capacity, MEMORY_MAX_KEEP))
+        new_f = RecordStore(max(256, len(old_f)), growable=True)
+        off = 0
+    for old, new in ((old_h, new_h), (old_f, new_f)):
+        rows = old.head(new.capacity)
+        new.add_rows(rows._replace(uids=rows.uids + off))
+        if isinstance(old, SQLiteStore):
+            old.close()
+    st.session_state.history, st.session_state.favorites = new_h, new_f
+    st.session_state.history_max_keep = new_h.capacity
+    st.session_state.uid_counter = max(st.session_state.uid_counter + off, new_h.max_uid(), new_f.max_uid())
+    st.session_state.hist_selected_uids = set()
+    st.session_state.fav_selected_uids = set()
+    st.session_state.backend = backend
+
+
+def new_uids(n: int) -> int:
+    """n 件分の UID を確保して先頭を返す（SQLite は他のセッションや parallel --db も書くので保存済みの最大の次から）"""
+    if st.session_state.backend[0] == "sqlite":
+        st.session_state.uid_counter = max(st.session_state.uid_counter, st.session_state.history.max_uid(),
+                                           st.session_state.favorites.max_uid())
+    st.session_state.uid_counter += n
+    return st.session_state.uid_counter - n + 1
+
+
+# =========================
+# 画面の部品（fragment）
+# =========================
+# 現在セット / 履歴 / リーダーボード / ★ / ガチャは st.fragment で、部品の中の操作はその部品だけを
+# 再実行します（サイドバーの条件表や大きな表を毎回描き直さない）。ほかの部品の中身を変える操作は
+# コールバックで st.rerun([key, ...]) を呼び、変えた部品だけを描き直します。
+# 操作のメッセージは部品ごとに flash しておき、その部品を描くときに出します。
+# 表（data_editor / dataframe）は pandas を読み込むので、条件表・履歴・リーダーボードは折りたたみを
+# 開いたときだけ表を作り、pandas もそこで初めて import します（起動と最初の表示を軽くするため）。
+def flash(panel: str, kind: str, msg: str):
+    st.session_state[f"_flash_{panel}"] = (kind, msg)
+
+
+def show_flash(panel: str):
+    if f"_flash_{panel}" in st.session_state:
+        kind, msg = st.session_state.pop(f"_flash_{panel}")
+        {"succ": st.success, "warn": st.warning, "info": st.info}[kind](msg)
+
+
+def table_filter(label: str, key: str):
+    """表の絞り込み条件式（空・エラーなら None）"""
+    src = st.text_input(label, key=key, placeholder="例: TOTAL >= 90 and HP >= 14").strip()
+    if not src:
+        return None
+    try:
+        return ruleexpr.compile_rule(src)
+    except ruleexpr.RuleSyntaxError as e:
+        st.error(f"条件式エラー：{e}")
+        return None
+
+
+# 履歴/★ の表の列（パーセンタイルとレア度は表示だけ。並べ替えはレア度で選べる）
+TABLE_SORT_KEYS = ["TOTAL", RARITY] + DERIVED_KEYS + ABILS
+TABLE_COLUMNS = {
+    "_uid": st.column_config.NumberColumn("UID", disabled=True),
+    **{f"{k}%": st.column_config.NumberColumn(f"{k}%", format="%.1f", disabled=True,
+                                              help=f"{k} がこの値以下になる確率（%）")
+       for k in PCT_KEYS},
+    RARITY: st.column_config.NumberColumn(RARITY, format="%.2f", disabled=True,
+                                          help="全能力でこのセット以上になる確率の -log10（3 なら 1/1000）"),
+}
+
+
+def table_page(view: TableView, store, where, key: str) -> int:
+    """ページ選択（1 ページ TABLE_ROWS 行）と件数の表示。戻り: 0 始まりのページ"""
+    total = view.count(store, where)
+    pages = max(1, -(-total // TABLE_ROWS))
+    page = 0
+    if pages > 1:
+        page = int(st.number_input(f"ページ（全 {pages:,}）", min_value=1, max_value=pages, value=1,
+                                   step=1, key=key)) - 1
+    if pages > 1 or where is not None:
+        shown = f"{page * TABLE_ROWS + 1:,}〜{min(total, (page + 1) * TABLE_ROWS):,}" if total else "0"
+        narrowed = f"（絞り込み後 {total:,} 件）" if where is not None else ""
+        st.caption(f"全 {len(store):,} 件{narrowed}のうち、並べ替え順で {shown} 件目を表示しています。")
+    return page
+
+
+def export_button(label: str, store, name: str, key: str):
+    """形式を選んでダウンロード（ファイルはボタンを押したときにチャンクごとに書き出す）"""
+    fmt = st.selectbox(f"{label}の形式", export.available_formats(), key=f"{key}_fmt",
+                       help="CSV/Parquet は出目・モディファイアを列に、JSON Lines は 1 行 1 レコード")
+    mime, ext = export.FORMATS[fmt]
+    # 書き出しはボタンを押したときにスクリプトの外で呼ばれるので、計測は別の実行（状態は残さない）
+    data = prof.timed(f"export:{key}", snapshot=False)(partial(export.export_file, store, fmt))
+    st.download_button(f"{label}をダウンロード", data=data,
+                       file_name=name + ext, mime=mime, use_container_width=True, key=key)
+
+
+# --- 自動配置（同じダイス式の能力どうしで値を並べ替えてスコアを最大にする） ---
+ARRANGE_PRESETS = {
+    "職業P+興味P": "職業P+興味P", "職業P": "職業P", "興味P": "興味P", "HP": "HP",
+    "ダメージボーナス": "STR + SIZ",   # DB は STR+SIZ が大きいほど上の区分
+    "式を入力": None,
+}
+if "arrange_preset" not in st.session_state:
+    st.session_state.arrange_preset = "職業P+興味P"
+    st.session_state.arrange_expr = ""
+    st.session_state.arrange_batch = False
+
+
+def arrange_source() -> Optional[str]:
+    """自動配置のスコア式（入力がエラーなら None）"""
+    src = ARRANGE_PRESETS[st.session_state.arrange_preset] or st.session_state.arrange_expr.strip()
+    try:
+        return ruleexpr.compile_score(src).source if src else None
+    except ruleexpr.RuleSyntaxError:
+        return None
+
+
+# --- リーダーボード（振ったセットのスコア上位 K。履歴の容量を超えて古いものが消えても残る） ---
+TOPK_MAX = 1_000
+if "topk" not in st.session_state:
+    st.session_state.topk = TopK(20, "TOTAL")
+    st.session_state.topk_score = "TOTAL"
+    st.session_state.topk_k = 20
+    st.session_state.topk_df = (None, None)   # (version, DataFrame)
+
+
+def rebuild_topk(score: str, k: int):
+    """スコア式/K を変えたら作り直す（それまでのセットは履歴に残っている分から流し込み直す）"""
+    top = TopK(k, score)
+    for rows in st.session_state.history.iter_chunks(100_000):
+        top.feed(rows)
+    st.session_state.topk = top
+
+
+def leaderboard_frame(top: TopK):
+    """リーダーボードの表（DataFrame。中身が変わったときだけ作り直す）"""
+    version, df = st.session_state.topk_df
+    if version == (id(top), top.version):
+        return df
+    import pandas as pd
+
+    cols = batch.columns(top.rows.finals)
+    df = pd.DataFrame({"順位": range(1, len(top) + 1), "スコア": top.scores,
+                       **{k: cols[k] for k in ABILS + ["TOTAL"] + DERIVED_KEYS}, "_uid": top.rows.uids})
+    st.session_state.topk_df = ((id(top), top.version), df)
+    return df
+
+
+# --- 乱数（シード 1 つでロール・まとめ振り・ガチャを再現できる） ---
+if "rng" not in st.session_state:
+    st.session_state.rng = SessionRNG()
+    st.session_state.rng_seed = str(st.session_state.rng.seed)
+
+
+def reseed(seed=None):
+    """セッションの乱数を作り直す（seed=None なら新しいシード）"""
+    st.session_state.rng = SessionRNG(seed)
+    st.session_state.rng_seed = str(st.session_state.rng.seed)
+
+
 # --- ガチャ結果の保持 ---
 if "gacha_country" not in st.session_state:
     st.session_state.gacha_country = None
@@ -135,6 +253,39 @@ if "gacha_pref" not in st.session_state:
     st.session_state.gacha_pref = None
 if "gacha_gender" not in st.session_state:
     st.session_state.gacha_gender = None
+if "gacha_party" not in st.session_state:
+    st.session_state.gacha_party = None   # まとめて抽選の結果（(組の人数, profiles の列)）
+
+# --- バランスの取れたパーティー（(候補の RollBatch, Party, 先頭の UID, モディファイア, 適用)） ---
+if "party_result" not in st.session_state:
+    st.session_state.party_result = None
+
+# --- 振り続ける統計（統計タブで開始した MonteCarloRunner。別スレッドで振る） ---
+if "mc_runner" not in st.session_state:
+    st.session_state.mc_runner = None
+
+
+# --- 再実行の計測（サイドバーのチェックか、環境変数 DICETOOL_PROFILE=1 で有効。既定はオフ） ---
+if "profiler" not in st.session_state:
+    st.session_state.profiler = RerunProfiler(enabled=os.environ.get("DICETOOL_PROFILE") == "1")
+prof = st.session_state.profiler
+
+
+def cb_profile_enabled():
+    # コールバックは再実行の前に呼ばれるので、切り替えた回の実行から計測できる
+    prof.enabled = st.session_state.profile_enabled
+
+
+def profile_snapshot() -> Dict[str, Any]:
+    """実行ごとに残す状態（件数と、セッション状態のおおよその大きさ。大きい順に 10 キー）"""
+    sizes = state_sizes(st.session_state)
+    return {"counts": {"history": len(st.session_state.history), "favorites": len(st.session_state.favorites),
+                       "leaderboard": len(st.session_state.topk), "state_keys": len(sizes)},
+            "state_bytes": sum(sizes.values()),
+            "state_top": dict(sorted(sizes.items(), key=lambda kv: -kv[1])[:10])}
+
+
+prof.snapshot = profile_snapshot
 
 
 # =========================
@@ -152,22 +303,11 @@ def render_status_tab():
     def make_final(abil: str, base_val: int) -> int:
         return base_val + (st.session_state.modifiers[abil] if apply_mod else 0)
 
-    # 共通：固定値/ダイス/モディファイアをまとめて適用
-    def roll_effective(abil: str) -> Tuple[int, List[int], int, int]:
-        """
-        戻り: base, detail, add, final
-          base   … 固定ありなら固定値、なければダイス合計(+固定加算済)
-          detail … 出目配列（固定時は []）
-          add    … 固定加算（3d6=0, 2d6+6=6, 3d6+3=3）
-          final  … base + (モディファイア or 0)
-        """
-        fixed = st.session_state.fixed_values.get(abil)
-        if fixed is not None:
-            base = int(fixed); d = []; add = 0
-        else:
-            base, d, add = roll_for(abil)
-        final = base + (st.session_state.modifiers[abil] if apply_mod else 0)
-        return base, d, add, final
+    # 共通：固定値/ダイス/モディファイアをまとめて適用して 1 セット振る（セッションの乱数。レコードは replay できる）
+    def roll_one_set(uid: Optional[int] = None) -> Dict[str, Any]:
+        rb = batch.roll_batch(1, st.session_state.fixed_values, st.session_state.modifiers, apply_mod,
+                              rng=st.session_state.rng.rolls)
+        return batch.to_records(rb, [0], st.session_state.modifiers, apply_mod, uid)[0]
 
     # モディファイア/適用トグルが変わったら現在セットを再計算
     def _recompute_current_from_mods():
@@ -186,72 +326,37 @@ def render_status_tab():
             st.session_state.prev_modifiers = dict(st.session_state.modifiers)
             st.session_state.prev_apply_mod = apply_mod
 
-    _check_recompute_mods()
+    with prof.section("recompute_mods"):
+        _check_recompute_mods()
 
     # =========================
     # レコード生成・★判定
     # =========================
-    def make_record(finals: Dict[str, int],
-                    base_vals: Dict[str, int],
-                    detail: Dict[str, List[int]],
-                    adds: Dict[str, int]) -> Dict[str, Any]:
-        rec = {
-            **finals,
-            "TOTAL": total_score(finals),
-            **derived_stats(finals),
-            "_base": base_vals, "_detail": detail, "_adds": adds,
-            "_mods": dict(st.session_state.modifiers),
-            "_apply_mod": apply_mod,
-        }
-        # 安定ID付与（チェック保持用）
-        st.session_state.uid_counter += 1
-        rec["_uid"] = st.session_state.uid_counter
-        return rec
-
     def adopt_record(rec: Dict[str, Any]):
         """履歴/★の1レコードを現在セットに展開して採用"""
-        finals = {a: int(rec[a]) for a in ABILS}
-        basev  = rec.get("_base", {
-            a: finals[a] - (rec.get("_mods", {}).get(a, 0) if rec.get("_apply_mod", True) else 0) for a in ABILS
-        })
-        st.session_state.current_stats  = finals
-        st.session_state.current_base   = basev
+        st.session_state.current_stats  = {a: int(rec[a]) for a in ABILS}
+        st.session_state.current_base   = records.record_base(rec)
         st.session_state.current_detail = rec.get("_detail", {a: [] for a in ABILS})
         st.session_state.current_add    = rec.get("_adds", {a: 0 for a in ABILS})
 
     def auto_fav_ok(rec: Dict[str, Any]) -> bool:
-        if not st.session_state.auto_fav_enabled:
-            return False
-        flags: List[bool] = []
-        for k in ALL_KEYS_FOR_RULE:
-            v = int(rec[k])
-            vmin = st.session_state.auto_min.get(k)
-            vmax = st.session_state.auto_max.get(k)
-            if (vmin is not None) or (vmax is not None):
-                ok = True
-                if vmin is not None: ok = ok and (v >= int(vmin))
-                if vmax is not None: ok = ok and (v <= int(vmax))
-                flags.append(ok)
-        if not flags:
-            return False
-        return all(flags) if st.session_state.auto_fav_mode == "AND" else any(flags)
+        return rules.auto_fav_ok(rec, st.session_state.auto_fav_enabled, st.session_state.auto_fav_mode,
+                                 st.session_state.auto_min, st.session_state.auto_max,
+                                 st.session_state.auto_fav_expr_ok)
 
     def history_append(rec: Dict[str, Any]):
-        st.session_state.history.insert(0, rec)
-        maxk = int(st.session_state.history_max_keep)
-        if len(st.session_state.history) > maxk:
-            st.session_state.history = st.session_state.history[:maxk]
+        st.session_state.history.append(rec)   # 容量（history_max_keep）超過分は古い順に消える
         if auto_fav_ok(rec):
-            st.session_state.favorites.insert(0, rec)
+            st.session_state.favorites.append(rec)
 
     # =========================
     # サイドバー：まとめて振る（履歴へ）
     # =========================
-    with st.sidebar:
+    with st.sidebar, prof.section("sidebar"):
         st.title("操作パネル")
 
         st.subheader("まとめて振る（履歴に追加）")
-        n_sets = st.number_input("セット数（最大20）", min_value=1, max_value=20, value=1, step=1)
+        n_sets = st.number_input("セット数（最大100000）", min_value=1, max_value=100_000, value=1, step=1)
 
         st.markdown("**固定値の指定**（空=未指定）")
         cols_fix = st.columns(4)
@@ -270,10 +375,35 @@ def render_status_tab():
                     value=st.session_state.modifiers[abil], step=1, key=f"mod_{abil}"
                 )
 
+        st.markdown("---")
+        st.subheader("乱数")
+        # 63bit のシードは number_input（JS の数値）に入らないので文字列で受ける
+        seed_src = st.text_input("シード", key="rng_seed",
+                                 help="同じシードで同じ操作をすると同じ出目になります。履歴のレコードにはシードと位置が残ります。")
+        if seed_src.strip() != str(st.session_state.rng.seed):   # シードを手で入れた
+            try:
+                st.session_state.rng = SessionRNG(int(seed_src.strip()))
+            except ValueError:
+                st.error(f"シードは 0〜2^{SEED_BITS}-1 の整数です。")
+        st.button("新しいシード", on_click=reseed, use_container_width=True)
+        st.caption(f"ロール位置 {st.session_state.rng.rolls.offset:,} / ジョブ {st.session_state.rng.jobs:,} 回")
+
+        st.markdown("---")
+        st.subheader("保存先")
+        st.checkbox("SQLite に保存する（再読み込み・再起動後も残る）", key="use_sqlite")
+        st.text_input("データベースファイル", key="sqlite_path", disabled=not st.session_state.use_sqlite)
+        switch_backend(st.session_state.use_sqlite, st.session_state.sqlite_path.strip() or SQLITE_PATH)
+
         st.markdown("---")
         st.subheader("履歴・★ 設定")
-        st.session_state.history_max_keep = st.number_input("履歴の最大保持数", min_value=5, max_value=200, value=20, step=1)
+        max_keep = SQLITE_MAX_KEEP if st.session_state.use_sqlite else MEMORY_MAX_KEEP
+        st.number_input("履歴の最大保持数", min_value=5, max_value=SQLITE_MAX_KEEP, step=1, key="history_max_keep")
+        if st.session_state.history_max_keep > max_keep:
+            st.caption(f"メモリ保存では最大 {MEMORY_MAX_KEEP:,} 件までです。")
+        st.session_state.history.resize(max(5, min(int(st.session_state.history_max_keep), max_keep)))
         st.checkbox("全体ロールを履歴に保存する", value=st.session_state.add_roll_to_history, key="add_roll_to_history")
+        st.checkbox("まとめ振りの各セットを自動配置する", key="arrange_batch",
+                    help="「自動配置」の目的で各セットの値を並べ替えてから保存します（並べ替えたセットは出目を作り直せません）")
 
         st.checkbox("自動お気に入りを有効化", value=st.session_state.auto_fav_enabled, key="auto_fav_enabled")
         st.radio("条件の結合", options=["AND", "OR"],
@@ -281,132 +411,172 @@ def render_status_tab():
                  key="auto_fav_mode", horizontal=True)
 
         st.caption("自動お気に入りの範囲条件（下限/上限）。空=0で未指定。対象：全能力・全派生・TOTAL")
-        cond_df = pd.DataFrame({
-            "項目": ALL_KEYS_FOR_RULE,
-            "下限": [st.session_state.auto_min[k] or 0 for k in ALL_KEYS_FOR_RULE],
-            "上限": [st.session_state.auto_max[k] or 0 for k in ALL_KEYS_FOR_RULE],
-        })
-        edited_cond = st.data_editor(cond_df, use_container_width=True, num_rows="fixed", key="auto_cond_table")
-        for _, row in edited_cond.iterrows():
-            k = row["項目"]
-            lo = int(row["下限"]) if int(row["下限"]) != 0 else None
-            hi = int(row["上限"]) if int(row["上限"]) != 0 else None
-            st.session_state.auto_min[k] = lo
-            st.session_state.auto_max[k] = hi
-
-        # まとめて振る（履歴へ）
+        with prof.section("cond_table"):
+            # 表（pandas）は開いたときだけ作る。閉じている間は指定中の条件を 1 行で出す
+            cond_exp = st.expander("範囲条件の表", key="auto_cond_open", on_change="rerun")
+            if cond_exp.open:
+                import pandas as pd
+
+                cond_df = pd.DataFrame({
+                    "項目": ALL_KEYS_FOR_RULE,
+                    "下限": [st.session_state.auto_min[k] or 0 for k in ALL_KEYS_FOR_RULE],
+                    "上限": [st.session_state.auto_max[k] or 0 for k in ALL_KEYS_FOR_RULE],
+                })
+                edited_cond = cond_exp.data_editor(cond_df, use_container_width=True, num_rows="fixed",
+                                                   key="auto_cond_table")
+                for _, row in edited_cond.iterrows():
+                    k = row["項目"]
+                    lo = int(row["下限"]) if int(row["下限"]) != 0 else None
+                    hi = int(row["上限"]) if int(row["上限"]) != 0 else None
+                    st.session_state.auto_min[k] = lo
+                    st.session_state.auto_max[k] = hi
+            else:
+                ranges = [f"{k} {st.session_state.auto_min[k] or ''}〜{st.session_state.auto_max[k] or ''}"
+                          for k in ALL_KEYS_FOR_RULE if st.session_state.auto_min[k] or st.session_state.auto_max[k]]
+                st.caption("指定中：" + (" / ".join(ranges) or "なし"))
+
+        # 条件式（表の条件と「条件の結合」でつなぐ）
+        st.text_input("条件式（任意）", key="auto_fav_expr",
+                      placeholder="例: HP >= 14 and (EDU >= 18 or INT >= 17) / DB in {+1D4,+1D6}")
+        expr_src = st.session_state.auto_fav_expr.strip()
+        try:
+            if expr_src:
+                ruleexpr.compile_rule(expr_src)
+            st.session_state.auto_fav_expr_ok = expr_src
+        except ruleexpr.RuleSyntaxError as e:
+            st.session_state.auto_fav_expr_ok = ""
+            st.error(f"条件式エラー：{e}")
+
+        # 条件の出現確率（表だけなら厳密値、式を含むと推定値。設定ごとにキャッシュ）
+        has_rule = ruleexpr.combined_source(st.session_state.auto_fav_mode, st.session_state.auto_min,
+                                            st.session_state.auto_max, st.session_state.auto_fav_expr_ok) is not None
+        if st.session_state.auto_fav_enabled and has_rule:
+            with prof.section("acceptance"):
+                p_rule, exact = sampler.acceptance(st.session_state.auto_fav_mode,
+                                                   st.session_state.auto_min, st.session_state.auto_max,
+                                                   st.session_state.auto_fav_expr_ok,
+                                                   st.session_state.fixed_values, st.session_state.modifiers,
+                                                   apply_mod)
+            label = "" if exact else "（推定）"
+            if p_rule > 0:
+                st.caption(f"1セットが条件を満たす確率{label}：{p_rule:.4%}（約 1/{1 / p_rule:,.1f}）")
+            else:
+                st.caption("この条件を満たすセットは出ません（確率 0）。" if exact else "推定確率はほぼ 0 です。")
+
+        # まとめて振る（履歴へ）— NumPy で一括生成し、レコード化は残る分だけ
         if st.button("まとめて振る（履歴に追加）", use_container_width=True):
-            newrecs = []
-            for _ in range(int(n_sets)):
-                base_vals, finals, detail, adds = {}, {}, {}, {}
-                for abil in ABILS:
-                    base, d, add, final = roll_effective(abil)
-                    base_vals[abil] = base
-                    detail[abil]    = d
-                    adds[abil]      = add
-                    finals[abil]    = final
-                rec = make_record(finals, base_vals, detail, adds)
-                newrecs.append(rec)
-
-            # 履歴に前置 → トリム
-            st.session_state.history[:0] = newrecs
-            maxk = max(5, int(st.session_state.history_max_keep))
-            if len(st.session_state.history) > maxk:
-                del st.session_state.history[maxk:]
-
-            # 自動★は新規分だけ
-            favs = [r for r in newrecs if auto_fav_ok(r)]
-            if favs:
-                st.session_state.favorites[:0] = favs
-
-            st.success(f"{len(newrecs)} セットを履歴に追加しました（★ {len(favs)} 件）")
+            with prof.section("bulk_roll"):
+                n = int(n_sets)
+                rb = batch.roll_batch(n, st.session_state.fixed_values, st.session_state.modifiers, apply_mod,
+                                      rng=st.session_state.rng.job())
+                if st.session_state.arrange_batch and arrange_source():
+                    rolled = np.array([st.session_state.fixed_values[a] is None for a in ABILS])
+                    rb, _moved = arrange.arrange_batch(rb, arrange_source(), rolled)
+                fav_mask = batch.auto_fav_mask(batch.columns(rb.finals), st.session_state.auto_fav_enabled,
+                                               st.session_state.auto_fav_mode,
+                                               st.session_state.auto_min, st.session_state.auto_max,
+                                               st.session_state.auto_fav_expr_ok)
+                fav_rows = fav_mask.nonzero()[0]
+                uid0 = new_uids(n)
+
+                # 履歴に前置（容量を超える分は最初から書かない）
+                keep = min(n, st.session_state.history.capacity)
+                st.session_state.history.extend_batch(rb, range(keep), st.session_state.modifiers, apply_mod, uid0)
+
+                # 自動★は新規分だけ
+                st.session_state.favorites.extend_batch(rb, fav_rows, st.session_state.modifiers, apply_mod, uid0)
+
+                # リーダーボードには履歴に残らない分も含めて全部流す
+                st.session_state.topk.feed_batch(rb, st.session_state.modifiers, apply_mod, uid0)
+
+                st.success(f"{n} セットを履歴に追加しました（★ {len(fav_rows)} 件）")
+
+        # ★が N 件そろうまで振る（条件付きサンプリング・履歴には残さない）
+        st.markdown("---")
+        st.subheader("★が N 件出るまで振る")
+        n_target = st.number_input("★の件数", min_value=1, max_value=10_000, value=5, step=1, key="fav_target_n")
+        if st.button("条件を満たすまで振る（★に追加）", use_container_width=True):
+            with prof.section("roll_until"):
+                if not has_rule:
+                    st.warning("自動お気に入りの条件が未指定です。")
+                else:
+                    p, _exact = sampler.acceptance(st.session_state.auto_fav_mode, st.session_state.auto_min,
+                                                   st.session_state.auto_max, st.session_state.auto_fav_expr_ok,
+                                                   st.session_state.fixed_values, st.session_state.modifiers,
+                                                   apply_mod)
+                    expected = int(n_target) / p if p > 0 else float("inf")
+                    if p > 0 and expected > UNTIL_MAX_ROLLS:
+                        st.warning(f"条件が厳しすぎます（{int(n_target)} 件に期待値 {expected:,.0f} セット。"
+                                   f"1 回に振れるのは {UNTIL_MAX_ROLLS:,} セットまでです）。"
+                                   "件数を減らすか、条件をゆるめてください。")
+                    else:
+                        try:
+                            res = sampler.roll_until(int(n_target), st.session_state.auto_fav_mode,
+                                                     st.session_state.auto_min, st.session_state.auto_max,
+                                                     st.session_state.fixed_values, st.session_state.modifiers,
+                                                     apply_mod, rng=st.session_state.rng.job(),
+                                                     max_rolls=UNTIL_MAX_ROLLS,
+                                                     expr=st.session_state.auto_fav_expr_ok)
+                        except ValueError as e:
+                            st.warning(str(e))
+                        else:
+                            n_got = len(res.batch.finals)
+                            uid0 = new_uids(n_got)
+                            st.session_state.favorites.extend_batch(
+                                res.batch, range(n_got), st.session_state.modifiers, apply_mod, uid0)
+                            st.session_state.topk.feed_batch(res.batch, st.session_state.modifiers, apply_mod, uid0)
+                            msg = f"★ {n_got} 件を追加しました（振った数 {res.rolled:,} / 期待値 {res.expected_rolls:,.0f}）"
+                            if n_got < int(n_target):
+                                st.warning(msg + f"。上限の {UNTIL_MAX_ROLLS:,} セットで打ち切りました。")
+                            else:
+                                st.success(msg)
+
+        st.markdown("---")
+        st.subheader("デバッグ")
+        st.checkbox("再実行を計測する", value=prof.enabled, key="profile_enabled", on_change=cb_profile_enabled,
+                    help="画面の部品ごとの処理時間とセッション状態の大きさを記録し、ページ下部に表示します")
 
         # サイドバーで値が変わった後にもう一度チェック（数値入力に追従）
-        _check_recompute_mods()
+        with prof.section("recompute_mods"):
+            _check_recompute_mods()
 
     # =========================
     # 全体振り（履歴保存オプションあり）
     # =========================
-    def roll_all_into_current(save_to_history: bool):
-        base_vals, finals, detail, adds = {}, {}, {}, {}
-        for abil in ABILS:
-            base, d, add, final = roll_effective(abil)
-            st.session_state.current_base[abil]   = base
-            st.session_state.current_detail[abil] = d
-            st.session_state.current_add[abil]    = add
-            st.session_state.current_stats[abil]  = final
-
-            base_vals[abil] = base
-            finals[abil]    = final
-            detail[abil]    = d
-            adds[abil]      = add
-
-        # レコードは常に作る（★判定のため）
-        rec = make_record(finals, base_vals, detail, adds)
+    def roll_all_into_current(save_to_history: bool) -> List[str]:
+        """1 セット振って現在セットにする。戻り: 中身が変わった部品（fragment の key）"""
+        # レコードは常に作る（★判定のため）。安定ID付与（チェック保持用）
+        rec = roll_one_set(new_uids(1))
+        adopt_record(rec)
+        changed = ["current"]
 
         # 履歴保存はトグルに従う
         if save_to_history:
-            st.session_state.history.insert(0, rec)
-            maxk = max(5, int(st.session_state.history_max_keep))
-            if len(st.session_state.history) > maxk:
-                del st.session_state.history[maxk:]
+            st.session_state.history.append(rec)
+            changed.append("history")
 
         # ★は常に条件判定して自動追加
         if auto_fav_ok(rec):
-            st.session_state.favorites.insert(0, rec)
+            st.session_state.favorites.append(rec)
+            changed.append("favorites")
+        if st.session_state.topk.feed_record(rec):
+            changed.append("leaderboard")
+        return changed
 
-    b1, b3 = st.columns([1,2])
-    with b1:
-        if st.button("🎲 全能力を振る", use_container_width=True):
-            roll_all_into_current(st.session_state.add_roll_to_history)
-            st.success("現在セットを新規ロールしました。")
-    with b3:
-        st.caption("固定あり→固定値／固定なし→ダイス。履歴保存はトグルでON/OFF。最終値はモディファイア設定に従う。")
-
-    st.markdown("---")
+    def cb_roll_all():
+        changed = roll_all_into_current(st.session_state.add_roll_to_history)
+        flash("current", "succ", "現在セットを新規ロールしました。")
+        st.rerun(changed)   # 履歴/★/リーダーボードは中身が変わったときだけ描き直す
 
     # =========================
-    # 能力一覧（横並び）＋ TOTAL（EDUの右）
+    # 現在セット（全体振り・能力一覧・入れ替え・派生）— 振り直し/入れ替えはここだけ再実行
     # =========================
-    st.subheader("能力一覧（横並び）")
-
     def cb_reroll_one(abil: str):
-        base, d, add, final = roll_effective(abil)
-        st.session_state.current_base[abil]   = base
-        st.session_state.current_detail[abil] = d
-        st.session_state.current_add[abil]    = add
-        st.session_state.current_stats[abil]  = final
-
-    # 8能力＋TOTALで9列
-    cols = st.columns(len(ABILS) + 1)
-
-    # 各能力
-    for i, abil in enumerate(ABILS):
-        with cols[i]:
-            st.markdown(f"### {abil}  \n<small>{ROLL_SPEC[abil][0]}</small>", unsafe_allow_html=True)
-            detail = st.session_state.current_detail.get(abil, [])
-            add = st.session_state.current_add.get(abil, 0)
-            if detail:
-                st.text(f"出目: [{', '.join(map(str, detail))}]" + (f" +{add}" if add else ""))
-            else:
-                st.text("出目: - (" + ("固定" if st.session_state.fixed_values.get(abil) is not None else "未振り") + ")")
-            final_val = st.session_state.current_stats.get(abil, 0)
-            st.metric("最終値", final_val, help="モディファイア適用後（トグルでON/OFF）")
-            st.button("🎲", key=f"reroll_{abil}", help=f"{abil} を振り直す",
-                      use_container_width=True, on_click=cb_reroll_one, args=(abil,))
-
-    # TOTAL（EDUの右）
-    with cols[-1]:
-        finals_now = {a: st.session_state.current_stats[a] for a in ABILS}
-        st.markdown("### TOTAL  \n<small>sum of abilities</small>", unsafe_allow_html=True)
-        st.metric("合計", total_score(finals_now))
-
-    st.markdown("---")
-
-    # =========================
-    # 出目入れ替え（スワップ） / xポイント移動 — フォームで即実行
-    # =========================
-    st.subheader("出目入れ替え（スワップ） / xポイント移動")
+        rec = roll_one_set()
+        st.session_state.current_base[abil]   = rec["_base"][abil]
+        st.session_state.current_detail[abil] = rec["_detail"][abil]
+        st.session_state.current_add[abil]    = rec["_adds"][abil]
+        st.session_state.current_stats[abil]  = rec[abil]
 
     def swap(a: str, b: str):
         cs = st.session_state.current_stats
@@ -422,203 +592,425 @@ def render_status_tab():
         st.session_state.current_stats[from_a] -= x
         st.session_state.current_stats[to_b]   += x
 
-    colL, colR = st.columns(2)
-
-    # 左：入れ替え（独立フォームで1クリック即実行）
-    with colL:
-        with st.form("swap_form", clear_on_submit=False):
-            swap_a = st.selectbox("入れ替え元", ABILS, index=0, key="swap_a")
-            swap_b = st.selectbox("入れ替え先", ABILS, index=1, key="swap_b")
-            submitted_swap = st.form_submit_button("↔ 入れ替える", use_container_width=True, key="btn_swap")
-            if submitted_swap:
-                if swap_a == swap_b:
-                    st.session_state._toast = ("warn", "同じ能力は入れ替えできません。")
-                else:
-                    swap(swap_a, swap_b)
-                    st.session_state._toast = ("succ", f"{swap_a} と {swap_b} を入れ替えました。")
-                st.rerun()
-
-    # 右：ポイント移動（独立フォームで1クリック即実行）
-    with colR:
-        with st.form("move_form", clear_on_submit=False):
-            move_from = st.selectbox("減らす能力", ABILS, index=0, key="move_from")
-            move_to   = st.selectbox("増やす能力", ABILS, index=1, key="move_to")
-            move_x    = st.number_input("移動ポイント", min_value=1, max_value=50, value=1, step=1, key="move_x")
-            submitted_move = st.form_submit_button("➕➖ 移動を実行", use_container_width=True, key="btn_move")
-            if submitted_move:
-                if move_from == move_to:
-                    st.session_state._toast = ("warn", "同じ能力へは移動できません。")
+    # 自動配置：同じダイス式の能力どうしで値を並べ替えて、目的のスコアを最大にする
+    def auto_arrange(src: str):
+        base = np.array([[st.session_state.current_base[a] for a in ABILS]], np.int16)
+        finals = np.array([[st.session_state.current_stats[a] for a in ABILS]], np.int16)
+        rolled = np.array([bool(st.session_state.current_detail.get(a)) for a in ABILS])
+        before = float(ruleexpr.compile_score(src).values(batch.columns(finals))[0])
+        perms, best = arrange.best_perms(base, finals, rolled, src)
+        moved = [a for c, a in enumerate(ABILS) if perms[0, c] != c]
+        if not moved:
+            return None
+        src_of = {a: ABILS[perms[0, c]] for c, a in enumerate(ABILS)}
+        for state in ("current_base", "current_detail", "current_add"):
+            old = dict(st.session_state[state])
+            st.session_state[state] = {a: old[src_of[a]] for a in ABILS}
+        _recompute_current_from_mods()
+        return moved, before, float(best[0])
+
+    # フォームの送信はコールバックで処理する（送信後の fragment 再実行で新しい値が描かれる）
+    def cb_swap():
+        a, b = st.session_state.swap_a, st.session_state.swap_b
+        if a == b:
+            flash("current", "warn", "同じ能力は入れ替えできません。")
+        else:
+            swap(a, b)
+            flash("current", "succ", f"{a} と {b} を入れ替えました。")
+
+    def cb_move():
+        a, b, x = st.session_state.move_from, st.session_state.move_to, int(st.session_state.move_x)
+        if a == b:
+            flash("current", "warn", "同じ能力へは移動できません。")
+        else:
+            move_points(a, b, x)
+            flash("current", "info", f"{a} -{x} / {b} +{x}（合計不変）")
+
+    def cb_arrange():
+        src = arrange_source()
+        if src is None:
+            flash("current", "warn", "スコア式を入力してください（または式にエラーがあります）。")
+            return
+        res = auto_arrange(src)
+        if res is None:
+            flash("current", "info", "今の並びがすでに最善です。")
+        else:
+            moved, before, after = res
+            before, after = (f"{v:g}" if np.isfinite(v) else "0 で割る" for v in (before, after))
+            flash("current", "succ", f"{' / '.join(moved)} を並べ替えました（{src}: {before} → {after}）")
+
+    @st.fragment(key="current")
+    @prof.timed("current")
+    def current_set_panel():
+        b1, b3 = st.columns([1,2])
+        with b1:
+            st.button("🎲 全能力を振る", use_container_width=True, on_click=cb_roll_all)
+        with b3:
+            st.caption("固定あり→固定値／固定なし→ダイス。履歴保存はトグルでON/OFF。最終値はモディファイア設定に従う。")
+
+        st.markdown("---")
+
+        # =========================
+        # 能力一覧（横並び）＋ TOTAL（EDUの右）
+        # =========================
+        st.subheader("能力一覧（横並び）")
+
+        # 8能力＋TOTALで9列
+        cols = st.columns(len(ABILS) + 1)
+
+        # 各能力
+        for i, abil in enumerate(ABILS):
+            with cols[i]:
+                st.markdown(f"### {abil}  \n<small>{ROLL_SPEC[abil][0]}</small>", unsafe_allow_html=True)
+                detail = st.session_state.current_detail.get(abil, [])
+                add = st.session_state.current_add.get(abil, 0)
+                if detail:
+                    st.text(f"出目: [{', '.join(map(str, detail))}]" + (f" +{add}" if add else ""))
                 else:
-                    move_points(move_from, move_to, int(move_x))
-                    st.session_state._toast = ("info", f"{move_from} -{move_x} / {move_to} +{move_x}（合計不変）")
-                st.rerun()
+                    st.text("出目: - (" + ("固定" if st.session_state.fixed_values.get(abil) is not None else "未振り") + ")")
+                final_val = st.session_state.current_stats.get(abil, 0)
+                st.metric("最終値", final_val, help="モディファイア適用後（トグルでON/OFF）")
+                st.button("🎲", key=f"reroll_{abil}", help=f"{abil} を振り直す",
+                          use_container_width=True, on_click=cb_reroll_one, args=(abil,))
+
+        # TOTAL（EDUの右）
+        with cols[-1]:
+            finals_now = {a: st.session_state.current_stats[a] for a in ABILS}
+            st.markdown("### TOTAL  \n<small>sum of abilities</small>", unsafe_allow_html=True)
+            st.metric("合計", total_score(finals_now))
 
-    # フォームでセットしたメッセージを次フレームで表示
-    if "_toast" in st.session_state:
-        kind, msg = st.session_state.pop("_toast")
-        {"succ": st.success, "warn": st.warning, "info": st.info}[kind](msg)
+        st.markdown("---")
 
-    # 範囲警告（ベース値で評価）
-    warns = []
-    for k in ABILS:
-        v = st.session_state.current_base.get(k, 0)
-        if v < WARN_MIN[k] or v > WARN_MAX[k]:
-            warns.append(f"{k} が範囲外（{v} / 推奨 {WARN_MIN[k]}〜{WARN_MAX[k]}）")
-    if warns:
-        st.warning(" / ".join(warns))
+        # =========================
+        # 出目入れ替え（スワップ） / xポイント移動 — フォームで即実行
+        # =========================
+        st.subheader("出目入れ替え（スワップ） / xポイント移動")
+
+        colL, colR = st.columns(2)
+
+        # 左：入れ替え（独立フォームで1クリック即実行）
+        with colL:
+            with st.form("swap_form", clear_on_submit=False):
+                st.selectbox("入れ替え元", ABILS, index=0, key="swap_a")
+                st.selectbox("入れ替え先", ABILS, index=1, key="swap_b")
+                st.form_submit_button("↔ 入れ替える", use_container_width=True, key="btn_swap", on_click=cb_swap)
+
+        # 右：ポイント移動（独立フォームで1クリック即実行）
+        with colR:
+            with st.form("move_form", clear_on_submit=False):
+                st.selectbox("減らす能力", ABILS, index=0, key="move_from")
+                st.selectbox("増やす能力", ABILS, index=1, key="move_to")
+                st.number_input("移動ポイント", min_value=1, max_value=50, value=1, step=1, key="move_x")
+                st.form_submit_button("➕➖ 移動を実行", use_container_width=True, key="btn_move", on_click=cb_move)
+
+        with st.form("arrange_form", clear_on_submit=False):
+            cA1, cA2, cA3 = st.columns([1, 2, 1])
+            with cA1:
+                st.selectbox("自動配置の目的", list(ARRANGE_PRESETS), key="arrange_preset")
+            with cA2:
+                st.text_input("スコア式（「式を入力」のとき）", key="arrange_expr", placeholder="例: 職業P + 2*HP")
+            with cA3:
+                st.form_submit_button("🧮 自動配置", use_container_width=True, on_click=cb_arrange)
+            st.caption("同じダイス式の能力どうし（3d6 どうし / 2d6+6 の SIZ・INT）で値を入れ替えて、目的を最大にします。"
+                       "固定値の能力は動かしません。")
+
+        # 操作のメッセージ（コールバックや他の部品からの採用でセットしたもの）
+        show_flash("current")
+
+        # 範囲警告（ベース値で評価）
+        warns = []
+        for k in ABILS:
+            v = st.session_state.current_base.get(k, 0)
+            if v < WARN_MIN[k] or v > WARN_MAX[k]:
+                warns.append(f"{k} が範囲外（{v} / 推奨 {WARN_MIN[k]}〜{WARN_MAX[k]}）")
+        if warns:
+            st.warning(" / ".join(warns))
 
-    st.markdown("---")
+        st.markdown("---")
+
+        # =========================
+        # 派生ステータス
+        # =========================
+        st.subheader("派生ステータス")
+        finals_now = {a: st.session_state.current_stats[a] for a in ABILS}
+        deriv = derived_stats(finals_now)
+        db = damage_bonus(finals_now["STR"], finals_now["SIZ"])
+
+        cA, cB, cC, cD = st.columns(4)
+        with cA:
+            st.metric("HP", deriv["HP"])
+            st.metric("MP", deriv["MP"])
+        with cB:
+            st.metric("SAN", deriv["SAN"])
+            st.metric("幸運", deriv["幸運"])
+        with cC:
+            st.metric("アイデア", deriv["アイデア"])
+            st.metric("知識", deriv["知識"])
+        with cD:
+            st.metric("職業P", deriv["職業P"])
+            st.metric("興味P", deriv["興味P"])
+        st.info(f"ダメージボーナス（STR+SIZ={finals_now['STR']+finals_now['SIZ']}）：**{db}**")
+
+        st.markdown("---")
+
+    current_set_panel()
+
+    # 他の部品から現在セットへ採用する（現在セットだけ描き直す）
+    def cb_adopt(rec: Optional[Dict[str, Any]], msg: str, panel: str):
+        if rec is None:
+            flash(panel, "info", "チェックがありません。")
+            return
+        adopt_record(rec)
+        flash("current", "succ", msg)
+        st.rerun("current")
+
+    def cb_copy_to_favs(rows: Rows, panel: str):
+        """rows のうち★にないものを★へ（★だけ描き直す）"""
+        new = ~np.isin(rows.uids, st.session_state.favorites.uids())
+        st.session_state.favorites.add_rows(Rows(*(f[new] for f in rows)))
+        flash("favorites", "succ", f"★に追加：{int(new.sum())} 件（{panel}から）")
+        st.rerun("favorites")
 
     # =========================
-    # 派生ステータス
+    # 履歴（並べ替え・採用・★チェック保持）
     # =========================
-    st.subheader("派生ステータス")
-    finals_now = {a: st.session_state.current_stats[a] for a in ABILS}
-    deriv = derived_stats(finals_now)
-    db = damage_bonus(finals_now["STR"], finals_now["SIZ"])
-
-    cA, cB, cC, cD = st.columns(4)
-    with cA:
-        st.metric("HP", deriv["HP"])
-        st.metric("MP", deriv["MP"])
-    with cB:
-        st.metric("SAN", deriv["SAN"])
-        st.metric("幸運", deriv["幸運"])
-    with cC:
-        st.metric("アイデア", deriv["アイデア"])
-        st.metric("知識", deriv["知識"])
-    with cD:
-        st.metric("職業P", deriv["職業P"])
-        st.metric("興味P", deriv["興味P"])
-    st.info(f"ダメージボーナス（STR+SIZ={finals_now['STR']+finals_now['SIZ']}）：**{db}**")
+    @st.fragment(key="history")
+    @prof.timed("history")
+    def history_panel():
+        hist_exp = st.expander("履歴（並べ替え・採用・★チェック）", key="hist_open", on_change="rerun")
+        with hist_exp:
+            hist = st.session_state.history
+            if len(hist):
+                sort_key = st.selectbox("並べ替え", options=TABLE_SORT_KEYS, index=0)
+                ascending = st.toggle("昇順", value=False, key="hist_asc")
+                where = table_filter("絞り込み（条件式・任意）", "hist_filter")
+                page = table_page(st.session_state.hist_view, hist, where, "hist_page")
+                if not hist_exp.open:   # 閉じている間は表を作らない（並べ替え・絞り込みの入力は残す）
+                    return
+
+                # 並べ替え済みの表は履歴が変わったときだけ作り直す（SQLite 保存ならクエリで取得）
+                with prof.section("frame"):
+                    df_view = st.session_state.hist_view.frame(hist, sort_key, ascending,
+                                                               st.session_state.hist_selected_uids, page, where)
+
+                with prof.section("editor"):
+                    edited = st.data_editor(
+                        df_view,
+                        use_container_width=True,
+                        height=380,
+                        column_config=TABLE_COLUMNS,
+                        key="hist_editor"
+                    )
+                # 表に出ていない行のチェックは保持する
+                st.session_state.hist_selected_uids = (
+                    (st.session_state.hist_selected_uids - set(edited["_uid"].tolist()))
+                    | set(edited.loc[edited["★チェック"] == True, "_uid"].tolist())
+                )
 
-    st.markdown("---")
+                idx = st.number_input("採用（履歴の先頭=0）", min_value=0, max_value=max(0, len(hist)-1), value=0,
+                                      step=1, key="hist_adopt_idx")
+                checked = hist.take_uids(st.session_state.hist_selected_uids)
+                cH1, cH2, cH3 = st.columns(3)
+                with cH1:
+                    st.button("このIDを現在セットに採用", use_container_width=True, on_click=cb_adopt,
+                              args=(hist.get(int(idx)), f"履歴の {int(idx)} 件目を採用しました。", "history"))
+                with cH2:
+                    st.button("チェック行を★に追加", use_container_width=True, on_click=cb_copy_to_favs,
+                              args=(checked, "履歴"))
+                with cH3:
+                    st.button("チェック先頭を現在セットに採用", use_container_width=True, on_click=cb_adopt,
+                              args=(checked.record(0) if len(checked.uids) else None,
+                                    "チェック先頭の1件を採用しました。", "history"))
+                show_flash("history")
+                export_button("履歴", hist, "coc6_history", "hist_export")
+            else:
+                st.info("履歴は空です。サイドバーや上部ボタンでロールしてください。")
+
+    history_panel()
 
     # =========================
-    # 履歴（並べ替え・採用・★チェック保持）
+    # リーダーボード（スコア上位 K。まとめ振り・全体ロールのたびに更新）
     # =========================
-    with st.expander("履歴（並べ替え・採用・★チェック）", expanded=False):
-        if st.session_state.history:
-            sort_key = st.selectbox("並べ替え", options=["TOTAL"] + DERIVED_KEYS + ABILS, index=0)
-            ascending = st.toggle("昇順", value=False, key="hist_asc")
-
-            df_hist = pd.DataFrame(st.session_state.history)
-            if "_uid" not in df_hist.columns:
-                df_hist["_uid"] = range(10_000, 10_000 + len(df_hist))
-            df_hist = df_hist.sort_values(by=sort_key, ascending=ascending).reset_index(drop=True)
-
-            cols_show = ["_uid"] + ABILS + ["TOTAL"] + DERIVED_KEYS
-            df_view = df_hist[cols_show].copy()
-            df_view.insert(0, "★チェック", df_view["_uid"].isin(st.session_state.hist_selected_uids))
-
-            edited = st.data_editor(
-                df_view,
-                use_container_width=True,
-                height=380,
-                column_config={"_uid": st.column_config.NumberColumn("UID", disabled=True)},
-                key="hist_editor"
-            )
-            st.session_state.hist_selected_uids = set(edited.loc[edited["★チェック"] == True, "_uid"].tolist())
-
-            idx = st.number_input("採用（履歴の先頭=0）", min_value=0, max_value=max(0, len(st.session_state.history)-1), value=0, step=1)
-            cH1, cH2, cH3 = st.columns(3)
-            with cH1:
-                if st.button("このIDを現在セットに採用", use_container_width=True):
-                    adopt_record(st.session_state.history[int(idx)])
-            with cH2:
-                if st.button("チェック行を★に追加", use_container_width=True):
-                    added = 0
-                    uids = st.session_state.hist_selected_uids
-                    for rec in st.session_state.history:
-                        if rec.get("_uid") in uids:
-                            st.session_state.favorites.insert(0, rec)
-                            added += 1
-                    st.success(f"★に追加：{added} 件")
-            with cH3:
-                if st.button("チェック先頭を現在セットに採用", use_container_width=True):
-                    picked = next((r for r in st.session_state.history if r.get("_uid") in st.session_state.hist_selected_uids), None)
-                    if picked:
-                        adopt_record(picked)
-                        st.success("チェック先頭の1件を採用しました。")
-                    else:
-                        st.info("チェックがありません。")
-        else:
-            st.info("履歴は空です。サイドバーや上部ボタンでロールしてください。")
+    @st.fragment(key="leaderboard")
+    @prof.timed("leaderboard")
+    def leaderboard_panel():
+        top_exp = st.expander("🏆 リーダーボード（スコア上位）", key="topk_open", on_change="rerun")
+        with top_exp:
+            cL1, cL2 = st.columns([3, 1])
+            with cL1:
+                st.text_input("スコア式", key="topk_score",
+                              help="大きいほど上位。例: TOTAL / 職業P+興味P / HP / TOTAL + 2*EDU")
+            with cL2:
+                st.number_input("K（件数）", min_value=1, max_value=TOPK_MAX, step=1, key="topk_k")
+            top = st.session_state.topk
+            score_src = st.session_state.topk_score.strip() or "TOTAL"
+            if score_src != top.score.source or int(st.session_state.topk_k) != top.k:
+                try:
+                    with prof.section("rebuild"):
+                        rebuild_topk(score_src, int(st.session_state.topk_k))
+                except ruleexpr.RuleSyntaxError as e:
+                    st.error(f"スコア式エラー：{e}")
+                top = st.session_state.topk
+            if not top_exp.open:   # 閉じている間は表を作らない（スコア式と K の入力は残す）
+                return
+
+            if len(top):
+                st.caption(f"スコア「{top.score.source}」の上位 {len(top):,} 件（流し込んだ {top.seen:,} セット中。"
+                           f"入るには {top.threshold():g} 以上）")
+                with prof.section("frame"):
+                    df_top = leaderboard_frame(top)
+                st.dataframe(df_top, use_container_width=True, height=360, hide_index=True,
+                             column_config={"_uid": st.column_config.NumberColumn("UID")})
+                rank = int(st.number_input("順位", min_value=1, max_value=len(top), value=1, step=1, key="topk_rank"))
+                cT1, cT2, cT3 = st.columns(3)
+                with cT1:
+                    st.button("この順位を現在セットに採用", use_container_width=True, on_click=cb_adopt,
+                              args=(top.rows.record(rank - 1), f"リーダーボードの {rank} 位を採用しました。",
+                                    "leaderboard"))
+                with cT2:
+                    st.button("リーダーボードを★に追加", use_container_width=True, on_click=cb_copy_to_favs,
+                              args=(top.rows, "リーダーボード"))
+                with cT3:
+                    st.button("リーダーボードをリセット", use_container_width=True, on_click=top.clear)
+            else:
+                st.info("まだ何も振っていません。まとめて振るか、全能力を振ると上位がここに出ます。")
+
+    leaderboard_panel()
 
     # =========================
-    # お気に入り（★） — 履歴風UI（チェック保持・採用・削除）
+    # バランスの取れたパーティー（候補をまとめて振り、差の小さい k 人を選ぶ）
     # =========================
-    st.subheader("お気に入り（★）")
-    if st.session_state.favorites:
-        df_fav = pd.DataFrame(st.session_state.favorites)
-        if "_uid" not in df_fav.columns:
-            df_fav["_uid"] = range(20_000, 20_000 + len(df_fav))
-
-        sort_key_f = st.selectbox("並べ替え（★）", options=["TOTAL"] + DERIVED_KEYS + ABILS, index=0, key="fav_sort_key")
-        ascending_f = st.toggle("昇順（★）", value=False, key="fav_asc")
-
-        if sort_key_f in df_fav.columns:
-            df_fav = df_fav.sort_values(by=sort_key_f, ascending=ascending_f).reset_index(drop=True)
-
-        cols_show_f = ["_uid"] + ABILS + ["TOTAL"] + DERIVED_KEYS
-        df_view_f = df_fav[cols_show_f].copy()
-        df_view_f.insert(0, "✓", df_view_f["_uid"].isin(st.session_state.fav_selected_uids))
-
-        edited_f = st.data_editor(
-            df_view_f,
-            use_container_width=True,
-            height=360,
-            column_config={"_uid": st.column_config.NumberColumn("UID", disabled=True)},
-            key="fav_editor"
-        )
-        st.session_state.fav_selected_uids = set(edited_f.loc[edited_f["✓"] == True, "_uid"].tolist())
-
-        cF1, cF2, cF3 = st.columns(3)
-        with cF1:
-            if st.button("選択行を現在セットに採用", use_container_width=True):
-                picked = next((rec for rec in st.session_state.favorites if rec.get("_uid") in st.session_state.fav_selected_uids), None)
-                if picked:
-                    adopt_record(picked)
-                    st.success("★から採用しました。")
-                else:
-                    st.info("チェックがありません。")
-
-        with cF2:
-            if st.button("選択行を★から削除", use_container_width=True):
-                if st.session_state.fav_selected_uids:
-                    st.session_state.favorites = [
-                        rec for rec in st.session_state.favorites
-                        if rec.get("_uid") not in st.session_state.fav_selected_uids
-                    ]
-                    st.session_state.fav_selected_uids.clear()
-                    st.success("選択した★を削除しました。")
+    PARTY_PREFER = {"高い組": "high", "中くらいの組": "mid", "低い組": "low"}
+
+    @st.fragment(key="party")
+    @prof.timed("party")
+    def party_panel():
+        party_exp = st.expander("🧭 バランスの取れたパーティー", key="party_open", on_change="rerun")
+        with party_exp:
+            st.caption("今の固定値・モディファイアで候補をまとめて振り（履歴には残しません）、選んだ項目の差"
+                       "（最大 - 最小を標準偏差で割った値のうち一番大きいもの）が最も小さい k 人を選びます。")
+            cP1, cP2, cP3 = st.columns([1, 1, 2])
+            with cP1:
+                k = int(st.number_input("人数", min_value=2, max_value=10, value=5, step=1, key="party_k"))
+            with cP2:
+                pool = int(st.number_input("候補のセット数", min_value=1_000, max_value=1_000_000, value=party.POOL,
+                                           step=10_000, key="party_pool"))
+            with cP3:
+                keys = st.multiselect("そろえる項目", party.NUMERIC_KEYS, default=party.PARTY_KEYS,
+                                      max_selections=party.MAX_KEYS, key="party_keys")
+            bands = {}
+            for col, key in zip(st.columns(max(1, len(keys))), keys):
+                with col:
+                    w = st.number_input(f"{key} の差の上限", min_value=0, value=None, step=1, key=f"party_band_{key}",
+                                        placeholder="上限なし")
+                if w is not None:
+                    bands[key] = int(w)
+            members = st.text_input("1 人ずつの条件（条件式・任意）", key="party_members",
+                                    placeholder="例: HP >= 12 and EDU >= 12")
+            prefer = st.radio("差が同じ組が複数あるとき（先頭の項目で）", list(PARTY_PREFER), horizontal=True,
+                              key="party_prefer")
+            if st.button("パーティーを探す", use_container_width=True, disabled=not keys):
+                try:
+                    with prof.section("search"):
+                        rb, found = party.balanced_party(k, pool, st.session_state.fixed_values,
+                                                         st.session_state.modifiers, apply_mod,
+                                                         rng=st.session_state.rng.job(), keys=keys, bands=bands,
+                                                         members=members, prefer=PARTY_PREFER[prefer])
+                except ValueError as e:   # 条件式の誤り（RuleSyntaxError）も
+                    st.warning(str(e))
                 else:
-                    st.info("チェックがありません。")
-
-        with cF3:
-            # CSVエクスポート
-            def fav_df_csv():
-                rows = []
-                for rec in st.session_state.favorites:
-                    row = {k: rec.get(k, 0) for k in ABILS}
-                    row.update({k: rec.get(k) for k in ["TOTAL"] + DERIVED_KEYS})
-                    rows.append(row)
-                return pd.DataFrame(rows) if rows else pd.DataFrame()
-            csv_bytes = fav_df_csv().to_csv(index=False).encode("utf-8")
-            st.download_button("★ をCSVでダウンロード", data=csv_bytes, file_name="coc6_favorites.csv",
-                               mime="text/csv", use_container_width=True)
-
-        if st.button("★ を全削除", use_container_width=True, type="secondary"):
-            st.session_state.favorites.clear()
+                    uid0 = new_uids(pool)
+                    st.session_state.party_result = (rb, found, uid0, dict(st.session_state.modifiers), apply_mod)
+            if not party_exp.open:   # 閉じている間は表を作らない（入力は残す）
+                return
+
+            if st.session_state.party_result is None:
+                st.caption("まだ探していません。")
+                return
+            rb, found, uid0, mods, applied = st.session_state.party_result
+            rows = batch_rows(rb, found.rows, mods, applied, uid0)
+            st.caption(f"候補 {found.candidates:,} 件から {len(found.rows)} 人。差（標準偏差で割った最大）"
+                       f"{found.spread:.2f}　" + "　".join(f"{key} の差 {v}" for key, v in found.ranges.items()))
+            cols = batch.columns(rows.finals)
+            st.dataframe({"_uid": rows.uids, **{c: cols[c] for c in ABILS + ["TOTAL"] + DERIVED_KEYS}},
+                         use_container_width=True, hide_index=True,
+                         column_config={"_uid": st.column_config.NumberColumn("UID")})
+            st.button("パーティーを★に追加", use_container_width=True, on_click=cb_copy_to_favs,
+                      args=(rows, "パーティー"))
+
+    party_panel()
+
+    # =========================
+    # お気に入り（★） — 履歴風UI（チェック保持・採用・削除）
+    # =========================
+    def cb_remove_favs():
+        if st.session_state.fav_selected_uids:
+            st.session_state.favorites.remove_uids(st.session_state.fav_selected_uids)
             st.session_state.fav_selected_uids.clear()
-            st.success("★ を空にしました。")
-    else:
-        st.info("★ は空です。履歴からチェック追加するか、自動お気に入りを使ってね。")
+            flash("favorites", "succ", "選択した★を削除しました。")
+        else:
+            flash("favorites", "info", "チェックがありません。")
+
+    def cb_clear_favs():
+        st.session_state.favorites.clear()
+        st.session_state.fav_selected_uids.clear()
+        flash("favorites", "succ", "★ を空にしました。")
+
+    @st.fragment(key="favorites")
+    @prof.timed("favorites")
+    def favorites_panel():
+        st.subheader("お気に入り（★）")
+        show_flash("favorites")
+        favs = st.session_state.favorites
+        if len(favs):
+            sort_key_f = st.selectbox("並べ替え（★）", options=TABLE_SORT_KEYS, index=0,
+                                      key="fav_sort_key")
+            ascending_f = st.toggle("昇順（★）", value=False, key="fav_asc")
+            where_f = table_filter("絞り込み（★・条件式・任意）", "fav_filter")
+            page_f = table_page(st.session_state.fav_view, favs, where_f, "fav_page")
+
+            with prof.section("frame"):
+                df_view_f = st.session_state.fav_view.frame(favs, sort_key_f, ascending_f,
+                                                            st.session_state.fav_selected_uids, page_f, where_f)
+
+            with prof.section("editor"):
+                edited_f = st.data_editor(
+                    df_view_f,
+                    use_container_width=True,
+                    height=360,
+                    column_config=TABLE_COLUMNS,
+                    key="fav_editor"
+                )
+            st.session_state.fav_selected_uids = (
+                (st.session_state.fav_selected_uids - set(edited_f["_uid"].tolist()))
+                | set(edited_f.loc[edited_f["✓"] == True, "_uid"].tolist())
+            )
+
+            checked = favs.take_uids(st.session_state.fav_selected_uids)
+            cF1, cF2, cF3 = st.columns(3)
+            with cF1:
+                st.button("選択行を現在セットに採用", use_container_width=True, on_click=cb_adopt,
+                          args=(checked.record(0) if len(checked.uids) else None, "★から採用しました。",
+                                "favorites"))
+
+            with cF2:
+                st.button("選択行を★から削除", use_container_width=True, on_click=cb_remove_favs)
+
+            with cF3:
+                export_button("★ ", favs, "coc6_favorites", "fav_export")
+
+            st.button("★ を全削除", use_container_width=True, type="secondary", on_click=cb_clear_favs)
+        else:
+            st.info("★ は空です。履歴からチェック追加するか、自動お気に入りを使ってね。")
+
+    favorites_panel()
 
 
 # =========================
 # ガチャタブ
 # =========================
+@st.fragment(key="gacha")
+@prof.timed("gacha")
 def render_gacha_tab():
     st.title("🎰 出身/性別ガチャ")
 
@@ -629,13 +1021,8 @@ def render_gacha_tab():
         st.subheader("出身国ガチャ")
         mode = st.radio("抽選モード", ["日本に寄せる（推し）", "均等抽選"], horizontal=True)
         if st.button("国を抽選", use_container_width=True):
-            if mode == "均等抽選":
-                st.session_state.gacha_country = random.choice(COUNTRIES)
-            else:
-                names = list(COUNTRIES)
-                weights = [COUNTRY_WEIGHTS[c] for c in names]
-                # random.choices は Python 3.8+ で利用可能
-                st.session_state.gacha_country = random.choices(names, weights=weights, k=1)[0]
+            # 抽選表（エイリアス法）は import 時に作ってあるので、1 回の抽選は O(1)
+            st.session_state.gacha_country = country_table(mode != "均等抽選").draw(st.session_state.rng.gacha)
             # 国が日本でないなら県はリセット
             st.session_state.gacha_pref = None
 
@@ -644,8 +1031,9 @@ def render_gacha_tab():
     with c2:
         st.subheader("出身県ガチャ（日本のみ）")
         disabled = (st.session_state.gacha_country != "日本")
+        pref_mode = st.radio("県の抽選", ["均等抽選", "人口比（令和2年国勢調査）"], horizontal=True, key="gacha_pref_mode")
         if st.button("県を抽選", use_container_width=True, disabled=disabled):
-            st.session_state.gacha_pref = random.choice(PREFECTURES)
+            st.session_state.gacha_pref = prefecture_table(pref_mode != "均等抽選").draw(st.session_state.rng.gacha)
         st.metric("出身県", st.session_state.gacha_pref if (st.session_state.gacha_country == "日本" and st.session_state.gacha_pref) else "-")
 
     st.markdown("---")
@@ -654,7 +1042,7 @@ def render_gacha_tab():
     colG1, colG2 = st.columns([1,2])
     with colG1:
         if st.button("性別を抽選", use_container_width=True):
-            st.session_state.gacha_gender = random.choice(GENDERS)
+            st.session_state.gacha_gender = GENDER_TABLE.draw(st.session_state.rng.gacha)
         st.metric("性別", st.session_state.gacha_gender or "-")
     with colG2:
         st.caption("表記は簡易カテゴリです。卓の方針に合わせて適宜編集してください。")
@@ -666,12 +1054,187 @@ def render_gacha_tab():
     gender = st.session_state.gacha_gender or "-"
     st.code(f"出身国: {country}\n出身県: {pref}\n性別: {gender}", language="text")
 
+    # =========================
+    # まとめて抽選（パーティー / NPC）
+    # =========================
+    st.markdown("---")
+    st.subheader("まとめて抽選（パーティー / NPC）")
+    st.caption("上の国・県の抽選モードで、出身国・出身県・性別を人数分まとめて引きます。")
+    cP1, cP2, cP3 = st.columns([1, 1, 2])
+    with cP1:
+        n_people = int(st.number_input("人数", min_value=1, max_value=100_000, value=4, step=1, key="gacha_party_n"))
+    with cP2:
+        party_size = int(st.number_input("1 組の人数", min_value=1, max_value=1_000, value=4, step=1,
+                                         key="gacha_party_size"))
+    with cP3:
+        unique = st.checkbox("同じ組の日本出身どうしで県を重複させない", key="gacha_party_unique")
+    if st.button("まとめて抽選", use_container_width=True):
+        try:
+            cols = gacha.profiles(st.session_state.rng.gacha, n_people, weighted=mode != "均等抽選",
+                                  population=pref_mode != "均等抽選", unique_prefecture=unique, party_size=party_size)
+        except ValueError as e:
+            st.warning(str(e))
+        else:
+            st.session_state.gacha_party = (party_size, cols)
+    if st.session_state.gacha_party is not None:
+        size, cols = st.session_state.gacha_party
+        n = len(cols["出身国"])
+        st.dataframe({"組": (np.arange(n) // size + 1).tolist(), **cols}, use_container_width=True,
+                     hide_index=True, height=min(400, 38 + 35 * n))
+
+
+# =========================
+# 統計タブ（振り続ける統計）
+# =========================
+# 振るのは MonteCarloRunner のスレッドで、画面は実行中だけ MC_REFRESH 秒ごとにこの部品を描き直します。
+# 描くのは値ごとの件数（TOTAL でも 100 行足らず）と項目ごとの要約だけなので、振った数によらず軽いです。
+# 開始・停止は run_every を切り替えるので、コールバックで st.rerun() を呼んで全体を再実行します。
+MC_REFRESH = 1.0
+
+
+def mc_settings() -> Dict[str, Any]:
+    """今の固定値/モディファイア/適用トグル（StreamStats.settings と比べる形）"""
+    return {"fixed_values": dict(st.session_state.fixed_values), "modifiers": dict(st.session_state.modifiers),
+            "apply_mod": st.session_state.prev_apply_mod}
+
+
+def mc_running() -> bool:
+    runner = st.session_state.mc_runner
+    return runner is not None and runner.running
+
+
+def cb_mc_start():
+    """続きから再開（設定が変わっていれば今の設定で最初から）"""
+    runner = st.session_state.mc_runner
+    if runner is None or runner.stats.settings != mc_settings():
+        if runner is not None:
+            runner.stop()
+        runner = montecarlo.MonteCarloRunner(montecarlo.StreamStats(**mc_settings()), st.session_state.rng.job())
+        st.session_state.mc_runner = runner
+    runner.start()
+    st.rerun()
+
+
+def cb_mc_stop():
+    st.session_state.mc_runner.stop()
+    st.rerun()
+
+
+def cb_mc_reset():
+    st.session_state.mc_runner.stop()
+    st.session_state.mc_runner = None
+    st.rerun()
+
+
+@st.fragment(key="stats", run_every=MC_REFRESH if mc_running() else None)
+@prof.timed("stats")
+def render_stats_tab(visible: bool):
+    runner = st.session_state.mc_runner
+    if not visible:
+        if runner is not None:
+            runner.touch()   # ほかのタブを見ている間も止めない
+        return
+    st.title("📈 振り続ける統計")
+    st.caption("今の固定値・モディファイアで能力値を振り続け、値ごとの頻度を厳密な分布と比べます。"
+               "件数は値ごとに数えるだけなので、何億セット振ってもメモリは増えません。")
+
+    running = mc_running()
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        st.button("開始" if runner is None else "再開", use_container_width=True, disabled=running,
+                  on_click=cb_mc_start, key="mc_start")
+    with c2:
+        st.button("停止", use_container_width=True, disabled=not running, on_click=cb_mc_stop, key="mc_stop")
+    with c3:
+        st.button("リセット", use_container_width=True, disabled=runner is None, on_click=cb_mc_reset, key="mc_reset")
+    if runner is None:
+        st.caption("「開始」を押すと、裏で振り始めます。")
+        return
+    if runner.error is not None:
+        st.error(f"止まりました: {runner.error}")
+    if runner.stats.settings != mc_settings():
+        st.caption("固定値/モディファイアが開始したときと違います。「リセット」してから開始すると今の設定で数えます。")
+
+    key = st.selectbox("項目", montecarlo.STAT_KEYS, key="mc_key")
+    snap = runner.snapshot(key)
+    m1, m2, m3 = st.columns(3)
+    m1.metric("振ったセット数", f"{snap['n']:,}")
+    m2.metric("速さ", f"{snap['rate']:,.0f} セット/秒")
+    m3.metric("メモリ", f"{runner.stats.nbytes():,} B")
+
+    st.bar_chart(snap["hist"], x="値", y=["実測", "理論"], stack=False, height=280)
+    st.dataframe(snap["summary"], use_container_width=True, hide_index=True,
+                 column_config={**{c: st.column_config.NumberColumn(c, format="%.4f")
+                                   for c in ("平均", "理論平均", "標準偏差", "理論SD")},
+                                "z": st.column_config.NumberColumn("z", format="%.2f",
+                                                                   help="(平均 - 理論平均) / (理論SD / √n)"),
+                                "TV": st.column_config.NumberColumn("TV", format="%.2e",
+                                                                    help="全変動距離（実測と理論の差の合計の半分）"),
+                                "χ²/自由度": st.column_config.NumberColumn("χ²/自由度", format="%.3f")})
+    st.dataframe(snap["db"], use_container_width=True, hide_index=True,
+                 column_config={c: st.column_config.NumberColumn(c, format="%.5f") for c in ("実測", "理論")})
+
+    if st.session_state.mc_ticking and not snap["running"]:
+        st.rerun()   # 上限や idle で止まった → 全体を再実行して自動更新を止める
+
+
+# =========================
+# 再実行の計測（デバッグ。計測が有効なときだけページ下部に出す）
+# =========================
+@st.fragment(key="profiler")
+def render_profiler_panel():
+    with st.expander("⏱ 再実行の計測", expanded=True):
+        last = prof.last()
+        if last is None:
+            st.info("まだ記録がありません。操作すると実行ごとの時間がここに出ます。")
+            return
+        import pandas as pd
+
+        st.caption(f"直近 {len(prof.runs):,} 回（最大 {prof.runs.maxlen:,} 回）の実行の区間ごとの時間（ミリ秒）。"
+                   "[app] は全体の再実行、[current] などは部品だけの再実行、export: はダウンロードの書き出しです。"
+                   "部品だけを操作したあとは「更新」で最新の記録を表示します。")
+        summary = pd.DataFrame(prof.summary()).sort_values("p90", ascending=False)
+        st.dataframe(summary, use_container_width=True, hide_index=True,
+                     column_config={c: st.column_config.NumberColumn(c, format="%.2f")
+                                    for c in ("p50", "p90", "p99", "最大")})
+
+        # 状態は snapshot を残した最後の実行から（ダウンロードの書き出しは残さない）
+        snap = next((r for r in reversed(prof.runs) if "counts" in r), None)
+        if snap is not None:
+            counts = snap["counts"]
+            cP1, cP2, cP3, cP4 = st.columns(4)
+            cP1.metric("履歴", f"{counts['history']:,}")
+            cP2.metric("★", f"{counts['favorites']:,}")
+            cP3.metric("リーダーボード", f"{counts['leaderboard']:,}")
+            cP4.metric("セッション状態", f"{snap['state_bytes'] / 2**20:,.2f} MB", help=f"{counts['state_keys']} キー")
+            st.dataframe(pd.DataFrame({"キー": list(snap["state_top"]),
+                                       "KB": [b / 1024 for b in snap["state_top"].values()]}),
+                         use_container_width=True, hide_index=True,
+                         column_config={"KB": st.column_config.NumberColumn("KB", format="%.1f")})
+
+        cR1, cR2, cR3 = st.columns(3)
+        with cR1:
+            st.button("更新", use_container_width=True, key="profile_refresh")
+        with cR2:
+            st.download_button("トレースを JSON でダウンロード", data=prof.to_json, file_name="rerun_trace.json",
+                               mime="application/json", use_container_width=True, key="profile_export")
+        with cR3:
+            st.button("記録を消す", use_container_width=True, on_click=prof.clear, key="profile_clear")
+
 
 # =========================
-# タブ構成（本体 / ガチャ）
+# タブ構成（本体 / ガチャ / 統計）
 # =========================
-TAB_STATUS, TAB_GACHA = st.tabs(["🧮 能力/履歴", "🎰 出身/性別ガチャ"])
-with TAB_STATUS:
-    render_status_tab()
-with TAB_GACHA:
-    render_gacha_tab()
+with prof.run("app", section=False):
+    TAB_STATUS, TAB_GACHA, TAB_STATS = st.tabs(["🧮 能力/履歴", "🎰 出身/性別ガチャ", "📈 統計"],
+                                               key="main_tab", on_change="rerun")
+    with TAB_STATUS:
+        render_status_tab()
+    with TAB_GACHA:
+        render_gacha_tab()
+    with TAB_STATS:
+        st.session_state.mc_ticking = mc_running()
+        render_stats_tab(bool(TAB_STATS.open))
+
+if prof.enabled:
+    render_profiler_panel()
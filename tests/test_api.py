@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("starlette")
+from dicetool.api import app  # noqa: E402
+
+
+def post(path, body):
+    """ASGI で 1 リクエスト送って (status, JSON) を返す（HTTP クライアントなしで動かす）"""
+    raw = json.dumps(body).encode()
+    sent = {"status": None, "body": b""}
+
+    async def receive():
+        return {"type": "http.request", "body": raw, "more_body": False}
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            sent["status"] = msg["status"]
+        elif msg["type"] == "http.response.body":
+            sent["body"] += msg.get("body", b"")
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"content-type", b"application/json")], "client": ("test", 0), "server": ("test", 80)}
+    asyncio.run(app(scope, receive, send))
+    return sent["status"], json.loads(sent["body"], parse_constant=_reject)
+
+
+def _reject(name):
+    raise ValueError(f"JSON に {name} は書けません")
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/roll", {"modifiers": {"STR": 1000}}),
+    ("/roll", {"modifiers": {"STR": -129}}),
+    ("/roll", {"fixed_values": {"STR": 100000}}),
+    ("/roll", {"fixed_values": {"STR": -1}}),
+    ("/roll", {"modifiers": {"STR": True}}),
+    ("/roll", {"modifiers": {"LUCK": 1}}),
+    ("/batch", {"n": 0}),
+    ("/batch", {"n": 10, "expr": "HP >="}),
+    ("/generate", {"n": 1, "auto_min": {"TOTAL": 10 ** 12}}),
+    ("/party", {"k": 0}),
+    ("/party", {"k": 5, "bands": {"TOTAL": -1}}),
+    ("/party", {"keys": ["XYZ"]}),
+    ("/party", {"keys": []}),
+    ("/batch", {"n": 10, "stream": "no"}),
+    ("/roll", {"apply_mod": 1}),
+    ("/gacha", {"kind": "profile", "unique_prefecture": "yes"}),
+    ("/generate", {"n": 1, "expr": "STR > 18"}),
+    ("/generate", {"n": 1, "auto_min": {"TOTAL": 140}}),
+    ("/generate", {"n": 100, "auto_min": {"TOTAL": 110}, "max_rolls": 1000}),
+])
+def test_bad_input_is_400(path, body):
+    status, out = post(path, body)
+    assert status == 400
+    assert out["error"]
+
+
+def test_roll_in_range():
+    status, rec = post("/roll", {"modifiers": {"STR": 127}, "fixed_values": {"DEX": 99}, "seed": 1})
+    assert status == 200
+    assert rec["DEX"] == 99
+
+
+def test_seed_replays():
+    a = post("/batch", {"n": 20, "seed": 5})[1]
+    b = post("/batch", {"n": 20, "seed": 5})[1]
+    assert a["records"] == b["records"]
+
+
+def test_generate_is_strict_json():
+    status, out = post("/generate", {"n": 3, "auto_min": {"TOTAL": 90}, "seed": 2})
+    assert status == 200 and out["complete"] and len(out["records"]) == 3
+    assert out["expected_rolls"] > 0
+
+
+def test_batch_stream_flag():
+    status, out = post("/batch", {"n": 5, "stream": False, "seed": 1})
+    assert status == 200 and len(out["records"]) == 5
@@ -0,0 +1,70 @@
+import warnings
+
+import numpy as np
+
+from dicetool import arrange, batch
+from dicetool.rng import NO_OFFSET, NO_SEED, RollStream
+from dicetool.rules import ABILS
+from dicetool.ruleexpr import compile_score
+from dicetool.store import RecordStore, batch_rows
+
+
+def test_replay_matches_batch():
+    rb = batch.roll_batch(500, rng=RollStream(11))
+    rows = np.array([0, 7, 499, 123, 7])
+    again = batch.replay(rb.seed, rb.offsets[rows])
+    np.testing.assert_array_equal(again.base, rb.base[rows])
+    np.testing.assert_array_equal(again.dice, rb.dice[rows])
+    np.testing.assert_array_equal(again.finals, rb.finals[rows])
+
+
+def test_one_at_a_time_matches_batch():
+    whole = batch.roll_batch(50, rng=RollStream(3))
+    rng = RollStream(3)
+    singles = [batch.roll_batch(1, rng=rng) for _ in range(50)]
+    np.testing.assert_array_equal(np.concatenate([s.base for s in singles]), whole.base)
+    np.testing.assert_array_equal(np.concatenate([s.offsets for s in singles]), whole.offsets)
+
+
+def test_records_replay(tmp_path):
+    rb = batch.roll_batch(200, modifiers={"STR": 2}, rng=RollStream(5))
+    rows = batch_rows(rb, range(200), {"STR": 2}, True, 1)
+    wiped = rows._replace(base=np.zeros_like(rows.base), dice=np.zeros_like(rows.dice) + 1)
+    again = wiped.replayed()
+    np.testing.assert_array_equal(again.base, rb.base)
+    np.testing.assert_array_equal(again.dice, rb.dice)
+
+
+def test_arrange_keeps_replay_for_unmoved_rows():
+    rb = batch.roll_batch(300, rng=RollStream(9))
+    out, moved = arrange.arrange_batch(rb, "職業P + 興味P")
+    assert 0 < moved < 300
+    lost = out.offsets == NO_OFFSET
+    assert lost.sum() == moved
+    assert out.seed == rb.seed
+    np.testing.assert_array_equal(out.offsets[~lost], rb.offsets[~lost])
+    np.testing.assert_array_equal(out.base[~lost], rb.base[~lost])
+
+    store = RecordStore(300)
+    store.extend_batch(out, range(300), {}, True, 1)
+    rows = store.head(300)
+    assert (rows.seeds == NO_SEED).sum() == moved
+    kept = rows.seeds != NO_SEED
+    again = batch.replay(rb.seed, rows.offsets[kept])
+    np.testing.assert_array_equal(again.base, rows.base[kept])
+    recs = batch.to_records(out, range(300), {}, True, 1)
+    assert sum("_seed" not in r for r in recs) == moved
+
+
+def test_arrange_never_picks_zero_division():
+    rb = batch.roll_batch(2_000, rng=RollStream(1))
+    pow_ = ABILS.index("POW")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        out, _moved = arrange.arrange_batch(rb, "TOTAL / (POW - 10)")
+    # POW に 10 以外を置ける行（3d6 の仲間に 10 以外の値がある行）は、どれも POW != 10 になる
+    group = [ABILS.index(a) for a in ("STR", "CON", "POW", "DEX", "APP")]
+    avoidable = (rb.base[:, group] != 10).any(axis=1)
+    assert (out.finals[avoidable, pow_] != 10).all()
+    scores = compile_score("TOTAL / (POW - 10)").values(batch.columns(out.finals))
+    assert np.isfinite(scores[avoidable]).all()
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import pytest
+
+from dicetool.dice import DiceSyntaxError, compile_spec
+
+SPECS = ["3d6", "2d6+6", "4d6kh3", "4d6dl1", "2d20kl1", "2d6r1", "2d6ro1", "d%", "2d6+6 reroll 1s once", "3d6-1d4"]
+
+
+def test_import_does_not_load_numpy():
+    code = ("import sys, dicetool; from dicetool.rules import ABILS; "
+            "[dicetool.roll_effective(a, {}, {a: 0 for a in ABILS}, True) for a in ABILS]; "
+            "print('numpy' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"
+
+
+@pytest.mark.parametrize("src", SPECS)
+def test_range_matches_dist(src):
+    spec = compile_spec(src)
+    dist, total = spec.dist()
+    assert (spec.min, spec.max) == (min(dist), max(dist))
+    assert sum(dist.values()) == total
+
+
+@pytest.mark.parametrize("src", SPECS)
+def test_table_matches_dist(src):
+    spec = compile_spec(src)
+    table = spec.table()
+    if table is None:
+        pytest.skip("表を作らない式")
+    totals, _dice = table
+    dist, total = spec.dist()   # 表の行はどれも等確率
+    got = {int(v): int((totals == v).sum()) for v in set(totals.tolist())}
+    assert {v: c / len(totals) for v, c in got.items()} == pytest.approx({v: c / total for v, c in dist.items()})
+
+
+@pytest.mark.parametrize("src", ["", "3d", "5d6", "1d200", "1d6r1r2r3r4r5r6"])
+def test_syntax_error(src):
+    with pytest.raises(DiceSyntaxError):
+        compile_spec(src)
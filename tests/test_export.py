@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+
+from dicetool import batch, export
+from dicetool.records import make_record
+from dicetool.rng import RollStream
+from dicetool.rules import ABILS
+from dicetool.sqlite_store import SQLiteStore
+from dicetool.store import RecordStore
+
+
+def _fill(store):
+    """シードあり・モディファイアあり/適用なし・固定値・シードなしのレコードを混ぜる"""
+    rb = batch.roll_batch(300, modifiers={"STR": 2, "SIZ": -1}, rng=RollStream(4))
+    store.extend_batch(rb, range(300), {"STR": 2, "SIZ": -1}, True, 1)
+    rb = batch.roll_batch(200, {"INT": 13}, {"DEX": 3}, False, rng=RollStream(5))
+    store.extend_batch(rb, range(200), {"DEX": 3}, False, 301)
+    finals = {a: 10 for a in ABILS}
+    store.append(make_record(finals, finals, {a: [] for a in ABILS}, {a: 0 for a in ABILS}, {}, True, uid=501))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    s = RecordStore(1_000) if request.param == "memory" else SQLiteStore(str(tmp_path / "x.sqlite3"), "history", 1_000)
+    _fill(s)
+    yield s
+    if request.param == "sqlite":
+        s.close()
+
+
+def test_jsonl_matches_make_record(store):
+    f = io.BytesIO()
+    assert export.write(store, "jsonl", f, chunk=64) == len(store) == 501
+    lines = f.getvalue().decode("utf-8").splitlines()
+    assert len(lines) == 501
+    for i, line in enumerate(lines):
+        assert line == json.dumps(store.get(i), ensure_ascii=False)
+    assert "_seed" not in json.loads(lines[0])   # 最後に追加したシードなしのレコード
+    assert "_seed" in json.loads(lines[-1])
+
+
+def test_both_stores_write_the_same_jsonl(tmp_path):
+    memory = RecordStore(1_000)
+    sqlite = SQLiteStore(str(tmp_path / "x.sqlite3"), "history", 1_000)
+    out = []
+    for s in (memory, sqlite):
+        _fill(s)
+        f = io.BytesIO()
+        export.write(s, "jsonl", f)
+        out.append(f.getvalue())
+    sqlite.close()
+    assert out[0] == out[1]
@@ -0,0 +1,90 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from dicetool import gacha
+
+WEIGHTS = [5, 0, 1, 3, 0.5, 8, 2.5]
+
+
+def _table():
+    return gacha.AliasTable([f"c{i}" for i in range(len(WEIGHTS))], WEIGHTS)
+
+
+def test_alias_table_is_exact():
+    """prob / alias から戻した各候補の確率が重みの比と一致する"""
+    for t in (_table(), gacha.COUNTRY_TABLE, gacha.PREFECTURE_POP_TABLE, gacha.GENDER_TABLE):
+        k = len(t)
+        back = t.prob / k
+        np.add.at(back, t.alias, (1 - t.prob) / k)
+        np.testing.assert_allclose(back, t.p, atol=1e-12)
+
+
+def _close(counts, p, n):
+    """件数が期待値から 5 標準偏差以内"""
+    sd = np.sqrt(n * p * (1 - p))
+    assert (np.abs(counts - n * p) <= 5 * sd + 1e-9).all()
+
+
+def test_sample_and_draw_frequencies():
+    t = _table()
+    rng = np.random.default_rng(0)
+    n = 200_000
+    _close(np.bincount(t.sample(rng, n), minlength=len(t)), t.p, n)
+    drawn = Counter(t.draw(rng) for _ in range(20_000))
+    _close(np.array([drawn[c] for c in t.items]), t.p, 20_000)
+
+
+def test_sample_unique():
+    t = _table()
+    rng = np.random.default_rng(1)
+    picks = t.sample_unique(rng, 5, groups=50_000)
+    assert picks.shape == (50_000, 5)
+    assert all(len(set(row)) == 5 for row in picks[:1000].tolist())
+    assert not (picks == 1).any()   # 重み 0 は選ばれない
+    _close(np.bincount(picks[:, 0], minlength=len(t)), t.p, 50_000)   # 1 個目は重みに比例
+    with pytest.raises(ValueError):
+        t.sample_unique(rng, 7)   # 重みが正の候補は 6 個
+
+
+def _groups(out, size):
+    pref = out["出身県"]
+    return [pref[i:i + size] for i in range(0, len(pref), size)]
+
+
+@pytest.mark.parametrize("population", [False, True])
+def test_profiles_unique_prefecture(population):
+    rng = np.random.default_rng(2)
+    n, size = 1003, 40   # 最後の組は 3 人
+    out = gacha.profiles(rng, n, population=population, unique_prefecture=True, party_size=size)
+    assert [len(out[k]) for k in gacha.PROFILE_KEYS] == [n] * 3
+    jp = np.array(out["出身国"]) == "日本"
+    pref = np.array(out["出身県"])
+    assert (pref[~jp] == gacha.NO_PREFECTURE).all()
+    assert np.isin(pref[jp], gacha.PREFECTURES).all()
+    groups = _groups(out, size)
+    assert len(groups[-1]) == 3
+    for g in groups:
+        japanese = [p for p in g if p != gacha.NO_PREFECTURE]
+        assert len(japanese) == len(set(japanese))
+
+
+def test_profiles_uneven_last_group_gets_its_own_picks():
+    """日本出身ばかりの短い最後の組も、ほかの組と独立に重複なしで引く"""
+    seen = Counter()
+    for seed in range(200):
+        out = gacha.profiles(np.random.default_rng(seed), 11, unique_prefecture=True, party_size=4)
+        g = _groups(out, 4)[-1]
+        japanese = [p for p in g if p != gacha.NO_PREFECTURE]
+        assert len(japanese) == len(set(japanese))
+        seen.update(japanese)
+    assert len(seen) > 10
+
+
+def test_profiles_more_than_47_is_an_error():
+    rng = np.random.default_rng(3)
+    with pytest.raises(ValueError):
+        gacha.profiles(rng, 1000, unique_prefecture=True)   # 1 組で日本出身が 200 人ほど
+    out = gacha.profiles(rng, 1000, unique_prefecture=False)
+    assert len(out["出身県"]) == 1000
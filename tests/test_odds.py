@@ -0,0 +1,50 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from dicetool import batch, odds
+from dicetool.rng import RollStream
+from dicetool.rules import ALL_KEYS_FOR_RULE
+
+SETTINGS = [
+    {},
+    {"modifiers": {"STR": 3, "EDU": -2}},
+    {"modifiers": {"STR": 3}, "apply_mod": False},
+    {"fixed_values": {"SIZ": 12, "POW": None}},
+]
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+@pytest.mark.parametrize("key", ALL_KEYS_FOR_RULE)
+def test_key_dist_sums_to_one(key, settings):
+    counts, total = odds._key_dist(key, odds.make_config(**settings))
+    assert sum(counts.values()) == total
+    assert sum(odds.key_dist(key, **settings).values()) == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_db_dist_sums_to_one(settings):
+    assert sum(odds._db_dist(odds.make_config(**settings)).values()) == Fraction(1)
+
+
+def test_and_or_complement():
+    lo = {"HP": 13, "EDU": 15, "TOTAL": 90}
+    none = {k: None for k in lo}
+    p_and = odds.rule_fraction("AND", lo, none)
+    p_or = odds.rule_fraction("OR", lo, none)
+    assert 0 < p_and < p_or < 1
+    below = {k: v - 1 for k, v in lo.items()}   # 全部の否定（どれも下回る）
+    assert p_or == 1 - odds.rule_fraction("AND", none, below)
+
+
+@pytest.mark.parametrize("key", ["TOTAL", "HP", "STR", "職業P"])
+def test_key_dist_matches_sampling(key):
+    n = 200_000
+    cols = batch.columns(batch.roll_batch(n, rng=RollStream(1), with_dice=False).finals)
+    exact = odds.key_dist(key)
+    values, counts = np.unique(cols[key], return_counts=True)
+    assert set(values.tolist()) <= set(exact)
+    tv = 0.5 * sum(abs(c / n - exact.get(int(v), 0.0)) for v, c in zip(values, counts))
+    tv += 0.5 * sum(p for v, p in exact.items() if v not in set(values.tolist()))
+    assert tv < 0.01
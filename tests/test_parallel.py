@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from dicetool import batch
+from dicetool.parallel import roll_parallel
+from dicetool.rng import RollStream
+from dicetool.ruleexpr import compile_rule, compile_score
+
+N, CHUNK = 4_000, 700   # 区間は 6 つ（最後は短い）
+MODS = {"STR": 2}
+
+
+def _run(workers, **kw):
+    return roll_parallel(N, rng=RollStream(9), workers=workers, chunk=CHUNK, modifiers=MODS, **kw)
+
+
+@pytest.mark.parametrize("kw", [
+    {"expr": "TOTAL >= 85", "keep": 10_000},
+    {"expr": "TOTAL >= 85", "keep": 50},
+    {"keep": 30, "score": "職業P + 興味P"},
+])
+def test_workers_agree_and_replay(kw):
+    one, two = _run(1, **kw), _run(2, **kw)
+    assert two.workers == 2
+    assert (one.rolled, one.passed) == (two.rolled, two.passed)
+    for field in ("finals", "base", "dice", "offsets"):
+        np.testing.assert_array_equal(getattr(one.batch, field), getattr(two.batch, field))
+    assert one.batch.seed == two.batch.seed
+
+    rb = one.batch
+    again = batch.replay(rb.seed, rb.offsets, modifiers=MODS)
+    np.testing.assert_array_equal(again.finals, rb.finals)
+    np.testing.assert_array_equal(again.base, rb.base)
+    np.testing.assert_array_equal(again.dice, rb.dice)
+
+    # 1 プロセスで全部振って絞り込んだものと同じ
+    whole = batch.roll_batch(N, modifiers=MODS, rng=RollStream(9))
+    cols = batch.columns(whole.finals)
+    ok = compile_rule(kw["expr"]).mask(cols) if "expr" in kw else np.ones(N, bool)
+    assert one.passed == int(ok.sum())
+    if "score" in kw:
+        s = compile_score(kw["score"]).values(cols)
+        want = np.lexsort((whole.offsets, -s))[:kw["keep"]]
+    else:
+        want = np.flatnonzero(ok)[:kw["keep"]]
+    np.testing.assert_array_equal(rb.offsets, whole.offsets[want])
@@ -0,0 +1,63 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from dicetool import batch, party
+from dicetool.rng import RollStream
+
+
+def _pool(n, seed, keys):
+    rb = batch.roll_batch(n, rng=RollStream(seed))
+    return batch.columns(rb.finals, frozenset(keys))
+
+
+def _brute(cols, k, keys, scale, bands, mask):
+    """すべての k 人の組を数えたときの最小 spread（上限に収まる組がなければ None）"""
+    sel = np.arange(len(cols[keys[0]])) if mask is None else np.flatnonzero(mask)
+    best = None
+    for combo in combinations(sel, k):
+        ranges = {key: int(np.ptp(cols[key][list(combo)])) for key in keys}
+        if any(ranges[key] > w for key, w in bands.items()):
+            continue
+        spread = max(ranges[key] / scale[key] for key in keys)
+        best = spread if best is None else min(best, spread)
+    return best
+
+
+CASES = [
+    # (seed, n, k, keys, bands, members の代わりの mask)
+    (1, 18, 4, party.PARTY_KEYS, {}, None),
+    (2, 20, 3, party.PARTY_KEYS, {"TOTAL": 6}, None),
+    (3, 16, 3, ["STR", "DEX"], {}, "even"),
+    (4, 20, 4, ["TOTAL", "HP"], {"HP": 2, "TOTAL": 10}, "STR"),
+    (5, 15, 5, ["POW", "SAN"], {"POW": 1}, None),
+    (6, 18, 3, party.PARTY_KEYS, {"TOTAL": 0, "HP": 0}, None),   # 収まる組がない
+]
+
+
+@pytest.mark.parametrize("seed, n, k, keys, bands, mask", CASES)
+def test_matches_brute_force(seed, n, k, keys, bands, mask):
+    cols = _pool(n, seed, keys + ["STR"])
+    mask = {None: None, "even": np.arange(n) % 2 == 0, "STR": cols["STR"] >= 9}[mask]
+    scale = party.scales(keys)
+    want = _brute(cols, k, keys, scale, bands, mask)
+    if want is None:
+        with pytest.raises(ValueError):
+            party.find_party(cols, k, keys, scale, bands, mask)
+        return
+    got = party.find_party(cols, k, keys, scale, bands, mask)
+    assert got.spread == pytest.approx(want)
+    assert len(got.rows) == len(set(got.rows.tolist())) == k
+    if mask is not None:
+        assert mask[got.rows].all()
+        assert got.candidates == int(mask.sum())
+    for key in keys:
+        assert got.ranges[key] == np.ptp(cols[key][got.rows])
+        assert got.ranges[key] <= bands.get(key, np.inf)
+
+
+def test_infeasible_case_is_infeasible():
+    seed, n, k, keys, bands, _ = CASES[-1]
+    cols = _pool(n, seed, keys)
+    assert _brute(cols, k, keys, party.scales(keys), bands, None) is None
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from dicetool import batch
+from dicetool.percentile import RARITY, RARITY_SCALE, rarity
+from dicetool.rng import RollStream
+from dicetool.ruleexpr import compile_rule
+from dicetool.sqlite_store import SQLiteStore
+from dicetool.store import RecordStore
+
+
+def _fill(store):
+    """モディファイアの違う行（適用あり/なし）を混ぜる。レア度の表はモディファイアごとに違う"""
+    uid = 1
+    for seed, mods, apply_mod in ((1, {}, True), (2, {"STR": 3, "POW": -2}, True), (3, {"STR": 3}, False),
+                                  (4, {"CON": 1}, True)):
+        rb = batch.roll_batch(400, modifiers=mods, apply_mod=apply_mod, rng=RollStream(seed))
+        store.extend_batch(rb, range(400), mods, apply_mod, uid)
+        uid += 400
+
+
+@pytest.fixture
+def stores(tmp_path):
+    memory = RecordStore(2_000)
+    sqlite = SQLiteStore(str(tmp_path / "x.sqlite3"), "history", 2_000)
+    _fill(memory)
+    _fill(sqlite)
+    yield memory, sqlite
+    sqlite.close()
+
+
+@pytest.mark.parametrize("where", [None, "STR >= 12"])
+@pytest.mark.parametrize("ascending", [False, True])
+def test_rarity_order_matches_between_stores(stores, ascending, where):
+    memory, sqlite = stores
+    rule = None if where is None else compile_rule(where)
+    assert memory.count(rule) == sqlite.count(rule)
+    for offset, limit in ((0, 2_000), (37, 50), (1_590, 100)):
+        a = memory.page(RARITY, ascending, limit, offset, rule)
+        b = sqlite.page(RARITY, ascending, limit, offset, rule)
+        np.testing.assert_array_equal(a["_uid"], b["_uid"])
+        np.testing.assert_array_equal(a[RARITY], b[RARITY])
+
+    page = memory.page(RARITY, ascending, 2_000, 0, rule)
+    step = np.diff(page[RARITY])
+    assert (step >= 0).all() if ascending else (step <= 0).all()
+    rows = memory.take(memory.index_of(page["_uid"].tolist()))
+    key = dict(zip(rows.uids.tolist(), rarity(rows.finals, rows.mods, rows.apply_mod).tolist()))
+    np.testing.assert_allclose(page[RARITY], [key[u] / RARITY_SCALE for u in page["_uid"].tolist()])
@@ -0,0 +1,150 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from dicetool import batch
+from dicetool.rng import RollStream
+from dicetool.rules import ABILS
+from dicetool.ruleexpr import RuleSyntaxError, compile_rule, compile_score
+from dicetool.sqlite_store import SQLiteStore
+
+N = 2_000
+
+RULES = [
+    "TOTAL >= 90",
+    "STR+SIZ >= 30",
+    "DB in {+1D4, +1D6}",
+    "HP >= 14 and (EDU >= 18 or INT >= 17)",
+    "12 <= HP <= 15 and not DB == -1D6",
+    "職業P * 興味P >= 50000",
+    "-職業P * 興味P <= -50000",
+    "TOTAL * TOTAL * TOTAL >= 900000",
+    "(STR + CON) / 2 > DEX",
+    "(STR + CON) // 3 == 9",
+]
+
+
+@pytest.fixture(scope="module")
+def rolled():
+    rb = batch.roll_batch(N, rng=RollStream(7))
+    return rb, batch.columns(rb.finals), batch.to_records(rb, range(N), {}, True)
+
+
+@pytest.fixture(scope="module")
+def store(rolled, tmp_path_factory):
+    rb = rolled[0]
+    s = SQLiteStore(str(tmp_path_factory.mktemp("db") / "rolls.sqlite3"), "history", N)
+    s.extend_batch(rb, range(N), {}, True, 0)
+    yield s
+    s.close()
+
+
+@pytest.mark.parametrize("src", RULES)
+def test_vectorized_matches_scalar(rolled, src):
+    _rb, cols, recs = rolled
+    rule = compile_rule(src)
+    np.testing.assert_array_equal(rule.mask(cols), [rule.test(r) for r in recs])
+
+
+@pytest.mark.parametrize("src", RULES)
+def test_sql_matches_vectorized(rolled, store, src):
+    _rb, cols, _recs = rolled
+    rule = compile_rule(src)
+    assert store.count(rule) == int(rule.mask(cols).sum())
+
+
+def test_product_does_not_overflow(rolled):
+    _rb, cols, recs = rolled
+    rule = compile_rule("職業P * 興味P >= 50000")
+    assert rule.mask(cols).sum() > 0
+    score = compile_score("職業P * 興味P")
+    np.testing.assert_array_equal(score.values(cols), [score.value(r) for r in recs])
+
+
+def test_syntax_error():
+    with pytest.raises(RuleSyntaxError):
+        compile_rule("HP >=")
+    with pytest.raises(RuleSyntaxError):
+        compile_rule("DB + 1 >= 2")
+
+
+ZERO_DIVISION = [
+    "STR // (SIZ - SIZ) >= 1",
+    "STR / (SIZ - SIZ) >= 1",
+    "not (STR / (SIZ - SIZ) >= 1)",
+    "STR / (SIZ - SIZ) >= 1 or TOTAL > 0",
+    "1 / 0 >= 1",
+]
+
+
+@pytest.mark.parametrize("src", ZERO_DIVISION)
+def test_zero_division_is_false_scalar(rolled, src):
+    _rb, _cols, recs = rolled
+    rule = compile_rule(src)
+    assert not any(rule.test(r) for r in recs[:50])
+
+
+@pytest.mark.parametrize("src", ZERO_DIVISION)
+def test_zero_division_is_false_vectorized(rolled, src):
+    _rb, cols, _recs = rolled
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")   # RuntimeWarning も出さない
+        assert not compile_rule(src).mask(cols).any()
+
+
+@pytest.mark.parametrize("src", ZERO_DIVISION)
+def test_zero_division_is_false_sql(store, src):
+    assert store.count(compile_rule(src)) == 0
+
+
+def test_division_by_nonzero_rows_still_match(rolled, store):
+    _rb, cols, recs = rolled
+    rule = compile_rule("100 // (STR - 10) >= 10")   # STR == 10 の行だけ 0 除算
+    mask = rule.mask(cols)
+    assert mask.any() and not mask[cols["STR"] == 10].any()
+    np.testing.assert_array_equal(mask, [rule.test(r) for r in recs])
+    assert store.count(rule) == int(mask.sum())
+
+
+SCORES = [
+    "TOTAL",
+    "職業P * 興味P",
+    "TOTAL / (POW - 10)",
+    "TOTAL // (POW - 10)",
+    "(STR + SIZ) // (EDU - 15) + 100 / (INT - 12)",
+    "1 / 0",
+]
+
+
+def _sql_scores(store, score):
+    cur = store.conn.execute(f"SELECT {score.sql} FROM {store._t} ORDER BY seq DESC")
+    return np.array([r[0] for r in cur.fetchall()], np.float64)
+
+
+@pytest.mark.parametrize("src", SCORES)
+def test_score_backends_agree(rolled, store, src):
+    _rb, cols, recs = rolled
+    score = compile_score(src)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")   # RuntimeWarning も出さない
+        vec = np.asarray(score.values(cols), np.float64)
+    np.testing.assert_allclose(vec, [score.value(r) for r in recs])
+    np.testing.assert_allclose(_sql_scores(store, score), vec)   # extend_batch で rows の先頭が最新
+
+
+def test_score_zero_division_is_worst(rolled):
+    _rb, cols, _recs = rolled
+    vals = compile_score("TOTAL / (POW - 10)").values(cols)
+    assert np.array_equal(np.isneginf(vals), cols["POW"] == 10)
+    assert np.isfinite(vals[cols["POW"] != 10]).all()
+
+
+def test_topk_skips_zero_division():
+    from dicetool.topk import TopK
+
+    rb = batch.roll_batch(N, rng=RollStream(7))
+    top = TopK(5, "TOTAL / (POW - 10)")
+    top.feed_batch(rb, {}, True, 1)
+    assert np.isfinite(top.scores).all()
+    assert (top.rows.finals[:, ABILS.index("POW")] != 10).all()
@@ -0,0 +1,75 @@
+import numpy as np
+
+from dicetool import batch
+from dicetool.rng import RollStream
+from dicetool.sqlite_store import SQLiteStore
+
+
+def _fill(store, n, uid0=1, seed=1):
+    rb = batch.roll_batch(n, rng=RollStream(seed))
+    store.extend_batch(rb, range(n), {}, True, uid0)
+    return rb
+
+
+def test_reopen_keeps_rows(tmp_path):
+    path = str(tmp_path / "rolls.sqlite3")
+    store = SQLiteStore(path, "history", 20)
+    store.resize(1_000)
+    _fill(store, 1_000)
+    uids = store.uids()
+    store.close()
+
+    for capacity in (20, None):   # 画面の新しいセッション / parallel --db
+        store = SQLiteStore(path, "history", capacity)
+        assert len(store) == 1_000
+        assert store.capacity == 1_000
+        np.testing.assert_array_equal(store.uids(), uids)
+        store.close()
+
+
+def test_default_capacity_is_saved(tmp_path):
+    path = str(tmp_path / "rolls.sqlite3")
+    store = SQLiteStore(path, "history", 50)
+    _fill(store, 30)
+    store.close()
+    store = SQLiteStore(path, "history", 20)
+    assert (store.capacity, len(store)) == (50, 30)
+    store.close()
+
+
+def test_old_file_without_capacity_is_not_trimmed(tmp_path):
+    path = str(tmp_path / "rolls.sqlite3")
+    store = SQLiteStore(path, "history", 500)
+    _fill(store, 300)
+    with store.conn:
+        store.conn.execute("DELETE FROM meta")   # 容量を記録していなかった頃のファイル
+    store.close()
+    store = SQLiteStore(path, "history", 20)
+    assert (store.capacity, len(store)) == (300, 300)
+    store.close()
+
+
+def test_rows_round_trip(tmp_path):
+    store = SQLiteStore(str(tmp_path / "rolls.sqlite3"), "favorites", 256, growable=True)
+    rb = _fill(store, 100, uid0=10)
+    rows = store.head(100)   # extend_batch は rows の先頭を最新にする
+    np.testing.assert_array_equal(rows.finals, rb.finals)
+    np.testing.assert_array_equal(rows.base, rb.base)
+    np.testing.assert_array_equal(rows.uids, np.arange(10, 110))
+    store.close()
+
+
+def test_sees_writes_from_other_connections(tmp_path):
+    path = str(tmp_path / "rolls.sqlite3")
+    a = SQLiteStore(path, "favorites", 256, growable=True)
+    b = SQLiteStore(path, "favorites", 256, growable=True)
+    _fill(a, 10)
+    version = b.version
+    _fill(a, 5, uid0=100, seed=2)
+    assert len(b) == 15
+    assert b.version != version
+    assert b.max_uid() == 104
+    b.remove_uids([1, 2])
+    assert len(a) == 13
+    a.close()
+    b.close()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from dicetool.rules import ABILS
+from dicetool.store import RecordStore, sort_order
+
+
+def _model_order(values, ascending):
+    """降順は値の大きい順・同値は新しい順、昇順はそのちょうど逆（values は新しい順）"""
+    order = sorted(range(len(values)), key=lambda i: (-values[i], i))
+    return order[::-1] if ascending else order
+
+
+def _check(store, model):
+    assert len(store) == len(model)
+    np.testing.assert_array_equal(store.uids(), [uid for uid, _ in model])
+    np.testing.assert_array_equal(store.finals().reshape(-1, len(ABILS)),
+                                  np.array([row for _, row in model], np.int16).reshape(-1, len(ABILS)))
+    if not model:
+        return
+    for key, col in (("STR", 0), ("TOTAL", None)):
+        values = [int(row.sum()) if col is None else int(row[col]) for _, row in model]
+        for ascending in (False, True):
+            want = [model[i][0] for i in _model_order(values, ascending)]
+            page = store.page(key, ascending, limit=len(model))
+            assert page["_uid"].tolist() == want
+            page = store.page(key, ascending, limit=3, offset=2)
+            assert page["_uid"].tolist() == want[2:5]
+
+
+@pytest.mark.parametrize("capacity", [1, 2, 5, 16])
+def test_matches_list_model(capacity):
+    """新しい順の list を模型にして、追加・折り返し・削除・容量変更を突き合わせる"""
+    rng = np.random.default_rng(capacity)
+    store, model = RecordStore(capacity), []
+    uid = 0
+    for step in range(300):
+        op = rng.integers(10)
+        if op < 6:      # 追加（容量を超える n も混ぜる）
+            n = int(rng.integers(0, 3 * capacity + 2))
+            finals = rng.integers(3, 19, size=(n, len(ABILS))).astype(np.int16)
+            uids = np.arange(uid, uid + n, dtype=np.int64)
+            uid += n
+            store.extend(finals, finals, None, np.zeros(len(ABILS), np.int8), True, uids)
+            model = ([(int(u), r) for u, r in zip(uids[::-1], finals[::-1])] + model)[:capacity]
+        elif op < 8:    # 削除（ないUIDも混ぜる）
+            drop = set(rng.choice(uid + 3, size=int(rng.integers(0, 4)), replace=False).tolist()) if uid else set()
+            removed = store.remove_uids(drop)
+            assert removed == sum(u in drop for u, _ in model)
+            model = [m for m in model if m[0] not in drop]
+        else:           # 容量変更（減らすときは新しい方を残す）
+            capacity = int(rng.integers(1, 20))
+            store.resize(capacity)
+            assert store.capacity == capacity
+            model = model[:capacity]
+        _check(store, model)
+
+
+def test_sort_order_matches_model():
+    rng = np.random.default_rng(0)
+    for values in (rng.integers(-5, 5, 200), rng.integers(-10**6, 10**6, 50), np.zeros(0, np.int64)):
+        for ascending in (False, True):
+            assert sort_order(values, ascending).tolist() == _model_order(values.tolist(), ascending)